@@ -7,9 +7,17 @@ Available classes:
   - FMFCapture: class for interfacing FlyMovieFormat videos
   - BlockingPlugin: base class for blocking plugins
   - NonBlockingPlugin: base class for non blocking plugins
+  - BatchPlugin: base class for plugins processing batches of frames
+  - ProcessPlugin: base class for plugins running in a worker process
+  - SharedFrame: read-only, reference counted frame shared with threaded
+                 plugins
+  - FrameCache: per-frame cache of derived images (grey, pyramids, blur),
+                passed to plugins as state['FRAME_CACHE']
+  - FrameState: the per-frame state passed to plugins, copy-on-write
 
 Available functions:
   - getLogger: returns the microfview logging.Logger instance
+  - run_batch: runs the same plugins over many recordings on a process pool
 
 Microfview is a minimal implementation of something that is a
 'fview-like' plugin framework. It comes without the whole GUI
@@ -41,9 +49,13 @@ __version__ = "0.1.0"
 import cv2
 
 from .main import Microfview
-from .plugin import BlockingPlugin, NonBlockingPlugin, PluginFinished, PluginChain
+from .plugin import BlockingPlugin, NonBlockingPlugin, BatchPlugin, PluginFinished, PluginChain
+from .process import ProcessPlugin
 from .capture import SeekError, get_capture_object
 from .capture.transform import ImageTransform
+from .frame import FramePool, SharedFrame, FrameCache
+from .state import FrameState
+from .batch import run_batch
 from .util import get_logger, parse_config_file, get_argument_parser, is_color
 from .plugins.display import DisplayPlugin
 
@@ -0,0 +1,182 @@
+"""microfview.batch module
+
+Runs the same plugins over many recordings, one Microfview per file on a
+pool of worker processes, as fast as the files can be decoded.
+
+  >>> def setup(fview, desc):
+  >>>     fview.attach_plugin(MyPlugin())
+  >>> run_batch(['a.fmf', 'b.mp4'], setup, framestore_factory=lambda desc: MyStore(desc + '.csv'))
+
+setup and framestore_factory are called in the worker processes, which
+are forked, so they do not need to be picklable. Plugins are run without
+display and captures without pacing (force_framerate or synth fps).
+The worker processes are daemonic and can therefore not start
+ProcessPlugin workers.
+"""
+import os
+import copy
+import time
+import logging
+import traceback
+import multiprocessing
+
+import cv2
+
+logger = logging.getLogger('microfview.batch')
+
+VIDEO_EXTENSIONS = ('.fmf', '.mp4', '.avi', '.mov', '.mkv')
+
+# set in each worker by _init_worker
+_job = None
+
+
+def expand_captures(paths, extensions=VIDEO_EXTENSIONS):
+    """returns the capture descriptions for paths, replacing directories by
+    the (sorted) video files they contain."""
+    descs = []
+    for p in paths:
+        if os.path.isdir(p):
+            descs.extend(sorted(os.path.join(p, f) for f in os.listdir(p)
+                                if os.path.splitext(f)[1].lower() in extensions))
+        else:
+            descs.append(p)
+    return descs
+
+
+def _is_file(desc):
+    # everything but synthetic captures and devices names a file. without
+    # this check a missing file would open camera 0 instead
+    return not (desc.startswith('synth:') or desc.startswith('/dev/video'))
+
+
+def _init_worker(job, opencv_threads):
+    global _job
+    _job = job
+    if opencv_threads is not None:
+        # the pool already uses every core
+        cv2.setNumThreads(opencv_threads)
+
+
+def _run_one(desc):
+    from .main import Microfview
+    from .capture import get_capture_object
+
+    setup, framestore_factory, config, stop_frame = _job
+    result = {'capture': desc, 'frames': 0, 'time': 0.0, 'fps': 0.0, 'error': None}
+    t0 = time.time()
+    try:
+        if _is_file(desc) and not os.path.isfile(desc):
+            raise IOError('no such file: %s' % desc)
+        cap = get_capture_object(desc, options_dict=copy.deepcopy(config))
+        cap.disable_pacing()
+        fview = Microfview(cap, visible=False, debug=False, stop_frame=stop_frame)
+        if framestore_factory is not None:
+            store = framestore_factory(desc)
+            if store is not None:
+                fview.attach_framestore(store)
+        setup(fview, desc)
+        # run the mainloop on this thread
+        fview.run()
+        result['frames'] = fview.frame_count
+    except Exception:
+        logger.error('%s failed' % desc, exc_info=True)
+        result['error'] = traceback.format_exc()
+    result['time'] = time.time() - t0
+    if result['time'] > 0:
+        result['fps'] = result['frames'] / result['time']
+    return result
+
+
+def run_batch(descs, setup, framestore_factory=None, config=None, workers=None, stop_frame=0, callback=None):
+    """runs Microfview with the same plugins over many captures.
+
+    Args:
+      descs (list): capture descriptions (filenames), see
+        expand_captures for directories.
+      setup (callable): called as setup(fview, desc) to attach the
+        plugins to the Microfview of each capture.
+      framestore_factory (callable, optional): called as
+        framestore_factory(desc), returns the FrameStore for the output
+        of that capture (or None).
+      config (dict, optional): the 'capture' and 'transform' options, as
+        returned by parse_config_file.
+      workers (int, optional): number of processes. Defaults to the
+        number of cores. 1 runs the captures one after the other in
+        this process.
+      stop_frame (int, optional): stop each capture after this many frames.
+      callback (callable, optional): called with the result of each
+        capture as it finishes.
+
+    returns:
+      a dict with the list of per capture results ('results', each a
+      dict of capture, frames, time, fps and error), the total number of
+      frames, the wall time and the aggregate frames per second.
+    """
+    if config is None:
+        config = {'capture': {}, 'transform': {}}
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(int(workers), len(descs) or 1))
+    job = (setup, framestore_factory, config, stop_frame)
+
+    logger.info('processing %d captures on %d processes' % (len(descs), workers))
+    t0 = time.time()
+    results = []
+    if workers == 1:
+        _init_worker(job, None)
+        it = (_run_one(d) for d in descs)
+        pool = None
+    else:
+        # a fresh process per capture so that plugins (and their threads)
+        # do not leak from one file to the next
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(job, 1), maxtasksperchild=1)
+        it = pool.imap_unordered(_run_one, descs)
+    try:
+        for r in it:
+            if r['error'] is None:
+                logger.info('%s: %d frames in %.1fs (%.1f fps)' % (r['capture'], r['frames'], r['time'], r['fps']))
+            results.append(r)
+            if callback is not None:
+                callback(r)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    wall = time.time() - t0
+    frames = sum(r['frames'] for r in results)
+    summary = {'results': results,
+               'frames': frames,
+               'failed': sum(1 for r in results if r['error'] is not None),
+               'time': wall,
+               'fps': frames / wall if wall > 0 else 0.0}
+    logger.info('processed %d frames from %d captures in %.1fs (%.1f fps, %d failed)' % (
+                frames, len(results), wall, summary['fps'], summary['failed']))
+    return summary
+
+
+def _import_name(name):
+    # 'package.module:attribute'
+    module, _, attr = name.partition(':')
+    if not attr:
+        raise ValueError("%r is not of the form module:name" % name)
+    mod = __import__(module, fromlist=[attr])
+    return getattr(mod, attr)
+
+
+def main(argv=None):
+    """entry point of 'micro-fview batch'"""
+    from .util import get_batch_argument_parser, parse_config_file
+    args = get_batch_argument_parser().parse_args(argv)
+    descs = expand_captures(args.captures)
+    if not descs:
+        logger.error('no captures found')
+        return 1
+    setup = _import_name(args.setup)
+    factory = _import_name(args.store) if args.store else None
+    conf = parse_config_file(args.config)
+    summary = run_batch(descs, setup, framestore_factory=factory, config=conf,
+                        workers=args.workers or None, stop_frame=args.stop_frame)
+    print "%d captures, %d frames in %.1fs: %.1f fps" % (len(summary['results']), summary['frames'],
+                                                         summary['time'], summary['fps'])
+    return 1 if summary['failed'] else 0
@@ -0,0 +1,443 @@
+"""microfview.bench module
+
+Benchmarks of the hot paths of microfview, to measure throughput and
+catch regressions:
+
+  capture     grabbing frames from synth, FMF (memory mapped) and
+              OpenCV (video file) captures
+  transform   ImageTransform with roi, scale, grey, mask and all of them
+  plugins     the mainloop with blocking, non-blocking, chained,
+              threaded chain and pipelined chain plugins
+  framestore  the mainloop storing plugin results in framestores
+  display     drawing the special state types onto frames
+  overhead    the framework overhead of the mainloop per frame and per
+              plugin (see measure_overhead)
+
+across frame sizes and plugin counts. Results are frames per second,
+written as JSON and compared against a saved baseline:
+
+  $ micro-fview bench --output bench.json
+  $ micro-fview bench --baseline bench.json
+
+The overhead benchmark runs Microfview on a small SynthCapture (without
+pacing) with 1 and with N DummyPlugins, which do nothing, so that
+
+  per plugin overhead = (t(N) - t(1)) / (N - 1)
+  per frame overhead  = t(1) - per plugin overhead - capture time
+
+where t is the time per frame and the capture time is measured by
+grabbing the same number of frames without the mainloop.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import socket
+import logging
+import argparse
+import tempfile
+
+import cv2
+import numpy as np
+
+from .main import Microfview
+from .plugin import BlockingPlugin, NonBlockingPlugin, PluginChain
+from .store import FrameStore, DetectedObjectType, TrackedObjectType, ContourType, PointArrayType, \
+    DETECTED_OBJECT, TRACKED_OBJECT, CONTOUR, POINT_ARRAY
+from .capture import get_capture_object
+from .capture.transform import ImageTransform
+from .testutils import DummyPlugin
+
+SYNTH_DESC = 'synth:class=dot:fps=0:nframes=%d:size=%s'
+
+
+def _capture_time(frames, size):
+    cam = get_capture_object(SYNTH_DESC % (frames, size))
+    cam.set_grey(True)
+    t0 = time.time()
+    for _ in xrange(frames):
+        cam.grab_next_frame()
+    return time.time() - t0
+
+
+def _mainloop_time(frames, size, nplugins, timed=False):
+    cam = get_capture_object(SYNTH_DESC % (frames, size))
+    fview = Microfview(cam, visible=False, debug=False)
+    for _ in range(nplugins):
+        fview.attach_plugin(DummyPlugin())
+    if timed:
+        fview.attach_metrics()
+    t0 = time.time()
+    # run the mainloop on this thread
+    fview.run()
+    return time.time() - t0, fview.frame_count
+
+
+def measure_overhead(plugins=10, frames=2000, size='64x48', repeats=3, timed=False):
+    """returns a dict of the mainloop overhead (seconds) per frame and per
+    plugin per frame, the best of repeats runs.
+
+    Args:
+      plugins (int): number of DummyPlugins (at least 2).
+      frames (int): frames per run.
+      size (str): frame size, WxH.
+      repeats (int): runs per measurement.
+      timed (bool): attach metrics, so that every plugin is timed.
+    """
+    plugins = max(2, int(plugins))
+    capture = min(_capture_time(frames, size) for _ in range(repeats)) / frames
+    t1 = tn = float('inf')
+    for _ in range(repeats):
+        t, n = _mainloop_time(frames, size, 1, timed)
+        t1 = min(t1, t / n)
+        t, n = _mainloop_time(frames, size, plugins, timed)
+        tn = min(tn, t / n)
+    per_plugin = (tn - t1) / (plugins - 1)
+    return {'plugins': plugins,
+            'frames': frames,
+            'size': size,
+            'timed': timed,
+            'capture_per_frame': capture,
+            'total_per_frame': tn,
+            'per_frame': t1 - per_plugin - capture,
+            'per_plugin': per_plugin,
+            'fps': 1.0 / tn}
+
+
+def format_overhead(r):
+    return ("%d plugins, %d frames of %s%s: %.0f fps\n"
+            "  capture          %6.1f us/frame\n"
+            "  mainloop         %6.1f us/frame\n"
+            "  per plugin       %6.1f us/frame" % (
+                r['plugins'], r['frames'], r['size'], ' (timed)' if r['timed'] else '', r['fps'],
+                r['capture_per_frame'] * 1e6, r['per_frame'] * 1e6, r['per_plugin'] * 1e6))
+
+
+SIZES = ('320x240', '640x480', '1280x1024')
+PLUGIN_COUNTS = (1, 10)
+
+# a benchmark result slower than the baseline by more than this fraction
+# is a regression
+THRESHOLD = 0.1
+
+
+def _size(size):
+    w, h = map(int, size.split('x'))
+    return w, h
+
+
+def _best_fps(func, repeats):
+    # func returns (frames, seconds)
+    best = 0.0
+    for _ in range(repeats):
+        n, t = func()
+        if t > 0:
+            best = max(best, n / t)
+    return best
+
+
+def _write_fmf(path, frames):
+    # an uncompressed version 3 MONO8 FMF movie
+    h, w = frames[0].shape
+    fmt = 'MONO8'
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<II', 3, len(fmt)) + fmt + struct.pack('<III', 8, h, w))
+        f.write(struct.pack('<QQ', 8 + w * h, len(frames)))
+        for i, frame in enumerate(frames):
+            f.write(struct.pack('<d', float(i)))
+            f.write(np.ascontiguousarray(frame, dtype=np.uint8).tostring())
+
+
+def _write_avi(path, frames):
+    h, w = frames[0].shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (w, h))
+    if not writer.isOpened():
+        return False
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    return True
+
+
+def _synth_frames(n, size, grey):
+    cam = get_capture_object(SYNTH_DESC % (n, size))
+    cam.set_grey(grey)
+    return [cam.grab_next_frame().copy() for _ in range(n)]
+
+
+def _grab_all(desc):
+    cam = get_capture_object(desc, options_dict={'capture': {}, 'transform': {}})
+    cam.disable_pacing()
+    n = 0
+    t0 = time.time()
+    try:
+        while True:
+            cam.grab_next_frame()
+            n += 1
+    except EOFError:
+        pass
+    t = time.time() - t0
+    cam.close()
+    return n, t
+
+
+def bench_capture(sizes, frames, repeats, tmpdir):
+    # file captures read a short movie, so the files stay small
+    nfile = min(frames, 50)
+    for size in sizes:
+        yield 'capture:synth:%s' % size, _best_fps(lambda: _grab_all(SYNTH_DESC % (frames, size)), repeats)
+
+        fmf = os.path.join(tmpdir, 'bench-%s.fmf' % size)
+        _write_fmf(fmf, _synth_frames(nfile, size, True))
+        yield 'capture:fmf:%s' % size, _best_fps(lambda: _grab_all(fmf), repeats)
+
+        avi = os.path.join(tmpdir, 'bench-%s.avi' % size)
+        if _write_avi(avi, _synth_frames(nfile, size, False)):
+            yield 'capture:opencv:%s' % size, _best_fps(lambda: _grab_all(avi), repeats)
+        else:
+            logging.getLogger('microfview.bench').warn('can not write MJPG videos, skipping opencv capture')
+
+
+def bench_transform(sizes, frames, repeats, tmpdir):
+    for size in sizes:
+        w, h = _size(size)
+        roi = [((w // 8, h // 8), (w - w // 8, h - h // 8))]
+        mask = [[(0, 0), (w // 4, 0), (0, h // 4)]]
+        variants = (('roi', {'roi': roi}),
+                    ('scale', {'scale': 0.5}),
+                    ('grey', {'grey': True}),
+                    ('mask', {'mask': mask}),
+                    ('all', {'roi': roi, 'scale': 0.5, 'grey': True, 'mask': mask}))
+        img = _synth_frames(1, size, False)[0]
+        for name, config in variants:
+            t = ImageTransform(background=config)
+
+            def run():
+                t0 = time.time()
+                for _ in xrange(frames):
+                    t.transform(img)
+                return frames, time.time() - t0
+            yield 'transform:%s:%s' % (name, size), _best_fps(run, repeats)
+
+
+class _BenchBlocking(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'bench': frame_number}
+
+
+class _BenchNonBlocking(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'bench': frame_number}
+
+
+class _NullFrameStore(FrameStore):
+    uses_color = False
+
+    def store_state(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
+        pass
+
+
+def _run_mainloop(size, frames, plugins, stores=0):
+    cam = get_capture_object(SYNTH_DESC % (frames, size))
+    fview = Microfview(cam, visible=False, debug=False)
+    for attach in plugins:
+        attach(fview)
+    for _ in range(stores):
+        fview.attach_framestore(_NullFrameStore())
+    t0 = time.time()
+    # run the mainloop on this thread
+    fview.run()
+    return fview.frame_count, time.time() - t0
+
+
+_PLUGIN_KINDS = (
+    ('blocking', lambda f: f.attach_plugin(_BenchBlocking())),
+    ('nonblocking', lambda f: f.attach_plugin(_BenchNonBlocking())),
+    ('chain', lambda f: f.attach_plugin(PluginChain(_BenchBlocking(), _BenchBlocking()))),
+    ('threaded_chain', lambda f: f.attach_parallel_plugin(PluginChain(_BenchBlocking(), _BenchBlocking()), threaded=True)),
+    ('pipelined_chain', lambda f: f.attach_parallel_plugin(PluginChain(_BenchBlocking(), _BenchBlocking(), pipelined=True))),
+)
+
+
+def bench_plugins(sizes, frames, repeats, tmpdir, plugin_counts=PLUGIN_COUNTS):
+    for size in sizes:
+        for kind, attach in _PLUGIN_KINDS:
+            for n in plugin_counts:
+                yield 'plugins:%s:%d:%s' % (kind, n, size), \
+                      _best_fps(lambda: _run_mainloop(size, frames, [attach] * n), repeats)
+
+
+def bench_framestore(sizes, frames, repeats, tmpdir):
+    attach = _PLUGIN_KINDS[0][1]
+    for size in sizes:
+        for stores in (0, 5):
+            yield 'framestore:%d:%s' % (stores, size), \
+                  _best_fps(lambda: _run_mainloop(size, frames, [attach] * 5, stores), repeats)
+
+
+def bench_display(sizes, frames, repeats, tmpdir):
+    from .plugins.display import draw_all_state
+    for size in sizes:
+        w, h = _size(size)
+        img = _synth_frames(1, size, False)[0]
+        pts = np.array([[10, 10], [w // 2, 10], [w // 2, h // 2]], dtype=np.int32).reshape((-1, 1, 2))
+        xs = np.arange(0, w, 4, dtype=np.int32)
+        state = {DETECTED_OBJECT: DetectedObjectType(1, w // 3, h // 3),
+                 TRACKED_OBJECT: TrackedObjectType(2, w // 2, h // 2, 0.0),
+                 CONTOUR: ContourType(3, w // 4, h // 4, pts),
+                 POINT_ARRAY: PointArrayType(xs, (xs * h) // w)}
+        for name, M in (('plain', None), ('transformed', np.float32([[0.5, 0, 1], [0, 0.5, 1]]))):
+            def run():
+                t0 = time.time()
+                for _ in xrange(frames):
+                    draw_all_state(img, state, M)
+                return frames, time.time() - t0
+            yield 'display:%s:%s' % (name, size), _best_fps(run, repeats)
+
+
+def bench_overhead(sizes, frames, repeats, tmpdir):
+    for timed in (False, True):
+        r = measure_overhead(10, max(frames, 1000), '64x48', repeats, timed)
+        name = 'overhead:%s' % ('timed' if timed else 'plain')
+        logging.getLogger('microfview.bench').info(format_overhead(r))
+        yield name, r['fps']
+
+
+SUITES = (('capture', bench_capture),
+          ('transform', bench_transform),
+          ('plugins', bench_plugins),
+          ('framestore', bench_framestore),
+          ('display', bench_display),
+          ('overhead', bench_overhead))
+
+
+def run_suite(sizes=SIZES, frames=300, repeats=3, only=None, callback=None):
+    """runs the benchmarks, returns a dict of benchmark name to frames per
+    second.
+
+    Args:
+      sizes (list): frame sizes, WxH.
+      frames (int): frames per run.
+      repeats (int): runs per benchmark, the fastest is reported.
+      only (list, optional): only run benchmarks whose name starts with
+        one of these.
+      callback (callable, optional): called with (name, fps) after each
+        benchmark.
+    """
+    results = {}
+    tmpdir = tempfile.mkdtemp(prefix='microfview-bench-')
+    try:
+        for suite, func in SUITES:
+            if only and not any(o.split(':')[0] == suite for o in only):
+                continue
+            for name, fps in func(sizes, frames, repeats, tmpdir):
+                if only and not any(name.startswith(o) for o in only):
+                    continue
+                results[name] = fps
+                if callback is not None:
+                    callback(name, fps)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
+
+
+def get_environment():
+    """returns a dict describing the machine and versions the benchmarks
+    ran on"""
+    from . import __version__
+    return {'microfview': __version__,
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'host': socket.gethostname(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def save_results(path, results, params=None):
+    with open(path, 'w') as f:
+        json.dump({'environment': get_environment(), 'params': params or {}, 'results': results},
+                  f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """compares results against baseline (both dicts of name to fps).
+
+    returns a list of (name, baseline fps, fps, relative change,
+    regression) for the benchmarks in both, where regression is True if
+    the fps dropped by more than threshold.
+    """
+    out = []
+    for name in sorted(set(results) & set(baseline)):
+        old, new = baseline[name], results[name]
+        change = (new - old) / old if old else 0.0
+        out.append((name, old, new, change, change < -threshold))
+    return out
+
+
+def format_comparison(rows):
+    lines = ['%-40s %12s %12s %8s' % ('benchmark', 'baseline', 'fps', 'change')]
+    for name, old, new, change, regression in rows:
+        lines.append('%-40s %12.1f %12.1f %+7.1f%%%s' % (name, old, new, change * 100,
+                                                      '  REGRESSION' if regression else ''))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """entry point of 'micro-fview bench'"""
+    parser = argparse.ArgumentParser(prog='micro-fview bench')
+    parser.add_argument('only', nargs='*',
+                        help='only run benchmarks whose name starts with these '
+                             '(%s)' % ', '.join(s for s, _ in SUITES))
+    parser.add_argument('--sizes', type=str, default=','.join(SIZES),
+                        help='frame sizes, comma separated WxH')
+    parser.add_argument('--frames', type=int, default=300,
+                        help='frames per run')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='runs per benchmark, the fastest is reported')
+    parser.add_argument('--quick', action='store_true', default=False,
+                        help='one small frame size, fewer frames and runs')
+    parser.add_argument('--output', type=str,
+                        help='write the results to this JSON file')
+    parser.add_argument('--baseline', type=str,
+                        help='compare against the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='flag benchmarks slower than the baseline by more than this fraction')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes.split(',')
+    frames, repeats = args.frames, args.repeats
+    if args.quick:
+        sizes, frames, repeats = sizes[:1], min(frames, 100), 1
+
+    # captures and the mainloop log when they start and stop
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('microfview').setLevel(logging.WARNING)
+    logging.getLogger('microfview.bench').setLevel(logging.INFO)
+
+    def _print(name, fps):
+        print '%-40s %12.1f fps' % (name, fps)
+        sys.stdout.flush()
+    results = run_suite(sizes, frames, repeats, args.only, _print)
+
+    if args.output:
+        save_results(args.output, results, {'sizes': sizes, 'frames': frames, 'repeats': repeats})
+    if args.baseline:
+        rows = compare(results, load_results(args.baseline), args.threshold)
+        print
+        print format_comparison(rows)
+        regressions = [r[0] for r in rows if r[4]]
+        if regressions:
+            print '%d regressions' % len(regressions)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
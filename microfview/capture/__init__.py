@@ -22,6 +22,10 @@ def get_capture_object(desc, cap_fallback=None, options_dict=None):
         use_opencv = capture_options.pop('use_opencv')
     except KeyError:
         use_opencv = True
+    use_mmap = capture_options.pop('use_mmap', True)
+    decode_workers = int(capture_options.pop('decode_workers', 0))
+    prefetch = int(capture_options.pop('prefetch', 0))
+    prefetch_overflow = capture_options.pop('prefetch_overflow', None)
 
     if (not capture_options) and (not desc) and (cap_fallback is not None):
         logging.info('Using provided capture object: %r' % cap_fallback)
@@ -34,9 +38,23 @@ def get_capture_object(desc, cap_fallback=None, options_dict=None):
             from .synth import SynthCapture
             cap = SynthCapture('synth:bg=%s:fps=50' % os.path.abspath(desc))
         elif desc.endswith('.fmf'):
-            logging.info('Opening FMF file using motmot')
-            from .videofmf import FMFCapture
-            cap = FMFCapture(desc, **capture_options)
+            if use_mmap:
+                from .fmfmmap import MmapFMFCapture
+                try:
+                    logging.info('Opening FMF file using mmap')
+                    cap = MmapFMFCapture(desc, **capture_options)
+                except NotImplementedError as e:
+                    logging.info('%s, falling back to motmot' % e)
+            if cap is None:
+                logging.info('Opening FMF file using motmot')
+                # motmot always returns copies
+                capture_options.pop('copy_frames', None)
+                from .videofmf import FMFCapture
+                cap = FMFCapture(desc, **capture_options)
+        elif decode_workers:
+            logging.info('Opening video file using OpenCV on %d processes' % decode_workers)
+            from .parallel import ParallelDecodeCapture
+            cap = ParallelDecodeCapture(desc, workers=decode_workers, **capture_options)
         else:
             logging.info('Opening video file using OpenCV')
             from .opencv import OpenCVCapture
@@ -60,6 +78,13 @@ def get_capture_object(desc, cap_fallback=None, options_dict=None):
         from .cameracamiface import CamifaceCapture
         cap = CamifaceCapture(**capture_options)
 
+    if prefetch > 0:
+        from .prefetch import PrefetchCapture
+        logging.info('Prefetching up to %d frames' % prefetch)
+        # the transform is attached to the prefetching capture so it runs on
+        # the consuming thread, after the frame leaves the ring
+        cap = PrefetchCapture(cap, size=prefetch, overflow=prefetch_overflow)
+
     if transform_options:
         if all(l in transform_options for l in ImageTransform.LAYERS):
             t = ImageTransform(**transform_options)
@@ -89,8 +114,16 @@ class CaptureBase(object):
 
     supports_seeking = False
 
+    supports_frame_skipping = False
+
     filename = None
 
+    # number of frames skipped without decoding because of the frame filter
+    frames_not_decoded = 0
+
+    _frame_index = None
+    _frame_filter = None
+
     @property
     def frame_shape(self):
         return self.frame_width,self.frame_height
@@ -102,6 +135,66 @@ class CaptureBase(object):
     def seek_frame(self, n):
         raise NotImplementedError
 
+    def set_frame_filter(self, func):
+        """Sets a function which is passed the number of the next frame and
+        returns False if that frame is not needed. Captures that support it
+        then skip the frame without decoding it.
+
+        :param func: callable, or None to decode every frame
+        :return: True if frames will be skipped
+        """
+        if not self.supports_frame_skipping:
+            return False
+        self._frame_filter = func
+        return True
+
+    def get_next_framenumber(self):
+        """returns the framenumber of the frame the next grab returns."""
+        raise NotImplementedError
+
+    def skip_next_frame(self):
+        """advances past the next frame without decoding it. returns False at
+        the end of the file."""
+        raise NotImplementedError
+
+    def disable_pacing(self):
+        """deliver frames as fast as possible, ignoring any forced or
+        simulated frame rate. returns True if the capture was paced."""
+        return False
+
+    def set_grey(self, grey):
+        """request single channel (grey) frames instead of colour (BGR)
+        frames. returns True if the capture will produce grey frames."""
+        return False
+
+    def build_frame_index(self):
+        """returns a new FrameIndex of all frames. override this function."""
+        raise NotImplementedError
+
+    def get_frame_index(self):
+        """returns the FrameIndex of this video file, loading it from or
+        building it and saving it to a sidecar file."""
+        if self._frame_index is None:
+            if not self.is_video_file:
+                raise ValueError("Frame index only available on video files")
+            from .index import FrameIndex
+            self._frame_index = FrameIndex.load_or_build(self.filename, self.build_frame_index)
+        return self._frame_index
+
+    def seek_time(self, t):
+        """Seeks to the first frame with a timestamp >= t.
+
+        :param t: timestamp
+        :return: the framenumber seeked to
+        """
+        n = self.get_frame_index().frame_at_time(t)
+        self.seek_frame(n)
+        return n
+
+    def get_frames_between(self, t0, t1):
+        """returns the framenumbers of all frames with t0 <= timestamp <= t1"""
+        return self.get_frame_index().frames_between(t0, t1)
+
     def grab_next_frame_blocking(self):
         raise NotImplementedError
 
@@ -118,6 +211,11 @@ class CaptureBase(object):
         return {}
 
     def grab_next_frame(self):
+        if self._frame_filter is not None:
+            while not self._frame_filter(self.get_next_framenumber()):
+                if not self.skip_next_frame():
+                    break
+                self.frames_not_decoded += 1
         img = self.grab_next_frame_blocking()
         if self.transform is not None:
             return self.transform.transform(img)
@@ -125,4 +223,47 @@ class CaptureBase(object):
 
     def attach_transform(self, t):
         self.transform = t
+        # transforms only need a transform method, cropping is optional
+        get_roi = getattr(t, 'get_roi', None)
+        roi = get_roi() if get_roi is not None else None
+        if roi is not None:
+            actual = self.set_roi(*roi)
+            if actual is None:
+                logger.info('cropping to %r in software' % (roi,))
+            else:
+                logger.info('capture crops to %r for %r' % (actual, roi))
+                t.set_source_roi(*actual)
+
+    def set_frame_pool(self, pool):
+        """draw the frames produced by the transform from pool (a FramePool),
+        so they can be kept by other threads."""
+        if hasattr(self.transform, 'set_frame_pool'):
+            self.transform.set_frame_pool(pool)
+
+    def set_reuse_output(self, reuse):
+        """let the transform write every frame into the same buffer (see
+        ImageTransform.set_reuse_output). returns whether it does."""
+        if hasattr(self.transform, 'set_reuse_output'):
+            return self.transform.set_reuse_output(reuse)
+        return False
+
+    def get_transform_matrix(self):
+        """returns the 2x3 affine matrix mapping frame coordinates to full
+        frame coordinates, or None if the frames are not transformed."""
+        if hasattr(self.transform, 'get_transform_matrix'):
+            return self.transform.get_transform_matrix()
+        return None
+
+    def set_roi(self, x0, y0, x1, y1):
+        """Asks the capture to only deliver the region of the frame between
+        (x0, y0) and (x1, y1), for example by setting the camera hardware ROI.
+
+        :return: the region (x, y, w, h) the capture actually delivers, which
+                 contains the requested region, or None if not supported
+        """
+        return None
+
+    def close(self):
+        """release any resources (threads, files) held by the capture."""
+        pass
 
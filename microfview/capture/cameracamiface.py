@@ -52,6 +52,7 @@ class CamifaceCapture(CaptureBase):
 
         # start the camera and set roi if requested.
         self._cam.start_camera()
+        self._user_roi = roi is not None
         if roi is not None:
             self._cam.set_frame_roi(*roi)
             actual_roi = self._cam.get_frame_roi()
@@ -111,4 +112,23 @@ class CamifaceCapture(CaptureBase):
     def seek_frame(self, n):
         raise ValueError("Seeking not available on video devices")
 
+    def set_roi(self, x0, y0, x1, y1):
+        if self._user_roi:
+            logger.info('not changing the camera roi as it was explicitly set')
+            return None
+        w, h = x1 - x0, y1 - y0
+        try:
+            self._cam.set_frame_roi(x0, y0, w, h)
+        except Exception:
+            logger.warn('could not set camera roi', exc_info=True)
+            return None
+        # the camera may round the roi (e.g. to multiples of 4 pixels)
+        l, t, aw, ah = self._cam.get_frame_roi()
+        if not ((l <= x0) and (t <= y0) and (l + aw >= x1) and (t + ah >= y1)):
+            logger.warn('camera roi %r does not contain %r, using full frame' % ((l, t, aw, ah), (x0, y0, w, h)))
+            self._cam.set_frame_roi(0, 0, self._cam.get_max_width(), self._cam.get_max_height())
+            return None
+        self.frame_width, self.frame_height = aw, ah
+        return l, t, aw, ah
+
 
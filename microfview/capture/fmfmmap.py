@@ -0,0 +1,245 @@
+"""microfview.capture.fmfmmap module
+
+Provides MmapFMFCapture class for FlyMovieFormat videos. The file is
+memory mapped, so frames can be accessed randomly and in bulk as read-only
+numpy views without copying or allocating pixel data.
+
+The capture copies each frame it returns by default, as blocking plugins
+may draw on it. When every plugin is threaded (and so only reads the
+frame) the views are returned as they are. RGB8 frames are converted to
+BGR like the frames of every other capture.
+
+Unlike FMFCapture this does not need motmot, but only uncompressed MONO8,
+RAW8, MONO16 and RGB8 movies are supported.
+"""
+import os.path
+import struct
+import time
+
+import cv2
+import numpy as np
+
+import logging
+
+from . import CaptureBase, SeekError
+
+TIMESTAMP_DTYPE = '<f8'
+
+# format -> (pixel dtype, channels)
+_PIXEL_FORMATS = {
+    'MONO8': ('u1', 1),
+    'MONO16': ('<u2', 1),
+    'RGB8': ('u1', 3),
+}
+
+
+def _pixel_format(fmt, bits_per_pixel):
+    if fmt.startswith('RAW8:'):
+        # bayer images are stored as single channel 8 bit
+        fmt = 'MONO8'
+    try:
+        dtype, channels = _PIXEL_FORMATS[fmt]
+    except KeyError:
+        raise NotImplementedError("FMF format %s not supported" % fmt)
+    if np.dtype(dtype).itemsize * 8 * channels != bits_per_pixel:
+        raise ValueError("FMF format %s with %d bits per pixel is invalid" % (fmt, bits_per_pixel))
+    return dtype, channels
+
+
+class MmapFlyMovie(object):
+
+    def __init__(self, filename, check_integrity=False):
+        """memory mapped, random access reader for FMF files.
+
+        Args:
+          filename (str): fmf filename.
+          check_integrity (bool, optional): warn if the frame count in the
+            header does not match the file size. Defaults to False.
+
+        Frames can be accessed by index or slice via the frames attribute,
+        e.g. movie.frames[1000:2000:5]. Timestamps are available via the
+        timestamps attribute without reading any pixel data.
+        """
+        self._log = logging.getLogger('microfview.capture.MmapFlyMovie')
+
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            version, = struct.unpack('<I', f.read(4))
+            if version == 1:
+                fmt = 'MONO8'
+                bits_per_pixel = 8
+            elif version == 3:
+                format_len, = struct.unpack('<I', f.read(4))
+                fmt = f.read(format_len)
+                bits_per_pixel, = struct.unpack('<I', f.read(4))
+            else:
+                raise ValueError("FMF version %d not supported" % version)
+            height, width = struct.unpack('<II', f.read(8))
+            bytes_per_chunk, = struct.unpack('<Q', f.read(8))
+            n_frames, = struct.unpack('<Q', f.read(8))
+            header_len = f.tell()
+
+        dtype, channels = _pixel_format(fmt, bits_per_pixel)
+        shape = (height, width) if channels == 1 else (height, width, channels)
+
+        chunk_dtype = np.dtype([('timestamp', TIMESTAMP_DTYPE), ('frame', dtype, shape)])
+        if chunk_dtype.itemsize != bytes_per_chunk:
+            raise ValueError("FMF chunk size %d does not match %s frames of %r" % (bytes_per_chunk, fmt, shape))
+
+        # frames which are only partly written (e.g. a recording that is still
+        # in progress or was truncated) are ignored
+        n_complete = (os.path.getsize(filename) - header_len) // bytes_per_chunk
+        if n_frames == 0:
+            n_frames = n_complete
+        elif n_frames > n_complete:
+            if check_integrity:
+                self._log.warn("header claims %d frames but file only contains %d" % (n_frames, n_complete))
+            n_frames = n_complete
+
+        self.version = version
+        self.format = fmt
+        self.bits_per_pixel = bits_per_pixel
+        self.height = height
+        self.width = width
+        self.n_frames = int(n_frames)
+
+        if self.n_frames:
+            self._chunks = np.memmap(filename, dtype=chunk_dtype, mode='r',
+                                     offset=header_len, shape=(self.n_frames,))
+        else:
+            self._chunks = np.zeros((0,), dtype=chunk_dtype)
+
+        # strided views into the mapped file
+        self.frames = self._chunks['frame'].view(np.ndarray)
+        self.timestamps = self._chunks['timestamp'].view(np.ndarray)
+
+    def __len__(self):
+        return self.n_frames
+
+    def get_frame(self, n):
+        """returns frame n and its timestamp."""
+        return self.frames[n], float(self.timestamps[n])
+
+    def get_all_timestamps(self):
+        """returns a copy of the timestamps of all frames."""
+        return np.array(self.timestamps)
+
+    def close(self):
+        # drop the references to the map, it is closed when they are collected
+        self._chunks = self.frames = self.timestamps = None
+
+
+class MmapFMFCapture(CaptureBase):
+
+    supports_seeking = True
+
+    supports_frame_skipping = True
+
+    def __init__(self, filename, check_integrity=False, force_framerate=0, copy_frames=True):
+        """class for reading fmf videos through a memory map.
+
+        Args:
+          filename (str): fmf filename.
+          check_integrity (bool, optional): warn if the fmf file is
+            truncated. Defaults to False.
+          force_framerate (float, optional): forces a maximum framerate.
+            Defaults to 0 (as fast as possible).
+          copy_frames (bool, optional): return a writable copy of each
+            frame instead of a read-only view into the file, unless a frame
+            pool is set (see set_frame_pool). Defaults to True.
+
+        """
+        super(MmapFMFCapture, self).__init__()
+
+        self.movie = MmapFlyMovie(filename, check_integrity)
+
+        self._next_frame = 0
+        self._grey = False
+        self._copy_option = self._copy_frames = bool(copy_frames)
+        self._frame_timestamp = 0.0
+        self._frame_number = -1
+        if force_framerate > 0:
+            self._frame_delay = 1./float(force_framerate)
+        else:
+            self._frame_delay = None
+
+        #CaptureBase attributes
+        self.frame_count = self.movie.n_frames
+        self.frame_width = self.movie.width
+        self.frame_height = self.movie.height
+        self.is_video_file = True
+        self.filename = filename
+
+    @property
+    def frames(self):
+        """all frames of the movie, supports indexing and slicing."""
+        return self.movie.frames
+
+    @property
+    def timestamps(self):
+        """the timestamps of all frames."""
+        return self.movie.timestamps
+
+    def set_grey(self, grey):
+        self._grey = grey and (self.movie.frames.ndim == 4)
+        # single channel movies are always grey
+        return grey
+
+    def set_frame_pool(self, pool):
+        """frames are only shared read-only once a pool is set, so the views
+        into the file are returned without copying them."""
+        super(MmapFMFCapture, self).set_frame_pool(pool)
+        self._copy_frames = self._copy_option and (pool is None)
+
+    def disable_pacing(self):
+        paced = self._frame_delay is not None
+        self._frame_delay = None
+        return paced
+
+    def build_frame_index(self):
+        from .index import FrameIndex
+        return FrameIndex(self.movie.get_all_timestamps())
+
+    def seek_frame(self, n):
+        # seeking to frame_count is allowed, the next grab raises EOFError
+        if not (0 <= n <= self.frame_count):
+            raise SeekError("frame %d out of range [0, %d]" % (n, self.frame_count))
+        self._next_frame = int(n)
+
+    def get_next_framenumber(self):
+        return self._next_frame
+
+    def skip_next_frame(self):
+        if self._next_frame >= self.frame_count:
+            return False
+        self._next_frame += 1
+        return True
+
+    def grab_next_frame_blocking(self):
+        """returns next frame."""
+        n = self._next_frame
+        if n >= self.frame_count:
+            raise EOFError("File ended at frame: %d" % n)
+        frame, self._frame_timestamp = self.movie.get_frame(n)
+        if frame.ndim == 3:
+            # fmf stores RGB, microfview works with BGR. either conversion
+            # returns a new frame
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY if self._grey else cv2.COLOR_RGB2BGR)
+        elif self._copy_frames:
+            frame = frame.copy()
+        self._frame_number = n
+        self._next_frame = n + 1
+        if self._frame_delay is not None:
+            time.sleep(self._frame_delay)
+        return frame
+
+    def get_last_timestamp(self):
+        """returns the timestamp of the last frame."""
+        return self._frame_timestamp
+
+    def get_last_framenumber(self):
+        """returns the framenumber of the last frame."""
+        return self._frame_number
+
+    def close(self):
+        self.movie.close()
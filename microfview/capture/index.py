@@ -0,0 +1,152 @@
+"""microfview.capture.index module
+
+Provides FrameIndex, a timestamp to frame number index for video files
+that is built once and cached in a sidecar file next to the video.
+"""
+import os
+import os.path
+
+import numpy as np
+
+import logging
+logger = logging.getLogger('microfview.capture.index')
+
+SIDECAR_SUFFIX = '.ufvidx.npz'
+
+
+def sidecar_filename(filename):
+    return filename + SIDECAR_SUFFIX
+
+
+def _file_signature(filename):
+    st = os.stat(filename)
+    return np.array([st.st_size, st.st_mtime], dtype=np.float64)
+
+
+class FrameIndex(object):
+
+    VERSION = 2
+
+    def __init__(self, timestamps, **extra):
+        """timestamp index of all frames in a video.
+
+        Args:
+          timestamps (array): the timestamp of every frame, indexed by
+            frame number.
+          extra: additional arrays stored with (and loaded from) the index.
+
+        Lookups use binary search. Timestamps do not need to be monotonic,
+        if they are not a sorted copy is kept for searching.
+        """
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.extra = dict((k, np.asarray(v)) for k, v in extra.items())
+
+        if len(self.timestamps) and np.any(np.diff(self.timestamps) < 0):
+            self._order = np.argsort(self.timestamps, kind='mergesort')
+            self._sorted = self.timestamps[self._order]
+        else:
+            self._order = None
+            self._sorted = self.timestamps
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _frame_numbers(self, i0, i1):
+        if self._order is None:
+            return np.arange(i0, i1)
+        return np.sort(self._order[i0:i1])
+
+    def frame_at_time(self, t):
+        """returns the number of the first frame with a timestamp >= t.
+
+        If t is after the last frame, the last frame is returned.
+        """
+        if not len(self):
+            raise ValueError("index is empty")
+        i = min(int(np.searchsorted(self._sorted, t, side='left')), len(self) - 1)
+        return i if self._order is None else int(self._order[i])
+
+    def frames_between(self, t0, t1):
+        """returns the numbers of all frames with t0 <= timestamp <= t1."""
+        i0 = int(np.searchsorted(self._sorted, t0, side='left'))
+        i1 = int(np.searchsorted(self._sorted, t1, side='right'))
+        return self._frame_numbers(i0, max(i0, i1))
+
+    def get_timestamp(self, n):
+        return float(self.timestamps[n])
+
+    def frame_with_time(self, t):
+        """returns the number of the frame with timestamp t, or None if no
+        frame is within half a frame interval of t."""
+        if not len(self):
+            return None
+        i = int(np.searchsorted(self._sorted, t, side='left'))
+        best = None
+        for j in (i - 1, i):
+            if 0 <= j < len(self) and ((best is None) or abs(self._sorted[j] - t) < abs(self._sorted[best] - t)):
+                best = j
+        if len(self) > 1:
+            tol = 0.5 * np.median(np.diff(self._sorted))
+        else:
+            tol = 0.0
+        if abs(self._sorted[best] - t) > max(tol, 1e-6):
+            return None
+        return best if self._order is None else int(self._order[best])
+
+    @property
+    def keyframes(self):
+        """sorted frame numbers of the keyframes, or None if unknown"""
+        return self.extra.get('keyframes')
+
+    def keyframe_before(self, n):
+        """returns the last keyframe <= n, or None if keyframes are unknown"""
+        kf = self.keyframes
+        if kf is None or not len(kf):
+            return None
+        i = int(np.searchsorted(kf, n, side='right')) - 1
+        return int(kf[i]) if i >= 0 else 0
+
+    def save(self, filename, source=None):
+        """saves the index, optionally recording the signature (size and
+        modification time) of the source video it was built from."""
+        arrays = dict(('extra_%s' % k, v) for k, v in self.extra.items())
+        arrays['version'] = np.array([self.VERSION])
+        arrays['timestamps'] = self.timestamps
+        if source is not None:
+            arrays['source'] = _file_signature(source)
+        # np.savez appends .npz to names without it, so write via a file object
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp, filename)
+
+    @classmethod
+    def load(cls, filename, source=None):
+        """loads an index. returns None if it does not exist, is from another
+        version or is stale with respect to the source video."""
+        try:
+            with np.load(filename) as dat:
+                if int(dat['version'][0]) != cls.VERSION:
+                    return None
+                if source is not None:
+                    if ('source' not in dat.files) or (not np.array_equal(dat['source'], _file_signature(source))):
+                        return None
+                extra = dict((k[6:], dat[k]) for k in dat.files if k.startswith('extra_'))
+                return cls(dat['timestamps'], **extra)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    @classmethod
+    def load_or_build(cls, source, build_func):
+        """returns the cached index for the video file source, calling
+        build_func() to build (and then cache) it if needed."""
+        fn = sidecar_filename(source)
+        idx = cls.load(fn, source=source)
+        if idx is None:
+            logger.info('building frame index for %s' % source)
+            idx = build_func()
+            try:
+                idx.save(fn, source=source)
+            except (IOError, OSError) as e:
+                logger.warn('could not cache frame index: %s' % e)
+        return idx
@@ -5,12 +5,22 @@ Provides FMFCapture class for FlyMovieFormat videos.
 
 import logging
 import os.path
+import threading
 
 import cv2
 import numpy as np
 
+try:
+    import av
+except ImportError:
+    av = None
+
 from . import CaptureBase, SeekError
 
+_POS_MSEC = getattr(cv2,"CAP_PROP_POS_MSEC",0)
+_POS_FRAMES = getattr(cv2,"CAP_PROP_POS_FRAMES",1)
+_CONVERT_RGB = getattr(cv2,"CAP_PROP_CONVERT_RGB",16)
+
 def decode_4cc(capture):
     prop = getattr(cv2,'CAP_PROP_FOURCC',6) #keep compat with OpenCV < 3.0
     fourcc = int(capture.get(prop))
@@ -49,6 +59,17 @@ class OpenCVCapture(CaptureBase):
 
         self._frame_timestamp = 0.0
         self._frame_number = -1
+        # the number of the frame the next read returns. for files we track
+        # this ourselves as opencv's position is not trustworthy after seeking
+        self._next_frame = 0
+        # True if a seek already grabbed the frame the next read returns
+        self._grabbed = False
+        # builds the frame index after the first seek, see seek_frame
+        self._index_thread = None
+        self._built_index = None
+        self._grey = False
+        # the raw frames are not grey, so decoded BGR frames are converted
+        self._convert_grey = False
 
         self._log.info('%s format: %s' % ("file" if is_file else "device",
                                           decode_4cc(self._capture)))
@@ -62,7 +83,9 @@ class OpenCVCapture(CaptureBase):
             self.frame_count = self._capture.get(getattr(cv2,"CAP_PROP_FRAME_COUNT",7))
             self.filename = os.path.abspath(identifier)
             self.supports_seeking = True
-            self._log.warn("seeking is not reliable on some videos in opencv")
+            self.supports_frame_skipping = True
+            if av is None:
+                self._log.info("PyAV not installed, keyframe positions will not be indexed")
         self.noncritical_errors = VideoDeviceReadError,
 
         if np.isnan(self.fps):
@@ -70,14 +93,18 @@ class OpenCVCapture(CaptureBase):
 
     def grab_next_frame_blocking(self):
         """returns next frame."""
-        #opencv post increments, so get these first
-        ms = self._capture.get(getattr(cv2,"CAP_PROP_POS_MSEC",0))
-        fn = self._capture.get(getattr(cv2,"CAP_PROP_POS_FRAMES",1))
+        #opencv post increments the frame position, so get it first
+        fn = self._capture.get(_POS_FRAMES)
+        frame_number = self._next_frame if self.is_video_file else int(fn)
 
-        frame_timestamp = ms/1000.
-        frame_number = int(fn)
+        if self._grabbed:
+            self._grabbed = False
+            flag, frame = self._capture.retrieve()
+        else:
+            flag, frame = self._capture.read()
 
-        flag, frame = self._capture.read()
+        #but the position in ms is that of the frame just read
+        frame_timestamp = self._capture.get(_POS_MSEC)/1000.
 
         if not flag:
             if self.is_video_file:
@@ -86,34 +113,244 @@ class OpenCVCapture(CaptureBase):
                 if frame_number >= self.frame_count:
                     raise EOFError("File ended at frame: %d" % frame_number)
                 #the frame didn't advance - truncated file
-                fn2 = self._capture.get(getattr(cv2,"CAP_PROP_POS_FRAMES",1))
+                fn2 = self._capture.get(_POS_FRAMES)
                 if (fn > 0) and (fn == fn2):
                     raise EOFError("Truncated file at at frame: %d" % frame_number)
             raise VideoDeviceReadError
 
         self._frame_timestamp = frame_timestamp
         self._frame_number = frame_number
+        self._next_frame = frame_number + 1
+
+        if self._grey:
+            frame = self._raw_to_grey(frame)
 
         return frame
 
+    def _raw_to_grey(self, frame):
+        if self._convert_grey:
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if frame.ndim == 3 and frame.shape[:2] == (self.frame_height, self.frame_width):
+            if frame.shape[2] == 2:
+                # packed YUYV, the Y (luma) channel is the grey image
+                return frame[:,:,0]
+            elif frame.shape[2] == 1:
+                return frame[:,:,0]
+        elif frame.ndim == 2 and frame.shape == (self.frame_height, self.frame_width):
+            return frame
+        # the backend gave us something we don't understand, go back to BGR
+        # and convert every frame, starting with this one
+        self._log.warn("device does not provide raw grey frames (shape %r), converting" % (frame.shape,))
+        self._convert_grey = True
+        if not (frame.ndim == 3 and frame.shape[2] == 3):
+            self._capture.set(_CONVERT_RGB, 1)
+            flag, frame = self._capture.retrieve()
+            if not flag:
+                raise VideoDeviceReadError
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    def get_next_framenumber(self):
+        return self._next_frame
+
+    def skip_next_frame(self):
+        # grab without retrieve skips the colour conversion and copy
+        if not self._grab():
+            return False
+        self._next_frame += 1
+        return True
+
+    def set_grey(self, grey):
+        if self.is_video_file:
+            # the ffmpeg backend always decodes files to BGR
+            return False
+        # ask the device for its raw format, which for the common YUYV
+        # cameras contains the grey image as the luma channel
+        if not self._capture.set(_CONVERT_RGB, 0 if grey else 1):
+            return False
+        self._grey = bool(grey)
+        self._convert_grey = False
+        return self._grey
+
+    def _scan_packets(self):
+        # demux (but don't decode) the file to find the presentation time of
+        # every frame and which frames are keyframes
+        container = av.open(self._identifier)
+        try:
+            stream = container.streams.video[0]
+            pts = []
+            keyframe = []
+            for packet in container.demux(stream):
+                if packet.pts is None:
+                    # flushing packets
+                    continue
+                pts.append(packet.pts)
+                keyframe.append(packet.is_keyframe)
+            start = stream.start_time or 0
+            time_base = float(stream.time_base)
+        finally:
+            container.close()
+        # packets arrive in decode order, frames are numbered in presentation order
+        order = np.argsort(pts, kind='mergesort')
+        timestamps = (np.asarray(pts, dtype=np.float64)[order] - start) * time_base
+        keyframes = np.flatnonzero(np.asarray(keyframe, dtype=bool)[order])
+        return timestamps, keyframes
+
+    def build_frame_index(self):
+        """scans the whole file to find the timestamp of every frame and,
+        if PyAV is installed, the keyframes"""
+        from .index import FrameIndex
+        if av is not None:
+            try:
+                timestamps, keyframes = self._scan_packets()
+                return FrameIndex(timestamps, keyframes=keyframes)
+            except Exception:
+                self._log.warn("could not index keyframes with PyAV", exc_info=True)
+        # grab does not convert the frame so this is faster than reading
+        cap = cv2.VideoCapture(self._identifier)
+        try:
+            timestamps = []
+            while cap.grab():
+                timestamps.append(cap.get(_POS_MSEC)/1000.)
+        finally:
+            cap.release()
+        return FrameIndex(timestamps)
+
+    def _build_index_in_background(self):
+        from .index import FrameIndex
+        try:
+            self._built_index = FrameIndex.load_or_build(self.filename, self.build_frame_index)
+        except Exception:
+            self._log.warn("could not build the frame index", exc_info=True)
+
+    def _available_frame_index(self):
+        # returns the frame index if it is cached or built, otherwise starts
+        # building it in the background and returns None
+        if (self._frame_index is None) and (self._index_thread is None):
+            from .index import FrameIndex, sidecar_filename
+            self._frame_index = FrameIndex.load(sidecar_filename(self.filename), source=self.filename)
+            if self._frame_index is None:
+                self._index_thread = threading.Thread(target=self._build_index_in_background,
+                                                      name='FrameIndex(%s)' % os.path.basename(self.filename))
+                self._index_thread.daemon = True
+                self._index_thread.start()
+        if (self._index_thread is not None) and self._index_thread.is_alive():
+            return None
+        return self.get_frame_index()
+
+    def get_frame_index(self):
+        if self._index_thread is not None:
+            self._index_thread.join()
+            self._index_thread = None
+            if self._frame_index is None:
+                self._frame_index = self._built_index
+        idx = super(OpenCVCapture, self).get_frame_index()
+        # the frame count reported by opencv is only an estimate
+        self.frame_count = len(idx)
+        return idx
+
+    def _grab(self):
+        # grab the next frame, unless a seek already did
+        if self._grabbed:
+            self._grabbed = False
+            return True
+        return self._capture.grab()
+
+    def _reopen(self):
+        self._capture.release()
+        self._capture = cv2.VideoCapture(self._identifier)
+        self._next_frame = 0
+        self._grabbed = False
+
+    def _skip_to(self, n):
+        # decode forward without converting the frames
+        while self._next_frame < n:
+            if not self._grab():
+                raise SeekError("could not decode frame %d" % self._next_frame)
+            self._next_frame += 1
+
+    def _grab_at(self, idx, k):
+        # seek opencv to frame k, grab it and return which frame we actually
+        # landed on (according to its timestamp) or None if unknown
+        self._grabbed = False
+        self._capture.set(_POS_FRAMES, k)
+        if not self._capture.grab():
+            return None
+        return idx.frame_with_time(self._capture.get(_POS_MSEC)/1000.)
+
     def seek_frame(self, n):
         """Seeks to the given frame in the files.
 
-        Seeking on random videos is generally risky, so we do some sanity checking.
-        Seeking to n=0 reopens the file (if this wraps a video file)
+        Seeking is made exact using the frame index (see get_frame_index),
+        which is cached next to the file. We seek opencv to the nearest
+        keyframe (or frame, if keyframes are unknown) before n, check where
+        it landed from the frame timestamp and then decode forward to n. If
+        opencv lands after n we seek further back. Seeking to n=0 reopens
+        the file.
+
+        Until the index is available (it is built in the background, starting
+        with the first seek) we decode forward to n instead, from the start
+        of the file if n is behind us, rather than scanning the whole file.
 
         :param n: framenumber
-        :return: np.array
         """
-        if self.is_video_file:
-            if n == 0:
-                self._capture.release()
-                self._capture = cv2.VideoCapture(self._identifier)
-            else:
-                self._capture.set(getattr(cv2,"CAP_PROP_POS_FRAMES",1), n)
-        else:
+        if not self.is_video_file:
             raise ValueError("Seeking not available on video devices")
 
+        idx = self._available_frame_index()
+        if idx is None:
+            if n < 0:
+                raise SeekError("frame %d out of range" % n)
+            if n < self._next_frame:
+                self._reopen()
+            self._skip_to(n)
+            return
+
+        if not (0 <= n <= len(idx)):
+            raise SeekError("frame %d out of range [0, %d]" % (n, len(idx)))
+
+        keyframe = idx.keyframe_before(n)
+        if keyframe is None:
+            # without keyframes only decode forward for up to a second of video
+            keyframe = n - (int(self.fps) if self.fps > 0 else 1)
+
+        if keyframe <= self._next_frame <= n:
+            # cheaper to decode forward from here than to seek
+            self._skip_to(n)
+            return
+
+        if n == 0:
+            self._reopen()
+            return
+
+        if (idx.keyframes is not None) and (keyframe == n):
+            # seeking to a keyframe is usually reliable, but check where we
+            # landed like below. the next read retrieves the grabbed frame
+            landed = self._grab_at(idx, n)
+            if landed == n:
+                self._next_frame = n
+                self._grabbed = True
+                return
+            if (landed is not None) and (landed < n):
+                self._next_frame = landed + 1
+                self._skip_to(n)
+                return
+            self._log.debug("seek to keyframe %d landed at %s, seeking further back" % (n, landed))
+
+        target = min(max(keyframe, 0), n - 1)
+        back = max(n - target, 1)
+        while target > 0:
+            landed = self._grab_at(idx, target)
+            if (landed is not None) and (landed < n):
+                self._next_frame = landed + 1
+                self._skip_to(n)
+                return
+            self._log.debug("seek to %d landed at %s, seeking further back" % (target, landed))
+            target = max(target - back, 0)
+            back *= 2
+
+        self._reopen()
+        self._skip_to(n)
+
     def get_last_timestamp(self):
         """returns the timestamp of the last frame."""
         return self._frame_timestamp
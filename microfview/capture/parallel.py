@@ -0,0 +1,259 @@
+"""microfview.capture.parallel module
+
+Provides ParallelDecodeCapture class, which decodes a video file in
+segments on a pool of worker processes for offline analysis. Decoded
+frames are passed back through shared memory and delivered in order.
+"""
+import ctypes
+import multiprocessing
+import multiprocessing.sharedctypes
+import Queue
+
+import numpy as np
+
+import logging
+
+from . import CaptureBase, SeekError
+from .opencv import OpenCVCapture
+
+
+def _decode_worker(filename, shm, shape, tasks, results):
+    frames = np.frombuffer(shm, dtype=np.uint8).reshape(shape)
+    cap = OpenCVCapture(filename, is_file=True)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        generation, seg, start, count, slot = task
+        timestamps = []
+        error = None
+        eof = False
+        try:
+            cap.seek_frame(start)
+            for i in range(count):
+                frames[slot, i] = cap.grab_next_frame_blocking()
+                timestamps.append(cap.get_last_timestamp())
+        except Exception as e:
+            # opencv also reports frames it fails to decode as the end of
+            # the file, the index says whether it really ended
+            error = repr(e)
+            eof = isinstance(e, EOFError)
+        results.put((generation, seg, slot, timestamps, error, eof))
+    cap.close()
+
+
+class ParallelDecodeCapture(CaptureBase):
+
+    supports_seeking = True
+
+    def __init__(self, filename, workers=None, segment_length=None):
+        """class for decoding video files on multiple processes.
+
+        The file is split into segments of at most segment_length
+        consecutive frames (starting on keyframes where possible) which are
+        decoded by a pool of worker processes into shared memory. Memory
+        for workers + 1 segments is allocated.
+
+        Args:
+          filename (str): video filename.
+          workers (int, optional): number of decoding processes. Defaults
+            to the number of cpus.
+          segment_length (int, optional): maximum number of frames per
+            segment. Defaults to 64.
+
+        """
+        super(ParallelDecodeCapture, self).__init__()
+
+        self._log = logging.getLogger('microfview.capture.ParallelDecodeCapture')
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, int(workers))
+        if segment_length is None:
+            segment_length = 64
+        segment_length = max(1, int(segment_length))
+
+        # the index gives exact frame counts and segment boundaries, and is
+        # cached so that the workers can load it instead of rebuilding it
+        cap = OpenCVCapture(filename, is_file=True)
+        idx = cap.get_frame_index()
+        frame = cap.grab_next_frame_blocking()
+        cap.close()
+
+        if idx.keyframes is None:
+            self._log.warn('keyframe positions unknown (PyAV not installed), every worker '
+                           'decodes and throws away the frames before each of its segments')
+        self._segments = self._split(len(idx), idx.keyframes, segment_length)
+        nslots = workers + 1
+        shape = (nslots, segment_length) + frame.shape
+        nbytes = int(np.prod(shape))
+        self._log.info('decoding %d segments on %d processes (%.0f MB shared memory)' % (
+                       len(self._segments), workers, nbytes / 1e6))
+
+        self._shm = multiprocessing.sharedctypes.RawArray(ctypes.c_uint8, nbytes)
+        self._frames = np.frombuffer(self._shm, dtype=np.uint8).reshape(shape)
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._workers = []
+        for i in range(workers):
+            p = multiprocessing.Process(target=_decode_worker,
+                                        args=(filename, self._shm, shape, self._tasks, self._results))
+            p.daemon = True
+            p.start()
+            self._workers.append(p)
+
+        self._free_slots = range(nslots)
+        self._generation = 0
+        self._next_submit = 0
+        self._done = {}
+        self._current = None
+        self._seg = -1
+        self._i = 0
+
+        self._frame_timestamp = 0.0
+        self._frame_number = -1
+
+        #CaptureBase attributes
+        self.fps = cap.fps
+        self.frame_count = len(idx)
+        self.frame_width = frame.shape[1]
+        self.frame_height = frame.shape[0]
+        self.is_video_file = True
+        self.filename = cap.filename
+        self._frame_index = idx
+
+        self._submit()
+
+    @staticmethod
+    def _split(n_frames, keyframes, segment_length):
+        # segments end before the last keyframe within segment_length frames,
+        # so that workers start decoding at a keyframe. long GOPs are split
+        # anyway, and without keyframes every segment is split at
+        # segment_length. the worker then decodes from the preceding
+        # keyframe (or up to a second before) and throws those frames away
+        if keyframes is None:
+            keyframes = ()
+        keyframes = sorted(int(k) for k in keyframes)
+        segments = []
+        start = 0
+        i = 0
+        while start < n_frames:
+            end = min(start + segment_length, n_frames)
+            while (i < len(keyframes)) and (keyframes[i] <= start):
+                i += 1
+            j = i
+            while (j < len(keyframes)) and (keyframes[j] <= end):
+                j += 1
+            if (end < n_frames) and (j > i):
+                end = keyframes[j - 1]
+            segments.append((start, end - start))
+            start = end
+        return segments
+
+    def _submit(self):
+        while self._free_slots and self._next_submit < len(self._segments):
+            seg = self._next_submit
+            start, count = self._segments[seg]
+            self._tasks.put((self._generation, seg, start, count, self._free_slots.pop()))
+            self._next_submit += 1
+
+    def _wait_segment(self, seg):
+        while seg not in self._done:
+            try:
+                generation, s, slot, timestamps, error, eof = self._results.get(timeout=1.0)
+            except Queue.Empty:
+                if not any(p.is_alive() for p in self._workers):
+                    raise EOFError("decoding processes died")
+                continue
+            if generation != self._generation:
+                # result of a segment requested before a seek
+                self._free_slots.append(slot)
+                self._submit()
+                continue
+            if error is not None:
+                start, count = self._segments[s]
+                if not (eof and (s == len(self._segments) - 1)):
+                    # the frames are in the index, don't silently truncate the file
+                    raise IOError("error decoding frame %d: %s" % (start + len(timestamps), error))
+                self._log.warn("file ended at frame %d, before the end of the index: %s" % (
+                               start + len(timestamps), error))
+            self._done[s] = (slot, timestamps)
+        return self._done.pop(seg)
+
+    def seek_frame(self, n):
+        if not (0 <= n <= self.frame_count):
+            raise SeekError("frame %d out of range [0, %d]" % (n, self.frame_count))
+        # free the slot of the current segment and ignore all outstanding results
+        if self._current is not None:
+            self._free_slots.append(self._current[0])
+        for slot, _ in self._done.values():
+            self._free_slots.append(slot)
+        self._done = {}
+        self._generation += 1
+        # take back the segments no worker has started on yet
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except Queue.Empty:
+                break
+            self._free_slots.append(task[-1])
+
+        self._current = None
+        if n == self.frame_count:
+            # the next grab raises EOFError
+            self._next_submit = len(self._segments)
+            self._seg = len(self._segments) - 1
+            return
+
+        seg = 0
+        while (seg < len(self._segments) - 1) and (self._segments[seg + 1][0] <= n):
+            seg += 1
+        self._next_submit = seg
+        self._submit()
+
+        # skip into the segment
+        self._current = self._wait_segment(seg)
+        self._seg = seg
+        self._i = n - self._segments[seg][0]
+
+    def grab_next_frame_blocking(self):
+        """returns next frame."""
+        while (self._current is None) or (self._i >= len(self._current[1])):
+            if self._current is not None:
+                start, count = self._segments[self._seg]
+                if len(self._current[1]) < count:
+                    raise EOFError("File ended at frame: %d" % (start + len(self._current[1])))
+                self._free_slots.append(self._current[0])
+                self._current = None
+                self._submit()
+            if self._seg + 1 >= len(self._segments):
+                raise EOFError("File ended at frame: %d" % self.frame_count)
+            self._seg += 1
+            self._current = self._wait_segment(self._seg)
+            self._i = 0
+
+        slot, timestamps = self._current
+        # copy the frame out of shared memory as the slot is reused once the
+        # segment has been consumed
+        frame = self._frames[slot, self._i].copy()
+        self._frame_timestamp = timestamps[self._i]
+        self._frame_number = self._segments[self._seg][0] + self._i
+        self._i += 1
+        return frame
+
+    def get_last_timestamp(self):
+        """returns the timestamp of the last frame."""
+        return self._frame_timestamp
+
+    def get_last_framenumber(self):
+        """returns the framenumber of the last frame."""
+        return self._frame_number
+
+    def close(self):
+        for p in self._workers:
+            self._tasks.put(None)
+        for p in self._workers:
+            p.join(1.0)
+            if p.is_alive():
+                p.terminate()
+        self._workers = []
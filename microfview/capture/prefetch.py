@@ -0,0 +1,264 @@
+"""microfview.capture.prefetch module
+
+Provides PrefetchCapture, which wraps any other capture object and reads
+frames from it on a background thread into a bounded ring buffer.
+"""
+import threading
+import collections
+
+import logging
+
+from . import CaptureBase
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST)
+
+
+class _Slot(object):
+
+    __slots__ = ('frame', 'timestamp', 'framenumber', 'metadata', 'error', 'not_decoded')
+
+    def __init__(self, frame, timestamp, framenumber, metadata, error=None, not_decoded=0):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.framenumber = framenumber
+        self.metadata = metadata
+        self.error = error
+        # frames the frame filter skipped before this one
+        self.not_decoded = not_decoded
+
+
+class PrefetchCapture(CaptureBase):
+
+    def __init__(self, capture, size=8, overflow=None):
+        """class for prefetching frames from another capture on a thread.
+
+        Args:
+          capture (CaptureBase): the capture object to read frames from.
+          size (int, optional): maximum number of frames held in the ring.
+            Defaults to 8.
+          overflow (str, optional): what to do when the ring is full. One of
+            'block' (stop reading until there is space), 'drop_newest'
+            (discard the frame just read) or 'drop_oldest' (discard the
+            oldest queued frame). Defaults to 'block' for video files and
+            'drop_oldest' for live devices.
+
+        """
+        super(PrefetchCapture, self).__init__()
+
+        if int(size) < 1:
+            raise ValueError("size has to be bigger than 0")
+        if overflow is None:
+            overflow = OVERFLOW_BLOCK if capture.is_video_file else OVERFLOW_DROP_OLDEST
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of %s" % (OVERFLOW_POLICIES,))
+
+        self._log = logging.getLogger('microfview.capture.PrefetchCapture')
+
+        self._capture = capture
+        self._size = int(size)
+        self._overflow = overflow
+
+        self._ring = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._run = False
+        # bumped on every seek so that frames read before the seek are discarded
+        self._generation = 0
+        # frames skipped before frames dropped with drop_newest, added to
+        # the next frame put in the ring
+        self._not_decoded_carry = 0
+        self._not_decoded = 0
+
+        self._frame_timestamp = 0.0
+        self._frame_number = -1
+        self._frame_metadata = {}
+
+        self.frames_read = 0
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.max_occupancy = 0
+        self.consumer_waits = 0
+
+        #CaptureBase attributes
+        self.fps = capture.fps
+        self.frame_count = capture.frame_count
+        self.frame_width = capture.frame_width
+        self.frame_height = capture.frame_height
+        self.is_video_file = capture.is_video_file
+        self.noncritical_errors = capture.noncritical_errors
+        self.supports_seeking = capture.supports_seeking
+        self.filename = capture.filename
+
+    @property
+    def occupancy(self):
+        """number of frames currently waiting in the ring."""
+        return len(self._ring)
+
+    def get_stats(self):
+        """returns a dict of ring buffer occupancy counters."""
+        with self._cond:
+            return {'size': self._size,
+                    'occupancy': len(self._ring),
+                    'max_occupancy': self.max_occupancy,
+                    'read': self.frames_read,
+                    'delivered': self.frames_delivered,
+                    'dropped': self.frames_dropped,
+                    'consumer_waits': self.consumer_waits}
+
+    def start(self):
+        """start the prefetching thread. called automatically on first grab."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._run = True
+            self._thread = threading.Thread(target=self._read_loop, name='PrefetchCapture')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """stop the prefetching thread."""
+        with self._cond:
+            self._run = False
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def close(self):
+        self.stop()
+        self._capture.close()
+
+    def _put(self, slot, generation):
+        with self._cond:
+            while self._run and (generation == self._generation) and (len(self._ring) >= self._size):
+                if self._overflow == OVERFLOW_BLOCK or slot.error is not None:
+                    self._cond.wait()
+                elif self._overflow == OVERFLOW_DROP_NEWEST:
+                    self.frames_dropped += 1
+                    self._not_decoded_carry += slot.not_decoded
+                    return
+                else:
+                    old = self._ring.popleft()
+                    self.frames_dropped += 1
+                    # the frames skipped before the dropped one were not wanted
+                    (self._ring[0] if self._ring else slot).not_decoded += old.not_decoded
+            if (not self._run) or (generation != self._generation):
+                return
+            slot.not_decoded += self._not_decoded_carry
+            self._not_decoded_carry = 0
+            self._ring.append(slot)
+            self.max_occupancy = max(self.max_occupancy, len(self._ring))
+            self._cond.notify_all()
+
+    def _read_loop(self):
+        cap = self._capture
+        while True:
+            with self._cond:
+                if not self._run:
+                    break
+                generation = self._generation
+            try:
+                n = cap.frames_not_decoded
+                frame = cap.grab_next_frame()
+                slot = _Slot(frame,
+                             cap.get_last_timestamp(),
+                             cap.get_last_framenumber(),
+                             cap.get_last_metadata(),
+                             not_decoded=cap.frames_not_decoded - n)
+                self.frames_read += 1
+            except EOFError as e:
+                slot = _Slot(None, None, None, None, error=e)
+            except cap.noncritical_errors as e:
+                slot = _Slot(None, None, None, None, error=e)
+            except Exception as e:
+                self._log.warn("unexpected error reading frame", exc_info=True)
+                slot = _Slot(None, None, None, None, error=e)
+
+            self._put(slot, generation)
+
+            if isinstance(slot.error, EOFError):
+                # wait for a seek (or stop) before reading again
+                with self._cond:
+                    while self._run and (generation == self._generation):
+                        self._cond.wait()
+
+    def set_grey(self, grey):
+        return self._capture.set_grey(grey)
+
+    def disable_pacing(self):
+        return self._capture.disable_pacing()
+
+    def set_roi(self, x0, y0, x1, y1):
+        actual = self._capture.set_roi(x0, y0, x1, y1)
+        if actual is not None:
+            self.frame_width, self.frame_height = actual[2:]
+        return actual
+
+    def set_frame_filter(self, func):
+        # frames are skipped by the wrapped capture on the reading thread
+        return self._capture.set_frame_filter(func)
+
+    @property
+    def frames_not_decoded(self):
+        # the reading thread runs ahead, only count the frames skipped
+        # before the frames delivered so far
+        return self._not_decoded
+
+    def get_frame_index(self):
+        return self._capture.get_frame_index()
+
+    def seek_frame(self, n):
+        with self._cond:
+            self._generation += 1
+            self._ring.clear()
+            self._not_decoded_carry = 0
+            self._cond.notify_all()
+            # the reading thread only touches the capture outside of the lock,
+            # so stop it while we seek the underlying capture
+            running = self._thread is not None
+        if running:
+            self.stop()
+        self._capture.seek_frame(n)
+        if running:
+            self.start()
+
+    def grab_next_frame_blocking(self):
+        """returns the next frame from the ring."""
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            if not self._ring:
+                self.consumer_waits += 1
+            while not self._ring:
+                self._cond.wait(0.1)
+                if self._thread is None:
+                    raise EOFError("prefetching stopped")
+            slot = self._ring.popleft()
+            self._cond.notify_all()
+
+        if slot.error is not None:
+            raise slot.error
+
+        self._frame_timestamp = slot.timestamp
+        self._frame_number = slot.framenumber
+        self._frame_metadata = slot.metadata
+        self._not_decoded += slot.not_decoded
+        self.frames_delivered += 1
+        return slot.frame
+
+    def get_last_timestamp(self):
+        """returns the timestamp of the last frame."""
+        return self._frame_timestamp
+
+    def get_last_framenumber(self):
+        """returns the framenumber of the last frame."""
+        return self._frame_number
+
+    def get_last_metadata(self):
+        """returns the metadata of the last frame."""
+        return self._frame_metadata
+
@@ -28,9 +28,27 @@ class _SynthBase(object):
         if size is not None:
             w, h = map(int, size.split('x'))
             self.frame_size = (w, h)
-            self._bg = cv2.resize(self._bg, self.frame_size)
+            if self._bg is not None:
+                self._bg = cv2.resize(self._bg, self.frame_size)
 
         self._noise = float(noise)
+        self._bg_grey = None
+        self._scratch = None
+        self.channels = 3
+
+    def set_grey(self, grey):
+        """render single channel (grey) frames"""
+        self.channels = 1 if grey else 3
+        if grey and (self._bg is not None) and (self._bg_grey is None):
+            self._bg_grey = cv2.cvtColor(self._bg, cv2.COLOR_BGR2GRAY)
+
+    def colour(self, bgr):
+        """returns the bgr colour converted for the frames being rendered"""
+        if self.channels == 1:
+            b, g, r = bgr
+            # same weights as cv2.COLOR_BGR2GRAY
+            return (int(round(0.114*b + 0.587*g + 0.299*r)),)
+        return tuple(bgr)
 
     def get_last_frame_metadata(self):
         return {}
@@ -39,23 +57,36 @@ class _SynthBase(object):
         """override this function to draw on the background"""
         pass
 
+    def skip(self, frame_count):
+        """advance the simulation by one frame without returning it. override
+        this function if render can step without drawing"""
+        w, h = self.frame_size
+        shape = (h, w, self.channels) if self.channels > 1 else (h, w)
+        if (self._scratch is None) or (self._scratch.shape != shape):
+            self._scratch = np.zeros(shape, np.uint8)
+        self.render(self._scratch, frame_count)
+
     def read(self, frame_count):
         if self.fps > 0.0:
             t0 = time.time()
 
         w, h = self.frame_size
 
+        c = self.channels
+        shape = (h, w, c) if c > 1 else (h, w)
         if self._bg is None:
-            buf = np.zeros((h, w, 3), np.uint8)
-        else:
+            buf = np.zeros(shape, np.uint8)
+        elif c > 1:
             buf = self._bg.copy()
+        else:
+            buf = self._bg_grey.copy()
 
         self.render(buf, frame_count)
 
         if self._noise > 0.0:
-            noise = np.zeros((h, w, 3), np.int8)
-            cv2.randn(noise, np.zeros(3), np.ones(3)*255*self._noise)
-            buf = cv2.add(buf, noise, dtype=cv2.CV_8UC3)
+            noise = np.zeros(shape, np.int8)
+            cv2.randn(noise, np.zeros(c), np.ones(c)*255*self._noise)
+            buf = cv2.add(buf, noise, dtype=cv2.CV_8U)
 
         if self.fps > 0.0:
             t1 = time.time()
@@ -89,7 +120,7 @@ class _MovingDot(_SynthBase):
         self._radius = int(kwargs.get('radius', 15))
         self._dotnoise = float(kwargs.get('dotnoise',0))
 
-    def render(self, buf, frame_count):
+    def _move(self):
         x,y = self._pos
         w,h = self.frame_size
 
@@ -111,14 +142,23 @@ class _MovingDot(_SynthBase):
 
         self._pos = x,y
 
+    def skip(self, frame_count):
+        self._move()
+
+    def render(self, buf, frame_count):
+        self._move()
+        x,y = self._pos
         # render the circle
-        cv2.circle(buf, (int(x),int(y)), self._radius, self._fill, -1)
+        cv2.circle(buf, (int(x),int(y)), self._radius, self.colour(self._fill), -1)
 
     def get_last_frame_metadata(self):
         return {'dot_radius':self._radius, 'dot_position':self._pos}
 
 
 class SynthCapture(CaptureBase):
+
+    supports_frame_skipping = True
+
     def __init__(self, desc, synthcls=None):
         super(SynthCapture, self).__init__()
 
@@ -156,6 +196,29 @@ class SynthCapture(CaptureBase):
         self.is_video_file = False
         self.frame_count = self._capture.nframes
 
+    def set_grey(self, grey):
+        self._capture.set_grey(grey)
+        return True
+
+    def disable_pacing(self):
+        # the nominal frame rate (self.fps) is kept
+        paced = self._capture.fps > 0.0
+        self._capture.fps = 0.0
+        return paced
+
+    def get_next_framenumber(self):
+        return self._i + 1
+
+    def skip_next_frame(self):
+        if self._i >= self.frame_count:
+            return False
+        # don't return the frame, but keep the simulation and frame rate
+        self._capture.skip(self._i)
+        if self._capture.fps > 0.0:
+            time.sleep(1.0/self._capture.fps)
+        self._i += 1
+        return True
+
     def grab_next_frame_blocking(self):
         if self._i >= self.frame_count:
             raise EOFError
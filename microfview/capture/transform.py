@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 
+from .. import trace
+
 import logging
 logger = logging.getLogger('microfview.capture.Transform')
 
@@ -10,11 +12,28 @@ class ImageTransform(object):
     LAYERS = ('background',)
 
     def __init__(self, **config):
+        """pre-processing applied to every captured frame.
+
+        The 'background' layer of the config may contain any combination of
+
+          roi: [((x0,y0), (x1,y1))], crop the frame to this region
+          mask: list of polygons [(x,y), ...] which are blacked out
+          scale: float, resize the (cropped) frame by this factor
+          grey: bool, convert colour frames to grey
+          reuse_output: bool, write every output frame into the same buffer
+            (see set_reuse_output)
+
+        roi and mask are given in full frame coordinates. The geometry is
+        computed once for the first frame and the intermediate steps write
+        into buffers which are reused for every frame. Unless reuse_output
+        is set, the output is still a new array for every frame, drawn from
+        a frame pool if one has been set (see set_frame_pool).
+        """
         config = config['background']
+        self._source_offset = (0, 0)
 
         if config.get('mask'):
             self._contour = [np.array(c) for c in config['mask']]
-            self._mask = None
         else:
             self._contour = None
         if config.get('roi'):
@@ -23,23 +42,146 @@ class ImageTransform(object):
                 raise ValueError('only one ROI for transform is supported')
             roi = roi[0]
             # roi is ((x0,y0), (x1,y1))
-            self._roi = slice(roi[0][0],roi[1][0]), slice(roi[0][1],roi[1][1])
+            self._request_roi = int(roi[0][0]), int(roi[0][1]), int(roi[1][0]), int(roi[1][1])
         else:
-            self._roi = None
+            self._request_roi = None
 
-    def transform(self, img):
+        self._scale = float(config.get('scale', 1.0))
+        if self._scale <= 0:
+            raise ValueError('scale must be bigger than 0')
+        self._grey = bool(config.get('grey', False))
+
+        self._pool = None
+        self._reuse_output = bool(config.get('reuse_output', False))
+        # (shape, dtype) of the input the geometry was computed for
+        self._geometry = None
+        self._M = None
+
+    def get_roi(self):
+        """returns the region of interest (x0, y0, x1, y1) in frame coordinates
+        or None"""
+        return self._request_roi
+
+    def set_source_roi(self, x, y, w, h):
+        """tell the transform that the capture already crops its frames to
+        the region (x, y, w, h) (for example in camera hardware), which must
+        contain the region of interest. only the remainder is cropped in
+        software, so the output is the same as without the hardware crop."""
+        x0, y0, x1, y1 = self._request_roi
+        if not ((x <= x0) and (y <= y0) and (x + w >= x1) and (y + h >= y1)):
+            raise ValueError("source region %r does not contain %r" % ((x, y, w, h), self._request_roi))
+        self._source_offset = (x, y)
+        self._geometry = None
+
+    def set_frame_pool(self, pool):
+        """draw output frames from pool (a FramePool) instead of reusing a
+        single buffer, so that frames can be kept by other threads."""
+        self._pool = pool
+
+    def set_reuse_output(self, reuse):
+        """if reuse is True, write every output frame into the same buffer
+        (when no frame pool is set). the returned frame is then only valid
+        until the next call to transform(), so this is only safe if no
+        plugin or framestore keeps frames. returns whether the output is
+        reused."""
+        self._reuse_output = bool(reuse)
+        return self._reuse_output
+
+    def get_transform_matrix(self):
+        """returns the 2x3 affine matrix mapping output frame coordinates to
+        full frame coordinates, i.e. x_in = x_out / scale + x0"""
+        if self._M is not None:
+            return self._M.copy()
+        x0, y0 = self._request_roi[:2] if self._request_roi is not None else self._source_offset
+        return np.float32([[1. / self._scale, 0, x0], [0, 1. / self._scale, y0]])
+
+    def _setup(self, img):
+        h, w = img.shape[:2]
+        sx, sy = self._source_offset
+        if self._request_roi is None:
+            x0, y0, x1, y1 = sx, sy, sx + w, sy + h
+        else:
+            x0, y0, x1, y1 = self._request_roi
+        # clip the roi to the frame
+        x0, x1 = [min(max(v, sx), sx + w) for v in (x0, x1)]
+        y0, y1 = [min(max(v, sy), sy + h) for v in (y0, y1)]
+        if (x0, y0, x1, y1) == (sx, sy, sx + w, sy + h):
+            self._crop = None
+        else:
+            self._crop = slice(y0 - sy, y1 - sy), slice(x0 - sx, x1 - sx)
+        cw, ch = x1 - x0, y1 - y0
+
+        ow, oh = max(1, int(round(cw * self._scale))), max(1, int(round(ch * self._scale)))
+        self._M = np.float32([[float(cw) / ow, 0, x0], [0, float(ch) / oh, y0]])
+
+        # the order of the steps. downscale first so that the other steps
+        # process fewer pixels
+        steps = []
+        if self._grey and img.ndim == 3 and img.shape[2] == 3:
+            steps.append('grey')
+        if (ow, oh) != (cw, ch):
+            steps.insert(0 if self._scale < 1 else len(steps), 'resize')
         if self._contour is not None:
-            if self._mask is None:
-                # init mask now we know the frame size
-                self._mask = np.empty((img.shape[0], img.shape[1]), dtype=np.uint8)
-                # start by keeping everything
-                self._mask.fill(255)
-                for c in self._contour:
-                    # subtract the background
-                    cv2.drawContours(self._mask, [c], 0, (0, 0, 0), -1) #-1 = CV_FILLED
-            return cv2.bitwise_and(img, img, mask=self._mask)
-        if self._roi is not None:
+            steps.append('mask')
+
+        shape = (ch, cw) + img.shape[2:]
+        interpolation = cv2.INTER_AREA if self._scale < 1 else cv2.INTER_LINEAR
+        self._steps = []
+        for s in steps:
+            if s == 'grey':
+                shape = shape[:2]
+                func = lambda src, dst: cv2.cvtColor(src, cv2.COLOR_BGR2GRAY, dst=dst)
+            elif s == 'resize':
+                shape = (oh, ow) + shape[2:]
+                func = lambda src, dst: cv2.resize(src, (ow, oh), dst=dst, interpolation=interpolation)
+            elif s == 'mask':
+                mask = self._make_mask(shape, img.dtype, x0, y0, float(ow) / cw, float(oh) / ch)
+                func = lambda src, dst: cv2.bitwise_and(src, mask, dst=dst)
+            self._steps.append((func, shape))
+
+        # intermediate results, the last step writes the output
+        self._buffers = [np.empty(shape, dtype=img.dtype) for _, shape in self._steps]
+        self._geometry = (img.shape, img.dtype.str)
+
+        logger.info('transform %r -> %r (roi: %r, steps: %s)' % (img.shape, shape, (x0, y0, x1, y1), ', '.join(steps) or 'none'))
+
+    def _make_mask(self, shape, dtype, x0, y0, fx, fy):
+        mask = np.empty(shape[:2], dtype=np.uint8)
+        # start by keeping everything
+        mask.fill(255)
+        for c in self._contour:
+            # subtract the background, contours are in full frame coordinates
+            c = np.round((c - np.array([x0, y0])) * np.array([fx, fy])).astype(np.int32)
+            cv2.drawContours(mask, [c], 0, (0, 0, 0), -1) #-1 = CV_FILLED
+        # a mask of the same shape and type as the image allows the output
+        # to be written completely, whatever the buffer contained before
+        full = np.zeros(shape, dtype=dtype)
+        full[mask > 0] = np.iinfo(dtype).max
+        return full
+
+    def transform(self, img):
+        with trace.span('ImageTransform', cat='capture'):
+            return self._transform(img)
+
+    def _transform(self, img):
+        if self._geometry != (img.shape, img.dtype.str):
+            self._setup(img)
+
+        if self._crop is not None:
             # slice works if image is 1 or 3 channel
-            return img[self._roi[1], self._roi[0]]
-        return img
+            img = img[self._crop]
+
+        if not self._steps:
+            return img
+
+        for i, (func, shape) in enumerate(self._steps[:-1]):
+            img = func(img, self._buffers[i])
 
+        func, shape = self._steps[-1]
+        if self._pool is None:
+            if self._reuse_output:
+                return func(img, self._buffers[-1])
+            return func(img, np.empty(shape, self._buffers[-1].dtype))
+        out = self._pool.empty(shape, self._buffers[-1].dtype)
+        func(img, out)
+        return out.freeze()
@@ -14,6 +14,8 @@ class FMFCapture(CaptureBase):
 
     supports_seeking = True
 
+    supports_frame_skipping = True
+
     def __init__(self, filename, check_integrity=False, force_framerate=0):
         """class for interfacing fmf videos.
 
@@ -43,8 +45,37 @@ class FMFCapture(CaptureBase):
         self.is_video_file = True
         self.filename = filename
 
+    def set_grey(self, grey):
+        # only mono (and bayer) movies are stored as single channel images
+        return (self._mov.format == 'MONO8') or self._mov.format.startswith('RAW8')
+
+    def disable_pacing(self):
+        paced = self._frame_delay is not None
+        self._frame_delay = None
+        return paced
+
+    def build_frame_index(self):
+        from .index import FrameIndex
+        timestamps = self._mov.get_all_timestamps()
+        # reading the timestamps moves the file position
+        self._mov.seek(self._frame_number + 1)
+        return FrameIndex(timestamps)
+
     def seek_frame(self, n):
         self._mov.seek(n)
+        self._frame_number = n - 1
+
+    def get_next_framenumber(self):
+        return self._frame_number + 1
+
+    def skip_next_frame(self):
+        n = self._frame_number + 1
+        if n >= self.frame_count:
+            return False
+        # seeking only moves the file position, no frame is read
+        self._mov.seek(n + 1)
+        self._frame_number = n
+        return True
 
     def grab_next_frame_blocking(self):
         """returns next frame."""
@@ -0,0 +1,323 @@
+"""microfview.frame module
+
+Provides SharedFrame and FramePool, which let threaded plugins share
+frames with the mainloop without copying them.
+
+SharedFrame:
+  A read-only numpy array backed by a reference counted buffer. Every
+  consumer that keeps a frame beyond the call it was passed to must
+  acquire() it and release() it when done. When the last reference is
+  released the buffer is returned to the pool it came from.
+
+FramePool:
+  Hands out reusable frame buffers and counts pool hits, misses and
+  the number of bytes that still had to be copied.
+
+FrameCache:
+  Computes derived representations of one frame (grey, colour, image
+  pyramid levels, blurred images) on first request and memoizes them,
+  so each is computed at most once per frame however many plugins ask.
+
+The mainloop only shares the captured frame without copying it with the
+threaded plugins that run after every blocking plugin. Blocking plugins
+always get a writable frame, which they may keep, and threaded plugins
+running before a blocking plugin get a copy.
+
+"""
+import threading
+import collections
+
+import cv2
+import numpy as np
+
+
+class _FrameBuffer(object):
+
+    __slots__ = ('array', 'refs', 'pool')
+
+    def __init__(self, array, pool):
+        self.array = array
+        self.refs = 1
+        self.pool = pool
+
+    def incref(self):
+        # the pool lock also protects the reference counts
+        with self.pool._lock:
+            self.refs += 1
+
+    def decref(self):
+        pool = self.pool
+        with pool._lock:
+            self.refs -= 1
+            if self.refs == 0:
+                pool._recycle(self)
+            elif self.refs < 0:
+                raise ValueError('frame released more times than it was acquired')
+
+
+class SharedFrame(np.ndarray):
+    """A numpy array whose memory is owned by a FramePool buffer.
+
+    Views (slices) of a shared frame share the reference count of the
+    buffer. The results of computations on a shared frame are ordinary
+    numpy arrays.
+    """
+
+    def __array_finalize__(self, obj):
+        if isinstance(obj, SharedFrame) and np.may_share_memory(self, obj):
+            self._buffer = obj._buffer
+        else:
+            self._buffer = None
+
+    def __array_wrap__(self, out_arr, context=None):
+        out_arr = out_arr.view(np.ndarray)
+        return out_arr[()] if out_arr.ndim == 0 else out_arr
+
+    @property
+    def is_shared(self):
+        return self._buffer is not None
+
+    def acquire(self):
+        """take another reference to the underlying buffer."""
+        if self._buffer is not None:
+            self._buffer.incref()
+        return self
+
+    def release(self):
+        """drop a reference to the underlying buffer."""
+        if self._buffer is not None:
+            self._buffer.decref()
+
+    def freeze(self):
+        """mark this frame read-only, returns self."""
+        self.flags.writeable = False
+        return self
+
+
+class FramePool(object):
+
+    def __init__(self, max_free=8):
+        """pool of reusable frame buffers.
+
+        Args:
+          max_free (int, optional): maximum number of unused buffers kept
+            for each frame shape. Defaults to 8.
+        """
+        self._lock = threading.Lock()
+        self._max_free = int(max_free)
+        self._free = collections.defaultdict(list)
+
+        self.hits = 0
+        self.misses = 0
+        self.adopted = 0
+        self.copies = 0
+        self.bytes_copied = 0
+
+    def _recycle(self, fb):
+        # called with the lock held
+        if fb.array is None:
+            return
+        free = self._free[(fb.array.shape, fb.array.dtype.str)]
+        if len(free) < self._max_free:
+            free.append(fb.array)
+        fb.array = None
+
+    def _wrap(self, array, fb):
+        sf = array.view(SharedFrame)
+        sf._buffer = fb
+        return sf
+
+    def empty(self, shape, dtype=np.uint8):
+        """returns a writable SharedFrame, reusing a free buffer if possible.
+
+        The caller holds the only reference and should freeze() the frame
+        once it has been filled.
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        with self._lock:
+            free = self._free.get((shape, dtype.str))
+            if free:
+                array = free.pop()
+                self.hits += 1
+            else:
+                array = None
+                self.misses += 1
+        if array is None:
+            array = np.empty(shape, dtype=dtype)
+        return self._wrap(array, _FrameBuffer(array, self))
+
+    def adopt(self, array):
+        """returns a read-only SharedFrame for array without copying it.
+
+        If array is already shared a new reference is taken instead. The
+        memory of adopted arrays is not reused by the pool as the code that
+        created them may still hold on to it.
+        """
+        if isinstance(array, SharedFrame) and array.is_shared:
+            return array.acquire().freeze()
+        with self._lock:
+            self.adopted += 1
+        return self._wrap(array, _FrameBuffer(None, self)).freeze()
+
+    def copy(self, array):
+        """returns a read-only SharedFrame holding a copy of array."""
+        sf = self.empty(array.shape, array.dtype)
+        np.copyto(sf, array)
+        with self._lock:
+            self.copies += 1
+            self.bytes_copied += array.nbytes
+        return sf.freeze()
+
+    def share(self, frame):
+        """returns a reference to frame that can be kept by another thread.
+
+        Shared frames are referenced without copying, anything else is
+        copied into a pooled buffer.
+        """
+        if isinstance(frame, SharedFrame) and frame.is_shared:
+            return frame.acquire()
+        return self.copy(frame)
+
+    def get_stats(self):
+        """returns a dict of pool counters."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'adopted': self.adopted,
+                    'copies': self.copies,
+                    'bytes_copied': self.bytes_copied,
+                    'free': sum(len(v) for v in self._free.values())}
+
+
+def _read_only(a):
+    # a view, so that the flag of a itself is not changed
+    v = a.view()
+    v.flags.writeable = False
+    return v
+
+
+class FrameCache(object):
+
+    def __init__(self, frame, grey=None, drawable=None):
+        """lazily computed, memoized representations of a single frame.
+
+        The mainloop passes one to the plugins as state['FRAME_CACHE'],
+        except to threaded plugins as it is only valid during the mainloop
+        iteration. Results are shared between all plugins, so copy them
+        before modifying them. The built-in representations are read-only,
+        except colour() of a colour frame, which is the frame itself.
+        Safe to use from several threads, a representation requested
+        concurrently is only computed once.
+
+        Args:
+          frame (array): the captured (BGR or grey) frame.
+          grey (array, optional): the grey version of frame, if already
+            known.
+          drawable (array, optional): frame or grey, if plugins may draw on
+            it. If it is writable the cache keeps a copy, so that the
+            representations show the frame as it was captured.
+        """
+        if (drawable is not None) and drawable.flags.writeable:
+            if drawable is frame:
+                frame = _read_only(frame.copy())
+            elif drawable is grey:
+                grey = _read_only(grey.copy())
+        self._frame = frame
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._pending = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        self._is_grey = frame.ndim == 2 or (frame.ndim == 3 and frame.shape[2] == 1)
+        if self._is_grey:
+            self._cache['grey'] = _read_only(frame.reshape(frame.shape[:2]))
+        elif grey is not None:
+            self._cache['grey'] = _read_only(grey)
+
+    @property
+    def frame(self):
+        return self._frame
+
+    def get(self, key, func, *args):
+        """returns the representation stored under key, computing it as
+        func(*args) if this is the first request for key this frame. the
+        result is returned to every plugin asking for key and must not be
+        modified."""
+        return self._get(key, False, func, *args)
+
+    def _get(self, key, freeze, func, *args):
+        # freeze is only safe for arrays which func allocated
+        while True:
+            with self._lock:
+                try:
+                    val = self._cache[key]
+                    self.hits += 1
+                    return val
+                except KeyError:
+                    pass
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    break
+            # another thread is computing it, when it is done we either find
+            # the result in the cache or (if it failed) compute it ourselves
+            event.wait()
+
+        try:
+            val = func(*args)
+            if freeze and isinstance(val, np.ndarray):
+                val.flags.writeable = False
+            with self._lock:
+                self._cache[key] = val
+                self.misses += 1
+            return val
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+    def grey(self):
+        """returns the frame as a single channel image."""
+        return self._get('grey', True, cv2.cvtColor, self._frame, cv2.COLOR_BGR2GRAY)
+
+    def colour(self):
+        """returns the frame as a BGR image."""
+        if self._is_grey:
+            return self._get('colour', True, cv2.cvtColor, self._frame, cv2.COLOR_GRAY2BGR)
+        return self._frame
+
+    def _image(self, grey):
+        return self.grey() if grey else self.colour()
+
+    def pyramid_level(self, level, grey=True):
+        """returns the frame downsampled (cv2.pyrDown) level times. level 0
+        is the frame itself."""
+        if level == 0:
+            return self._image(grey)
+        return self._get(('pyramid', bool(grey), level), True,
+                         lambda: cv2.pyrDown(self.pyramid_level(level - 1, grey)))
+
+    def pyramid(self, levels, grey=True):
+        """returns a list of the first levels pyramid levels."""
+        return [self.pyramid_level(i, grey) for i in range(levels)]
+
+    def blur(self, ksize, sigma=0, grey=True):
+        """returns the frame blurred with a (ksize x ksize) gaussian kernel."""
+        return self._get(('blur', int(ksize), float(sigma), bool(grey)), True,
+                         lambda: cv2.GaussianBlur(self._image(grey), (int(ksize), int(ksize)), sigma))
+
+    def get_stats(self):
+        """returns a dict of cache counters."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'cached': len(self._cache)}
+
+
+def release_frame(frame):
+    """release frame if it is a shared frame, does nothing otherwise"""
+    if isinstance(frame, SharedFrame):
+        frame.release()
@@ -0,0 +1,117 @@
+"""microfview.latency module
+
+Provides LatencyRecorder, which measures for every frame
+  - capture to dispatch: from the frame timestamp to the mainloop
+    pushing the frame to the plugins,
+  - dispatch to complete: from the push to each plugin's result being
+    completed (threaded plugins record it on their own thread),
+  - capture to framestore: from the frame timestamp to the last result
+    of the frame being stored,
+and counts frames that were not processed, by cause:
+  - driver: frame numbers the capture skipped,
+  - busy: frames dropped by asynchronous plugins which were busy,
+  - capture_error: frames the capture failed to deliver,
+  - shed: frames on which the adaptive scheduler did not run a plugin.
+
+Capture latencies are only meaningful if the capture timestamps frames
+with time.time() (live cameras), not for recorded files.
+"""
+import time
+import collections
+
+from .metrics import Histogram
+
+DROP_DRIVER = 'driver'
+DROP_BUSY = 'busy'
+DROP_CAPTURE_ERROR = 'capture_error'
+DROP_SHED = 'shed'
+
+DROP_CAUSES = (DROP_DRIVER, DROP_BUSY, DROP_CAPTURE_ERROR, DROP_SHED)
+
+
+class LatencyRecorder(object):
+
+    def __init__(self, size=1000):
+        """keeps the records of the last size frames and histograms of all
+        frames.
+
+        Args:
+          size (int, optional): number of per frame records kept.
+        """
+        self._size = int(size)
+        # frame_number -> record, oldest first
+        self._records = collections.OrderedDict()
+        self._histograms = collections.OrderedDict()
+        self.drops = dict.fromkeys(DROP_CAUSES, 0)
+        self.plugin_drops = collections.defaultdict(lambda: dict.fromkeys(DROP_CAUSES, 0))
+        self.frames = 0
+
+    def _observe(self, name, v):
+        h = self._histograms.get(name)
+        if h is None:
+            h = self._histograms[name] = Histogram()
+        h.observe(v)
+
+    def begin_frame(self, frame_number, frame_timestamp, now):
+        """called by the mainloop before pushing a frame to the plugins"""
+        self.frames += 1
+        capture_to_dispatch = now - frame_timestamp
+        self._observe('capture_to_dispatch', capture_to_dispatch)
+        if self._size:
+            self._records[frame_number] = {'frame_number': frame_number,
+                                           'frame_timestamp': frame_timestamp,
+                                           'dispatch': now,
+                                           'capture_to_dispatch': capture_to_dispatch,
+                                           'dispatch_to_complete': {},
+                                           'capture_to_store': float('nan')}
+            if len(self._records) > self._size:
+                self._records.popitem(last=False)
+
+    def store(self, callback_name, frame_number, frame_timestamp, now):
+        """called when the result of plugin callback_name for the frame
+        dispatched at now is stored"""
+        t = time.time()
+        dispatch_to_complete = t - now
+        capture_to_store = t - frame_timestamp
+        self._observe('dispatch_to_complete:%s' % callback_name, dispatch_to_complete)
+        self._observe('capture_to_store', capture_to_store)
+        rec = self._records.get(frame_number)
+        if (rec is not None) and (rec['dispatch'] == now):
+            rec['dispatch_to_complete'][callback_name] = dispatch_to_complete
+            if not (rec['capture_to_store'] >= capture_to_store):
+                rec['capture_to_store'] = capture_to_store
+
+    def drop(self, cause, n=1, plugin=None):
+        """count n frames not processed because of cause"""
+        self.drops[cause] += n
+        if plugin is not None:
+            self.plugin_drops[plugin][cause] += n
+
+    def get_records(self):
+        """returns the per frame records (dicts), oldest first"""
+        return list(self._records.values())
+
+    def get_record(self, frame_number):
+        return self._records.get(frame_number)
+
+    def get_drops(self):
+        """returns a dict of cause to number of frames, and a dict of plugin
+        identifier to such a dict"""
+        return dict(self.drops), dict((k, dict(v)) for k, v in self.plugin_drops.items())
+
+    def get_summary(self):
+        """returns a dict of latency name to stats (count, mean, max, p50,
+        p95, p99, in seconds) over all frames"""
+        return dict((k, h.get_stats()) for k, h in self._histograms.items())
+
+    def format_summary(self):
+        lines = ['%d frames, not processed: %s' % (self.frames,
+                 ', '.join('%s %d' % (c, self.drops[c]) for c in DROP_CAUSES))]
+        for plugin, d in sorted(self.plugin_drops.items()):
+            lines.append('  %s not processed: %s' % (plugin, ', '.join('%s %d' % (c, d[c]) for c in DROP_CAUSES if d[c])))
+        lines.append('latency (ms)%s' % ''.join('%8s' % s for s in ('p50', 'p95', 'p99', 'max', 'count')))
+        for name, h in self._histograms.items():
+            s = h.get_stats()
+            lines.append('  %s %s %d' % (name, ' '.join('%7.1f' % (s[k] * 1000) for k in ('p50', 'p95', 'p99', 'max')),
+                                         s['count']))
+        return '\n'.join(lines)
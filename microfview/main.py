@@ -4,6 +4,7 @@ Provides Microfview class, which manages the frame capture
 and delegates frames to all plugins.
 
 """
+import sys
 import threading
 import time
 import collections
@@ -15,26 +16,75 @@ import numpy as np
 import logging
 logger = logging.getLogger('microfview')
 
-from .plugin import PluginFinished, FuncWrapperPlugin, MESSAGE_SEEK
+from .plugin import PluginFinished, FuncWrapperPlugin, MESSAGE_SEEK, MESSAGE_SEEK_TIME
 from .plugins.display import DisplayPlugin
+from .capture import SeekError
 from .store import FrameStoreManager, FrameStore
+from .frame import FramePool, SharedFrame, FrameCache
+from .schedule import PluginSchedule, DeadlineScheduler, DECISION_SHED
+from .state import FrameState, StateLayout
+from .latency import LatencyRecorder, DROP_DRIVER, DROP_BUSY, DROP_CAPTURE_ERROR, DROP_SHED
+from . import trace
 
 # helper function for frame_capture checks
 def _has_method(obj, method):
     return hasattr(obj, method) and callable(getattr(obj, method))
 
 
+def _describe_result(d, ret, state):
+    s = "%s (threaded: %s)" % (d.identifier, d.plugin.threaded)
+    if ret is None:
+        return s + ' returned None'
+    elif ret is False:
+        return s + ' BUSY'
+    elif isinstance(ret, tuple):
+        s += ' returned img %r and state %r' % (ret[0].shape, ret[1].keys())
+    elif isinstance(ret, collections.Mapping):
+        s += ' returned state %r' % (ret.keys(),)
+    elif isinstance(ret, np.ndarray):
+        s += ' returned image %r' % (ret.shape,)
+    return s + '\n\tcurrent merged state:\n\t%s' % state.keys()
+
+
+class _Dispatch(object):
+    """how the mainloop calls a plugin, computed once when the schedule
+    changes instead of on every frame."""
+
+    __slots__ = ('plugin', 'identifier', 'every', 'push_frame', 'drops_frames', 'dropped', 'warned')
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.identifier = plugin.identifier
+        self.every = plugin.every
+        self.push_frame = plugin.push_frame
+        # asynchronous plugins count the frames they drop when busy
+        self.drops_frames = plugin.threaded and hasattr(plugin, 'frames_dropped')
+        self.dropped = getattr(plugin, 'frames_dropped', 0)
+        # warned that a frame it returned was ignored
+        self.warned = False
+
+
 class Microfview(threading.Thread):
 
-    def __init__(self, frame_capture, visible=True, debug=True, single_frame_step=False, stop_frame=0):
+    def __init__(self, frame_capture, visible=True, debug=True, single_frame_step=False, stop_frame=0, plugin_workers=0):
         """Microfview main class.
 
         Args:
           frame_capture (microfview capture): A capture class for aquiring frames.
             See microfview.camera or microfview.video.
+          plugin_workers (int, optional): run independent plugins concurrently
+            on this many threads. See microfview.schedule.
+
+        Attributes:
+          frame_count (int): the number of frames processed.
+          frames_skipped (int): the number of frames the capture skipped
+            without decoding them because no plugin needed them.
+          latency (LatencyRecorder): per frame latencies and counts of
+            frames not processed, by cause, or None. See
+            attach_latency_recorder.
 
         """
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, name='Microfview')
         self.daemon = True
         self._lock = threading.Lock()
 
@@ -51,6 +101,7 @@ class Microfview(threading.Thread):
         self.frame_capture_noncritical_errors = frame_capture.noncritical_errors
 
         self.frame_count = 0
+        self.frames_skipped = 0
         self.frame_number_current = 0
 
         self._stop_frame = stop_frame
@@ -58,10 +109,20 @@ class Microfview(threading.Thread):
         self._run = False
 
         self._plugins = []
+        self._plugin_workers = int(plugin_workers)
+        self._schedule = None
+        self._plan = []
+        self._share_from = None
+        self._deadline = None
 
         self._profile_timestore = None
         self._profile = None
+        self._metrics = None
+        self._metrics_exporters = []
         self._framestore = FrameStoreManager()
+        self.frame_pool = FramePool()
+
+        self.latency = None
 
         self._display_plugins = []
 
@@ -77,10 +138,20 @@ class Microfview(threading.Thread):
         from .capture import get_capture_object
         from .util import parse_config_file, print_mean_fps
         conf = parse_config_file(args.config)
+        if args.prefetch:
+            conf['capture']['prefetch'] = args.prefetch
         cap_fallback = get_capture_object(args.capture, cap_fallback=cap_fallback, options_dict=conf)
-        obj = cls(cap_fallback, visible=not args.hide, debug=args.debug, single_frame_step=args.step, stop_frame=args.stop_frame)
+        obj = cls(cap_fallback, visible=not args.hide, debug=args.debug, single_frame_step=args.step, stop_frame=args.stop_frame,
+                  plugin_workers=args.plugin_workers)
         if args.print_fps:
             obj.attach_profiler(print_mean_fps)
+        if args.trace:
+            trace.enable(size=args.trace_size, path=args.trace)
+        if args.latency:
+            obj.attach_latency_recorder()
+        if args.metrics_port or args.metrics_file:
+            obj.attach_metrics(port=args.metrics_port or None, path=args.metrics_file,
+                               interval=args.metrics_interval)
         if add_display_plugin and (not args.hide):
             obj.attach_display_plugin(enable_seek=args.seek)
         return obj
@@ -118,6 +189,50 @@ class Microfview(threading.Thread):
         self._profile_timestore = collections.defaultdict(lambda: collections.deque(maxlen=10))
         self._profile = callback_func
 
+    def attach_metrics(self, metrics=None, port=None, path=None, interval=10.0):
+        """Records latency histograms of every stage of the mainloop and
+        frame counters (see microfview.metrics).
+
+        Args:
+          metrics (Metrics, optional): where to record, a new Metrics if None
+          port (int, optional): serve the metrics on http://127.0.0.1:port/metrics
+          path (str, optional): write the metrics to this file every interval seconds
+
+        returns:
+          the Metrics object
+        """
+        from .metrics import Metrics, MetricsServer, MetricsFileWriter
+        if metrics is None:
+            metrics = Metrics()
+        self._metrics = metrics
+        if port is not None:
+            self._metrics_exporters.append(MetricsServer(metrics, port))
+        if path is not None:
+            self._metrics_exporters.append(MetricsFileWriter(metrics, path, interval))
+        return metrics
+
+    def attach_latency_recorder(self, recorder=None):
+        """Records the latency of every frame and counts frames not
+        processed, by cause (see microfview.latency). A summary is logged
+        when the mainloop stops.
+
+        Args:
+          recorder (LatencyRecorder, optional): where to record, a new
+            LatencyRecorder if None
+
+        returns:
+          the LatencyRecorder, also available as the latency attribute
+        """
+        if recorder is None:
+            recorder = LatencyRecorder()
+        self.latency = recorder
+        self._framestore.set_latency_recorder(recorder)
+        return recorder
+
+    def get_metrics(self):
+        """returns the attached Metrics, or None"""
+        return self._metrics
+
     def attach_framestore(self, obj):
         """Attaches a FrameStore instance that will be called after every
         frame to save any relevant data for that frame"""
@@ -158,17 +273,108 @@ class Microfview(threading.Thread):
         self._plugins.append(plugin)
         logger.info('attaching plugin %s (shows_windows: %s)' % (plugin.human_name, plugin.shows_windows))
 
-    def attach_parallel_plugin(self, plugin, threaded=False):
+    def attach_parallel_plugin(self, plugin, threaded=False, mode=None):
+        """Attaches a plugin whose returned frame and state are not passed to
+        the following plugins.
+
+        Args:
+          plugin: the plugin
+          threaded (bool): run the plugin on its own thread
+          mode (str, optional): 'thread' (same as threaded=True) or
+            'process' to run the plugin in a worker process (see
+            ProcessPlugin)
+
+        returns:
+          plugin_object:  can be used to detach the plugin
+        """
+        if mode == 'process':
+            from .process import ProcessPlugin
+            plugin = ProcessPlugin(plugin=plugin)
+        elif mode in (None, 'thread'):
+            plugin.threaded = threaded or (mode == 'thread')
+        else:
+            raise ValueError("mode must be 'thread' or 'process'")
         plugin.return_frame = False
         plugin.return_state = False
-        plugin.threaded = threaded
         self.attach_plugin(plugin)
+        return plugin
 
     def detach_plugin(self, plugin):
         """Detaches a plugin."""
         plugin.stop()
         self._plugins.remove(plugin)
 
+    def _update_frame_filter(self):
+        # tell the capture which frames are needed, so it can skip decoding
+        # the others. only possible if no plugin needs every frame
+        if not _has_method(self.frame_capture, 'set_frame_filter'):
+            return
+        everys = set(p.every for p in self._plugins + self._display_plugins)
+        if (not everys) or (1 in everys):
+            func = None
+        elif len(everys) == 1:
+            every = everys.pop()
+            func = lambda n: n % every == 0
+        else:
+            everys = tuple(everys)
+            func = lambda n: any(n % e == 0 for e in everys)
+        if self.frame_capture.set_frame_filter(func) and (func is not None):
+            logger.info('capture skips frames not needed by plugins (every: %s)' % (everys,))
+
+    def _update_schedule(self):
+        if self._schedule is not None:
+            self._schedule.close()
+        self._schedule = PluginSchedule(self._plugins, self._plugin_workers)
+        self._plan = [[_Dispatch(p) for p in level] for level in self._schedule.levels]
+        # the frame is shared read-only with the threaded plugins of the
+        # levels from here on. blocking plugins may draw on the frame, so
+        # only if no blocking plugin runs after them
+        self._share_from = None
+        for i in range(len(self._plan) - 1, -1, -1):
+            if not all(d.plugin.threaded for d in self._plan[i]):
+                break
+            self._share_from = i
+
+    def get_schedule_decisions(self):
+        """returns the decisions of the adaptive scheduler (see
+        DeadlineScheduler.get_decisions), or an empty dict if no plugin
+        declares a priority, budget or target_rate."""
+        if self._deadline is None:
+            return {}
+        return self._deadline.get_decisions()
+
+    def _count_drop(self, cause, n=1, plugin=None):
+        if self.latency is not None:
+            self.latency.drop(cause, n, plugin)
+        if self._metrics is not None:
+            if plugin is None:
+                self._metrics.inc('frames_dropped_total', n, cause=cause)
+            else:
+                self._metrics.inc('frames_dropped_total', n, cause=cause, plugin=plugin)
+
+    def _share(self, frame, refs):
+        # returns a read-only SharedFrame of a frame only the mainloop holds,
+        # appending the reference the mainloop takes to refs
+        if isinstance(frame, SharedFrame) and frame.is_shared:
+            return frame
+        frame = self.frame_pool.adopt(frame)
+        refs.append(frame)
+        return frame
+
+    def _warn_frame_ignored(self, d):
+        # the schedule only runs plugins concurrently which declare that
+        # they return no frame
+        if not d.warned:
+            logger.warn("%s returned a frame while running concurrently, the frame is ignored" % d.identifier)
+            d.warned = True
+
+    def _push_frame(self, plugin, buf, frame_number, frame_timestamp, now, state):
+        with trace.span(plugin.identifier, cat='plugin'):
+            plugin.tick()
+            ret = plugin.push_frame(buf, frame_number, self.frame_count, frame_timestamp, now, state, self._framestore)
+            plugin.tock()
+        return ret
+
     def run(self):
         """main loop. do not call directly."""
         # if there are no plugins then add a fake one so we can at least see the capture source
@@ -184,6 +390,7 @@ class Microfview(threading.Thread):
             plugin.set_visible(self._visible)
             plugin.start(self.frame_capture)
             plugin.set_message_queue(self._msg_queue)
+            plugin.set_frame_pool(self.frame_pool)
 
             schema[plugin.identifier] = plugin.get_schema()
 
@@ -193,11 +400,50 @@ class Microfview(threading.Thread):
             self._framestore.add(d)
         self._framestore.open(schema)
 
+        # preallocate state slots for everything the plugins return
+        state_layout = StateLayout.from_schemas(schema)
+
         call_cvwaitkey = any(p.shows_windows for p in self._plugins)
         logger.info('will call waitkey: %s' % call_cvwaitkey)
 
         all_grey_plugins = not any(p.uses_color for p in self._plugins)
         logger.info('plugins all use grey images: %s' % all_grey_plugins)
+        # framestores and display plugins get the original frame, so it may
+        # only be grey if none of them uses colour
+        if all_grey_plugins and (not self._framestore.uses_color()) and _has_method(self.frame_capture, 'set_grey'):
+            # otherwise we convert each frame below
+            logger.info('capture produces grey images: %s' % self.frame_capture.set_grey(True))
+
+        self._update_frame_filter()
+        self._update_schedule()
+
+        # threaded plugins are handed read-only references to the frame instead of copies
+        logger.info('sharing frames with threaded plugins: %s' % (self._share_from is not None))
+        # frames are only drawn from (and recycled to) the pool if no blocking
+        # plugin, which may keep them, ever sees them
+        pool_frames = self._share_from == 0
+        if pool_frames and _has_method(self.frame_capture, 'set_frame_pool'):
+            self.frame_capture.set_frame_pool(self.frame_pool)
+        # threaded plugins keep the frame, so the transform must not write
+        # the next one into the same buffer
+        if (self._share_from is not None) and _has_method(self.frame_capture, 'set_reuse_output'):
+            logger.info('transform reuses its output: %s' % self.frame_capture.set_reuse_output(False))
+        # plugins and display plugins map their results to full frame coordinates
+        transformed = (getattr(self.frame_capture, 'transform', None) is not None) and \
+            _has_method(self.frame_capture, 'get_transform_matrix')
+        if DeadlineScheduler.wanted(self._plugins):
+            self._deadline = DeadlineScheduler(getattr(self.frame_capture, 'fps', None),
+                                               live=not getattr(self.frame_capture, 'is_video_file', False))
+            logger.info('adaptive scheduling (frame period: %s)' % self._deadline.period)
+        not_decoded = getattr(self.frame_capture, 'frames_not_decoded', 0)
+
+        metrics = self._metrics
+        for e in self._metrics_exporters:
+            e.start()
+
+        # plugins are only timed (and results described) if something uses it
+        timed = (self._profile is not None) or (metrics is not None) or (self._deadline is not None)
+        debug = logger.isEnabledFor(logging.DEBUG)
 
         self._run = True
         try:
@@ -220,117 +466,252 @@ class Microfview(threading.Thread):
                 now0 = time.time()
                 try:
                     if (msg_type == MESSAGE_SEEK) and self.frame_capture.supports_seeking:
-                        self.frame_number_current = msg - 1
                         self.frame_capture.seek_frame(msg)
+                        self.frame_number_current = msg - 1
+                    elif (msg_type == MESSAGE_SEEK_TIME) and self.frame_capture.supports_seeking:
+                        self.frame_number_current = self.frame_capture.seek_time(msg) - 1
                     frame = self.frame_capture.grab_next_frame()
-                    execution_times['Acquire'] = time.time() - now0
+                    t_acquired = time.time()
+                    execution_times['Acquire'] = t_acquired - now0
+                    trace.complete('Acquire', now0, t_acquired)
                 except EOFError as e:
                     logger.info(e.message)
                     self.stop()
                     continue
+                except SeekError as e:
+                    # carry on from wherever the capture is
+                    logger.error("could not seek: %s" % e)
+                    continue
                 except self.frame_capture_noncritical_errors as e:
                     logger.exception("error when retrieving frame")
+                    self._count_drop(DROP_CAPTURE_ERROR)
                     continue
 
                 if frame is None:
                     logger.exception("error when retrieving frame")
+                    self._count_drop(DROP_CAPTURE_ERROR)
                     continue
 
                 if capture_is_color is None:
                     #protect against empty last dimensions
                     capture_is_color = (frame.shape[-1] == 3) & (frame.ndim == 3)
 
+                # the mainloop holds one reference to each frame it shares
+                frame_refs = []
+                if isinstance(frame, SharedFrame) and frame.is_shared:
+                    # frames the transform drew from the pool already come
+                    # with a reference, which the mainloop takes over
+                    frame_refs.append(frame)
+
                 if capture_is_color and all_grey_plugins:
-                    buf = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    if pool_frames:
+                        grey = self.frame_pool.empty(frame.shape[:2], frame.dtype)
+                        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=grey)
+                        frame_refs.append(grey.freeze())
+                    else:
+                        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    buf = grey
                 else:
+                    grey = None
                     buf = frame
 
-                state = {}
+                state = FrameState(state_layout)
                 state['FRAME_ORIGINAL'] = frame
+                state['FRAME_CACHE'] = FrameCache(frame, grey=grey, drawable=buf)
                 state['FRAME_METADATA'] = self.frame_capture.get_last_metadata()
                 state['KEY'] = last_key
+                if transformed:
+                    state['FRAME_TRANSFORM'] = self.frame_capture.get_transform_matrix()
 
                 frame_timestamp = self.frame_capture.get_last_timestamp()
                 frame_number = self.frame_capture.get_last_framenumber()
 
+                # frames the capture skipped because no plugin needed them
+                n = getattr(self.frame_capture, 'frames_not_decoded', 0)
+                not_decoded, skip_wanted = n, n - not_decoded
+
                 # warn if frames were skipped
-                skip = frame_number - self.frame_number_current
+                skip = frame_number - self.frame_number_current - skip_wanted
                 if skip != 1:
                     logger.warning('skipped %d frames' % skip)
+                    if skip > 1:
+                        self._count_drop(DROP_DRIVER, skip - 1)
                 self.frame_number_current = frame_number
 
+                if metrics is not None:
+                    metrics.observe('Acquire', execution_times['Acquire'])
+                    metrics.inc('frames_processed_total')
+                    if skip_wanted:
+                        metrics.inc('frames_skipped_total', skip_wanted)
+                    t_store = time.time()
+
                 self.frame_count += 1
+                self.frames_skipped += skip_wanted
 
                 finished_plugins = []
                 now = time.time()
 
                 self._framestore.begin_frame(frame, frame_number, self.frame_count, frame_timestamp, now, last_key)
 
-                for plugin in self._plugins:
-                    if self.frame_number_current % plugin.every == 0:
-                        cn = plugin.identifier
+                if metrics is not None:
+                    t_store = time.time() - t_store
+
+                if self._deadline is not None:
+                    selected = self._deadline.select(self._plugins, self.frame_number_current, frame_timestamp)
+                    plugins_run = []
+                    for cn, d in self._deadline.decisions.iteritems():
+                        if d == DECISION_SHED:
+                            self._count_drop(DROP_SHED, plugin=cn)
+
+                share_from = self._share_from
+                for i, level in enumerate(self._plan):
+                    if i == share_from:
+                        # only threaded plugins follow, which are handed
+                        # read-only references to the frame instead of copies.
+                        # frames returned by plugins are copied by them
+                        shared = self._share(frame, frame_refs)
+                        if buf is frame:
+                            buf = shared
+                        elif buf is grey:
+                            buf = self._share(grey, frame_refs)
+                        frame = state['FRAME_ORIGINAL'] = shared
+
+                    if self._deadline is not None:
+                        active = [d for d in level if d.plugin in selected]
+                        plugins_run.extend(d.plugin for d in active)
+                    elif len(level) == 1:
+                        active = level if self.frame_number_current % level[0].every == 0 else ()
+                    else:
+                        active = [d for d in level if self.frame_number_current % d.every == 0]
+                    if not active:
+                        continue
+
+                    concurrent = len(active) > 1
+                    if concurrent:
+                        # each plugin gets a copy of the state, their results
+                        # are merged below in attach order
+                        push = lambda d: self._push_frame(d.plugin, buf, frame_number, frame_timestamp, now, state.copy())
+                        results = self._schedule.run_level(active, push)
+                    else:
+                        d = active[0]
                         try:
-                            plugin.tick()
-                            ret = plugin.push_frame(buf, frame_number, self.frame_count, frame_timestamp, now, state, self._framestore)
-                            plugin.tock()
-
-                            dbg_s = ["%s (threaded: %s)" % (cn, plugin.threaded)]
-
-                            # if ret is False, the non-blocking plugin was
-                            # still processing the old frame.
-                            # if it is None then the plugin didn't return
-                            # anything useful
-                            # if is a 2-tuple then it is a frame and a dict
-                            if ret is not None:
-                                ret_state = {}
-                                if ret is False:
-                                    dbg_s.append('BUSY')
-                                elif isinstance(ret, tuple):
-                                    buf, ret_state = ret
-                                    dbg_s.append('returned img %r and state %r' % (buf.shape,ret_state.keys()))
-                                elif isinstance(ret, dict):
-                                    ret_state = ret
-                                    dbg_s.append('returned state %r' % (ret_state.keys(),))
-                                elif isinstance(ret, np.ndarray):
-                                    buf = ret
-                                    dbg_s.append('returned image %r' % (buf.shape,))
-
-                                state.update(ret_state)
-                                dbg_s.append('\n\tcurrent merged state:\n\t%s' % state.keys())
-
+                            if timed or trace.is_enabled():
+                                ret = self._push_frame(d.plugin, buf, frame_number, frame_timestamp, now, state)
+                            else:
+                                ret = d.push_frame(buf, frame_number, self.frame_count, frame_timestamp, now, state,
+                                                   self._framestore)
+                            results = ((d, ret, None),)
+                        except PluginFinished:
+                            results = ((d, None, sys.exc_info()),)
+
+                    for d, ret, exc_info in results:
+                        if exc_info is not None:
+                            if isinstance(exc_info[1], PluginFinished):
+                                logger.info("%s finished" % d.identifier)
+                                finished_plugins.append(d.plugin)
+                                continue
+                            raise exc_info[0], exc_info[1], exc_info[2]
+
+                        # if ret is False, the non-blocking plugin was
+                        # still processing the old frame.
+                        # if it is None then the plugin didn't return
+                        # anything useful
+                        # if is a 2-tuple then it is a frame and a dict
+                        # plugins run concurrently do not return frames
+                        if (ret is not None) and (ret is not False):
+                            t = type(ret)
+                            if t is dict:
+                                ret_state = ret
+                            elif isinstance(ret, tuple):
+                                ret_state = ret[1]
+                                if not concurrent:
+                                    buf = ret[0]
+                                elif ret[0] is not buf:
+                                    self._warn_frame_ignored(d)
+                            elif isinstance(ret, collections.Mapping):
+                                ret_state = ret
                             else:
-                                dbg_s.append('returned None')
+                                ret_state = None
+                                if isinstance(ret, np.ndarray):
+                                    if not concurrent:
+                                        buf = ret
+                                    elif ret is not buf:
+                                        self._warn_frame_ignored(d)
+                            if ret_state:
+                                state.update(ret_state)
 
-                            # print ' '.join(dbg_s)
+                        if debug:
+                            logger.debug(_describe_result(d, ret, state))
 
-                            execution_times[cn] = plugin.get_execution_time()
+                        if d.drops_frames:
+                            dropped = d.plugin.frames_dropped
+                            if dropped != d.dropped:
+                                self._count_drop(DROP_BUSY, dropped - d.dropped, plugin=d.identifier)
+                                d.dropped = dropped
 
-                        except PluginFinished:
-                            logger.info("%s finished" % cn)
-                            finished_plugins.append(plugin)
+                        if timed:
+                            cn = d.identifier
+                            execution_times[cn] = d.plugin.get_execution_time()
+                            if metrics is not None:
+                                if ret is False:
+                                    metrics.inc('plugin_busy_total', plugin=cn)
+                                else:
+                                    metrics.observe(cn, execution_times[cn])
 
                 if self._profile is not None:
                     execution_times['TOTAL'] = time.time() - now0
 
                 for plugin in finished_plugins:
                     self.detach_plugin(plugin)
+                    if self._deadline is not None:
+                        self._deadline.remove(plugin)
                     cn = plugin.identifier
                     execution_times.pop(cn)
+                if finished_plugins:
+                    self._update_frame_filter()
+                    self._update_schedule()
 
                 if self._profile is not None:
                     for et in execution_times:
                         self._profile_timestore[et].append(execution_times[et])
                     self._profile(execution_times, self._profile_timestore)
 
+                if metrics is not None:
+                    t_display = time.time()
+
                 if call_cvwaitkey:
-                    last_key = 0xFF & cv2.waitKey(self._waitkey_delay)
+                    with trace.span('waitKey'):
+                        last_key = 0xFF & cv2.waitKey(self._waitkey_delay)
                 elif self._waitkey_delay == 0:
                     raw_input('Press key to continue')
                 if (self._key_handler is not None) and (last_key == 0xFF):
                     last_key = self._key_handler()
 
+                if metrics is not None:
+                    t0 = time.time()
+                    metrics.observe('display', t0 - t_display)
+
+                # results of threaded plugins are stored on this thread,
+                # inside the frame
+                self._framestore.deliver_completed()
                 self._framestore.end_frame(frame, frame_number, self.frame_count, frame_timestamp, now)
 
+                if metrics is not None:
+                    # display plugins draw in end_frame
+                    metrics.observe('framestore', t_store + time.time() - t0)
+                    metrics.observe('TOTAL', time.time() - now0)
+
+                if self._deadline is not None:
+                    # time spent waiting for the capture is not overhead
+                    self._deadline.update(plugins_run, frame_timestamp, time.time() - now)
+
+                for f in frame_refs:
+                    f.release()
+
+                trace.complete('frame', now0, time.time(), frame_number=frame_number)
+                if last_key == ord('T'):
+                    trace.dump()
+
                 if not self._plugins:
                     self.stop()
 
@@ -350,7 +731,16 @@ class Microfview(threading.Thread):
             # stop the plugins
             for plugin in self._plugins:
                 plugin.stop()
+            if self._schedule is not None:
+                self._schedule.close()
             self._framestore.close()
+            if _has_method(self.frame_capture, 'close'):
+                self.frame_capture.close()
+            for e in self._metrics_exporters:
+                e.stop()
+            trace.dump()
+            if self.latency is not None:
+                logger.info('frame accounting:\n%s' % self.latency.format_summary())
 
         self.finished = True
 
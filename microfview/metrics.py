@@ -0,0 +1,259 @@
+"""microfview.metrics module
+
+Provides Metrics, fixed memory latency histograms and counters for the
+mainloop, and two ways of exporting them in the Prometheus text
+exposition format without slowing the mainloop:
+
+MetricsServer:
+  serves the metrics over http on a local port (GET /metrics).
+
+MetricsFileWriter:
+  periodically (atomically) rewrites a file, e.g. for the node exporter
+  textfile collector.
+
+Histograms use logarithmic buckets, so quantiles are accurate to the
+bucket width (about 12% with the default 20 buckets per decade).
+"""
+import os
+import math
+import time
+import logging
+import threading
+import BaseHTTPServer
+
+logger = logging.getLogger('microfview.metrics')
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+
+    def __init__(self, min_value=1e-6, max_value=1e3, buckets_per_decade=20):
+        """histogram with logarithmic buckets.
+
+        Args:
+          min_value (float, optional): values below this are counted in
+            the first bucket.
+          max_value (float, optional): values above this are counted in
+            the last bucket.
+          buckets_per_decade (int, optional): resolution.
+        """
+        self._min = float(min_value)
+        self._scale = float(buckets_per_decade)
+        self._n = int(math.ceil(math.log10(max_value / self._min) * self._scale)) + 1
+        self._counts = [0] * self._n
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, v):
+        if v != v:
+            # nan
+            return
+        if v > self._min:
+            i = int(math.log10(v / self._min) * self._scale) + 1
+            if i >= self._n:
+                i = self._n - 1
+        else:
+            i = 0
+        self._counts[i] += 1
+        self.count += 1
+        self.sum += v
+        if v > self.max:
+            self.max = v
+
+    def _upper(self, i):
+        return self._min * 10 ** (i / self._scale)
+
+    def quantile(self, q):
+        """returns the upper bound of the bucket containing quantile q, or
+        nan if nothing was observed."""
+        counts = list(self._counts)
+        total = sum(counts)
+        if not total:
+            return float('nan')
+        rank = q * total
+        acc = 0
+        for i, c in enumerate(counts):
+            acc += c
+            if acc >= rank and c:
+                # the last bucket has no upper bound
+                if i == self._n - 1:
+                    return self.max
+                # never report more than the largest observed value
+                return min(self._upper(i), self.max)
+        return self.max
+
+    def get_stats(self):
+        n = self.count
+        d = {'count': n,
+             'mean': self.sum / n if n else float('nan'),
+             'max': self.max}
+        for q in QUANTILES:
+            d['p%d' % int(q * 100)] = self.quantile(q)
+        return d
+
+    def reset(self):
+        self._counts = [0] * self._n
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in labels)
+
+
+class Metrics(object):
+
+    def __init__(self, prefix='microfview'):
+        """latency histograms (seconds) per stage and counters.
+
+        Only the mainloop updates metrics, exporting them from other
+        threads does not take a lock, so an export may be a few
+        observations out of date.
+        """
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self.started = time.time()
+
+    def observe(self, stage, seconds):
+        """record the duration of a stage (Acquire, a plugin identifier, ...)"""
+        h = self._histograms.get(stage)
+        if h is None:
+            h = self._histograms[stage] = Histogram()
+        h.observe(seconds)
+
+    def inc(self, name, n=1, **labels):
+        """increment counter name (with optional labels) by n"""
+        key = (name, tuple(sorted(labels.items()))) if labels else (name, ())
+        self._counters[key] = self._counters.get(key, 0) + n
+
+    def get_histogram(self, stage):
+        return self._histograms.get(stage)
+
+    def get_counter(self, name, **labels):
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def get_stats(self):
+        """returns a dict of stage to histogram stats (count, mean, max,
+        p50, p95, p99) and a dict of counters ('name{labels}' to value)."""
+        stages = dict((k, h.get_stats()) for k, h in list(self._histograms.items()))
+        counters = dict((n + _labels(l), v) for (n, l), v in list(self._counters.items()))
+        return stages, counters
+
+    def reset(self):
+        for h in list(self._histograms.values()):
+            h.reset()
+        self._counters.clear()
+
+    def to_prometheus(self):
+        """returns the metrics in the Prometheus text exposition format"""
+        p = self.prefix
+        out = []
+        name = '%s_stage_seconds' % p
+        out.append('# HELP %s time spent per frame in each stage of the mainloop' % name)
+        out.append('# TYPE %s summary' % name)
+        maxes = []
+        for stage, h in sorted(self._histograms.items()):
+            for q in QUANTILES:
+                v = h.quantile(q)
+                if v == v:
+                    out.append('%s%s %.9g' % (name, _labels((('stage', stage), ('quantile', q))), v))
+            out.append('%s_sum%s %.9g' % (name, _labels((('stage', stage),)), h.sum))
+            out.append('%s_count%s %d' % (name, _labels((('stage', stage),)), h.count))
+            maxes.append('%s_max%s %.9g' % (name, _labels((('stage', stage),)), h.max))
+        out.append('# TYPE %s_max gauge' % name)
+        out.extend(maxes)
+
+        typed = set()
+        for (cname, labels), v in sorted(self._counters.items()):
+            cname = '%s_%s' % (p, cname)
+            if cname not in typed:
+                out.append('# TYPE %s counter' % cname)
+                typed.add(cname)
+            out.append('%s%s %d' % (cname, _labels(labels), v))
+
+        out.append('# TYPE %s_uptime_seconds gauge' % p)
+        out.append('%s_uptime_seconds %.3f' % (p, time.time() - self.started))
+        return '\n'.join(out) + '\n'
+
+
+class MetricsFileWriter(object):
+
+    def __init__(self, metrics, path, interval=10.0):
+        """rewrites path with the metrics every interval seconds, on a thread."""
+        self._metrics = metrics
+        self._path = path
+        self._interval = float(interval)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='MetricsFileWriter')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        logger.info('writing metrics to %s every %.1fs' % (self._path, self._interval))
+
+    def write(self):
+        # written to a temporary file first so readers never see a partial file
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self._metrics.to_prometheus())
+        os.rename(tmp, self._path)
+
+    def _loop(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.write()
+            except Exception:
+                logger.warn('could not write metrics', exc_info=True)
+
+    def stop(self):
+        """stop the thread and write the final metrics."""
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.to_prometheus()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+
+class MetricsServer(object):
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        """serves the metrics over http, on a thread. Only listens on
+        localhost by default."""
+        self._server = BaseHTTPServer.HTTPServer((host, int(port)), _Handler)
+        self._server.metrics = metrics
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer')
+        self._thread.daemon = True
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread.start()
+        logger.info('serving metrics on http://%s:%d/metrics' % self.address)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -13,8 +13,13 @@ NonBlockingPlugin:
   process_frame. But it skips a frame if process_frame did not return
   before the next incoming frame.
 
+BatchPlugin:
+  Derive from BatchPlugin and override method process_frames to get a
+  Plugin which is passed batches of frames, stacked into one array.
+
 """
 import threading
+import collections
 import time
 import logging
 import Queue
@@ -22,14 +27,68 @@ import Queue
 import cv2
 import numpy as np
 
+from .frame import FramePool, SharedFrame, release_frame
+from . import trace
 
 MESSAGE_SEEK = 0
+MESSAGE_SEEK_TIME = 1
+
+# what a NonBlockingPlugin does with new frames when its queue is full
+POLICY_DROP_NEWEST = 'drop_newest'
+POLICY_REPLACE_OLDEST = 'replace_oldest'
+POLICY_BLOCK = 'block'
+POLICY_SAMPLE = 'sample'
+
+POLICIES = (POLICY_DROP_NEWEST, POLICY_REPLACE_OLDEST, POLICY_BLOCK, POLICY_SAMPLE)
 
 
 class PluginFinished(Exception):
     pass
 
 
+def _pin_result(ret):
+    # a worker returning (views of) the shared frames it was given, as the
+    # frame or in the state, must keep a reference to them, otherwise the
+    # buffer could be reused while the mainloop still holds the result. the
+    # reference is never released so the buffer is simply garbage collected
+    # instead of returning to the pool.
+    if isinstance(ret, tuple):
+        frame, ret_state = ret
+    elif isinstance(ret, collections.Mapping):
+        frame, ret_state = None, ret
+    else:
+        frame, ret_state = ret, None
+    if isinstance(frame, SharedFrame):
+        frame.acquire()
+    if ret_state:
+        for v in ret_state.values():
+            if isinstance(v, SharedFrame):
+                v.acquire()
+
+
+def _split_result(ret, frame):
+    # returns the (frame, state) of the value returned by process_frame,
+    # where frame is the passed frame if none was returned
+    ret_state = {}
+    if isinstance(ret, tuple):
+        frame, ret_state = ret
+    elif isinstance(ret, collections.Mapping):
+        ret_state = ret
+    elif isinstance(ret, np.ndarray):
+        frame = ret
+    return frame, ret_state
+
+
+def release_state(state):
+    """release the frame referenced by a state returned from share_state()"""
+    release_frame(state.get('FRAME_ORIGINAL'))
+
+
+def _release_args(args):
+    release_frame(args[0])
+    release_state(args[5])
+
+
 class _Plugin(object):
     """Base class for
 
@@ -41,6 +100,12 @@ class _Plugin(object):
         uses_color (bool) : true if this plugin uses color information
         human_name (string) : human readable name of this plugin
         uid (string) : code identifying this plugin in the main application hierarchy
+        priority (int) : if set, the plugin may be skipped when the mainloop
+                         falls behind the capture, lowest priority first
+        budget (float) : if set, seconds per frame this plugin may use on
+                         average, it is skipped on frames as needed
+        target_rate (float) : if set, run at most this many times per
+                              second (of frame time)
     """
 
     def __init__(self, every=1, logger=None):
@@ -66,9 +131,24 @@ class _Plugin(object):
         self.return_state = True
         self.threaded = False
 
+        # adaptive scheduling, see microfview.schedule.DeadlineScheduler
+        self.priority = None
+        self.budget = None
+        self.target_rate = None
+
         self._t0 = self._t1 = np.nan
         self._uid = "UNKNOWN"
         self._msgq = None
+        self._frame_pool = None
+
+        # frames pushed to an asynchronous plugin which it dropped because
+        # it was busy
+        self.frames_dropped = 0
+
+        self._latency = np.nan
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._latency_n = 0
 
     @property
     def identifier(self):
@@ -89,6 +169,24 @@ class _Plugin(object):
     def tock(self):
         self._t1 = time.time()
 
+    def record_latency(self, current_time):
+        """record that the result for the frame pushed at current_time was
+        just delivered."""
+        latency = time.time() - current_time
+        self._latency = latency
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        self._latency_n += 1
+
+    def get_latency(self):
+        """returns a dict of the time (in seconds) from frames being pushed
+        to the plugin until their results were delivered."""
+        n = self._latency_n
+        return {'last': self._latency,
+                'mean': self._latency_total / n if n else np.nan,
+                'max': self._latency_max,
+                'count': n}
+
     def set_debug(self, d):
         self.debug = d
 
@@ -98,6 +196,39 @@ class _Plugin(object):
     def set_message_queue(self, q):
         self._msgq = q
 
+    def set_frame_pool(self, pool):
+        self._frame_pool = pool
+
+    def share_frame(self, frame):
+        """returns a read-only reference to frame that may be kept by another
+        thread. The reference must be released with release_frame()."""
+        if self._frame_pool is None:
+            self._frame_pool = FramePool()
+        return self._frame_pool.share(frame)
+
+    def share_state(self, state):
+        """returns a copy of state that may be kept by another thread. The
+        copy must be released with release_state()."""
+        state = state.copy()
+        # the cache belongs to the mainloop iteration
+        state.pop('FRAME_CACHE', None)
+        frame = state.get('FRAME_ORIGINAL')
+        if frame is not None:
+            state['FRAME_ORIGINAL'] = self.share_frame(frame)
+        return state
+
+    def _share_args(self, args):
+        # args are those of process_frame. the frame is usually the original
+        # frame, which is then only copied once
+        frame = self.share_frame(args[0])
+        if args[5].get('FRAME_ORIGINAL') is args[0]:
+            state = args[5].copy()
+            state.pop('FRAME_CACHE', None)
+            state['FRAME_ORIGINAL'] = frame.acquire()
+        else:
+            state = self.share_state(args[5])
+        return (frame,) + args[1:5] + (state,)
+
     def send_message(self, msg_type, msg_val):
         self._msgq.put((self._uid,msg_type,msg_val))
 
@@ -157,6 +288,12 @@ class _Plugin(object):
         """optionally return a dict describing any data hat is returned for this frame"""
         return {}
 
+    def get_requires(self):
+        """optionally return the state keys this plugin reads. Plugins that
+        declare this (and return no frame) may be run concurrently with
+        other plugins. None (the default) means unknown."""
+        return None
+
 
 class FuncWrapperPlugin(_Plugin):
     def __init__(self, func, name, every=1):
@@ -174,6 +311,24 @@ class FuncWrapperPlugin(_Plugin):
 class PluginChain(_Plugin, threading.Thread):
 
     def __init__(self, *plugins, **kwargs):
+        """PluginChain.
+
+        Calls the process_frame of each plugin in turn, passing on the
+        returned frame and state.
+
+        Keyword Args:
+          every (int): the chain gets called every Nth frame.
+          name (str): shown in the human readable name.
+          return_frame, return_state (bool): return the frame / state of
+            the last plugin to the mainloop.
+          pipelined (bool): run each plugin on its own thread, handing
+            frames to the next plugin through a queue. Results are
+            stored in frame order by the mainloop on the frame during which
+            they complete, and returned to the mainloop on a later frame.
+            Frames are dropped when the first plugin is busy.
+          queue_size (int): for pipelined chains, the number of frames
+            waiting for each plugin. Defaults to 1.
+        """
         _Plugin.__init__(self, every=kwargs.get('every', 1), logger=kwargs.get('logger', None))
         threading.Thread.__init__(self)
         self.daemon = True
@@ -193,6 +348,15 @@ class PluginChain(_Plugin, threading.Thread):
         self._res_queue.put(False)
         self._et = np.nan
 
+        self._pipelined = bool(kwargs.get('pipelined', False))
+        if self._pipelined:
+            self.threaded = True
+            queue_size = int(kwargs.get('queue_size', 1))
+            self._stage_queues = [Queue.Queue(maxsize=queue_size) for _ in self._plugins]
+            self._pipe_results = Queue.Queue()
+            self._stage_et = [np.nan] * len(self._plugins)
+            self._stage_threads = []
+
         if ('return_last_frame' in kwargs) or ('return_last_state' in kwargs):
             raise ValueError("UPDATE YOUR CODE")
 
@@ -207,88 +371,214 @@ class PluginChain(_Plugin, threading.Thread):
             schema.update(p.get_schema())
         return schema
 
+    def get_requires(self):
+        requires = set()
+        for p in self._plugins:
+            r = p.get_requires()
+            if r is None:
+                return None
+            requires.update(r)
+        return requires
+
     def set_debug(self, d):
         map(lambda x: x.set_debug(d), self._plugins)
 
     def set_visible(self, v):
         map(lambda x: x.set_visible(v), self._plugins)
 
+    def set_frame_pool(self, pool):
+        self._frame_pool = pool
+        map(lambda x: x.set_frame_pool(pool), self._plugins)
+
     def start(self, capture_object):
         map(lambda x: x.start(capture_object), self._plugins)
-        if self.threaded:
+        if self._pipelined:
+            for i in range(len(self._plugins)):
+                t = threading.Thread(target=self._run_stage, args=(i,), name='%s:%d' % (self.human_name, i))
+                t.daemon = True
+                t.start()
+                self._stage_threads.append(t)
+            logging.debug('plugin %s started %d threads' % (self.identifier, len(self._stage_threads)))
+        elif self.threaded:
             threading.Thread.start(self)
             logging.debug('plugin %s started thread' % self.identifier)
 
     def stop(self):
         """compatibility function."""
         map(lambda x: x.stop(), self._plugins)
-        if self.threaded:
+        if self._pipelined:
+            if self._stage_threads:
+                # each stage passes this on to the next before exiting
+                self._stage_queues[0].put(None)
+            for t in self._stage_threads:
+                t.join()
+            self._stage_threads = []
+        elif self.threaded:
             self._arg_queue.put(None)
             self.join()
 
     def get_execution_time(self):
-        if self.threaded:
+        if self._pipelined:
+            # the throughput is set by the slowest stage
+            return np.nanmax(self._stage_et) if not np.all(np.isnan(self._stage_et)) else np.nan
+        elif self.threaded:
             return self._et
         else:
             return self._t1 - self._t0
 
+    def get_stage_times(self):
+        """returns the last execution time of each plugin of a pipelined chain"""
+        return list(self._stage_et)
+
     def run(self):
         while True:
-            args = self._arg_queue.get()
+            item = self._arg_queue.get()
             # thread was quit
-            if args is None:
+            if item is None:
                 break
             else:
+                args, storem = item
                 try:
                     t0 = time.time()
-                    self._res_queue.put(self._call_plugins(*args))
+                    # only the results of the chain are stored and returned,
+                    # not the upstream state it was passed
+                    ret_state = {}
+                    frame, _ = self._call_plugins(*args, written=ret_state)
+                    _pin_result((frame, ret_state) if self.return_frame else ret_state)
+                    # hand over the result now, tagged with the frame it is from
+                    if ret_state:
+                        storem.store_completed(self.identifier, frame, *args[1:5] + (ret_state,))
+                    self.record_latency(args[4])
+                    self._res_queue.put((frame, ret_state))
                     self._et = time.time() - t0
                 except Exception as e:
                     self.logger.warn(e.message, exc_info=True)
                     self._res_queue.put(e)
                     break
+                finally:
+                    _release_args(args)
 
-    def _call_plugins(self, frame, frame_number, frame_count, frame_time, current_time, state):
-        for p in self._plugins:
+    def _call_plugin(self, p, frame, frame_number, frame_count, frame_time, current_time, state, written=None):
+        with trace.span(p.identifier, cat='plugin', frame_number=frame_number):
             ret = p.process_frame(frame, frame_number, frame_count, frame_time, current_time, state)
-            # if ret is False, the non-blocking plugin was
-            # still processing the old frame.
-            # if it is None then the plugin didn't return
-            # anything useful
-            # if is a 2-tuple then it is a frame and a dict
-            if ret is not None:
-                ret_state = {}
-                if ret is False:
-                    self.logger.warn("non-blocking plugins in chain not supported")
-                elif isinstance(ret, tuple):
-                    frame, ret_state = ret
-                elif isinstance(ret, dict):
-                    ret_state = ret
-                elif isinstance(ret, np.ndarray):
-                    frame = ret
-                state.update(ret_state)
+        # if ret is False, the non-blocking plugin was
+        # still processing the old frame.
+        # if it is None then the plugin didn't return
+        # anything useful
+        # if is a 2-tuple then it is a frame and a dict
+        if ret is not None:
+            ret_state = {}
+            if ret is False:
+                self.logger.warn("non-blocking plugins in chain not supported")
+            elif isinstance(ret, tuple):
+                frame, ret_state = ret
+            elif isinstance(ret, collections.Mapping):
+                ret_state = ret
+            elif isinstance(ret, np.ndarray):
+                frame = ret
+            state.update(ret_state)
+            if written is not None:
+                written.update(ret_state)
+        return frame
+
+    def _call_plugins(self, frame, frame_number, frame_count, frame_time, current_time, state, written=None):
+        for p in self._plugins:
+            frame = self._call_plugin(p, frame, frame_number, frame_count, frame_time, current_time, state, written)
         return frame, state
 
+    def _run_stage(self, i):
+        p = self._plugins[i]
+        in_queue = self._stage_queues[i]
+        last = (i == len(self._plugins) - 1)
+        out_queue = self._pipe_results if last else self._stage_queues[i + 1]
+        while True:
+            item = in_queue.get()
+            # chain was stopped
+            if item is None:
+                out_queue.put(None)
+                break
+            # item is [shared frame, frame, frame_number, frame_count, frame_time,
+            #          current_time, state, exception, storem, results of the chain]
+            if item[7] is None:
+                t0 = time.time()
+                try:
+                    item[1] = self._call_plugin(p, *item[1:7], written=item[9])
+                except Exception as e:
+                    if not isinstance(e, PluginFinished):
+                        self.logger.warn(e.message, exc_info=True)
+                    # passed on to be re-raised in the main thread
+                    item[7] = e
+                self._stage_et[i] = time.time() - t0
+            if last:
+                _pin_result((item[1], item[9]) if self.return_frame else item[9])
+                if (item[7] is None) and item[9]:
+                    # hand over the result now, tagged with the frame it is from
+                    item[8].store_completed(self.identifier, *item[1:6] + [item[9]])
+                self.record_latency(item[5])
+                release_frame(item[0])
+                release_state(item[6])
+                item[0] = item[6] = item[8] = None
+            out_queue.put(item)
+
+    def _push_pipelined(self, frame, frame_number, frame_count, frame_time, current_time, state, storem):
+        # drop new frames if the first stage is busy. only the mainloop puts
+        # frames on the queue, so if it is not full now it won't be when we put
+        if not self._stage_queues[0].full():
+            shared = self.share_frame(frame)
+            self._stage_queues[0].put_nowait([shared, shared, frame_number, frame_count,
+                                              frame_time, current_time, self.share_state(state), None, storem, {}])
+        else:
+            self.frames_dropped += 1
+
+        ret = False
+        while True:
+            try:
+                item = self._pipe_results.get_nowait()
+            except Queue.Empty:
+                break
+            if item is None:
+                continue
+            frame, error, ret_state = item[1], item[7], item[9]
+            # re-raise exceptions (such as PluginFinished) back to the main thread
+            if error is not None:
+                raise error
+            ret = frame, ret_state
+
+        if ret is False:
+            # we are still busy
+            return False
+        frame, ret_state = ret
+        if self.return_frame and self.return_state:
+            return frame, ret_state
+        elif self.return_frame:
+            return frame
+        elif self.return_state:
+            return ret_state
+        else:
+            return None
+
     def push_frame(self, frame, frame_number, frame_count, frame_time, current_time, state, storem):
+        if self._pipelined:
+            return self._push_pipelined(frame, frame_number, frame_count, frame_time, current_time, state, storem)
         if self.threaded:
             ret = self._res_queue.get()
             # re-raise exceptions (such as PluginFinished) back to the main thread
             if isinstance(ret, Exception):
                 raise ret
-            # fixme: copying the frame and blanking the state seems heavy handed. I really need to
-            # fixme: replace this state object with something smarter - a lockable or freezable dict maybe?
-            self._arg_queue.put((frame.copy(), frame_number, frame_count, frame_time, current_time, {'KEY':None}))
+            # the worker gets a copy-on-write copy of the full state
+            self._arg_queue.put((self._share_args((frame, frame_number, frame_count, frame_time, current_time, state)), storem))
         else:
             ret = self._call_plugins(frame, frame_number, frame_count, frame_time, current_time, state)
 
         ret_state = {}
         if isinstance(ret, tuple):
             frame, ret_state = ret
-        elif isinstance(ret, dict):
+        elif isinstance(ret, collections.Mapping):
             ret_state = ret
         elif isinstance(ret, np.ndarray):
             frame = ret
-        if ret_state:
+        # threaded chains hand over their results when they complete
+        if ret_state and not self.threaded:
             storem.store(self.identifier, frame, frame_number, frame_count, frame_time, current_time, ret_state)
 
         if self.return_frame and self.return_state:
@@ -309,7 +599,7 @@ class BlockingPlugin(_Plugin):
             ret_state = {}
             if isinstance(ret, tuple):
                 frame, ret_state = ret
-            elif isinstance(ret, dict):
+            elif isinstance(ret, collections.Mapping):
                 ret_state = ret
             elif isinstance(ret, np.ndarray):
                 frame = ret
@@ -321,23 +611,58 @@ class BlockingPlugin(_Plugin):
 
 class NonBlockingPlugin(_Plugin, threading.Thread):
 
-    def __init__(self, every=1, logger=None):
+    def __init__(self, every=1, logger=None, queue_size=1, policy=POLICY_DROP_NEWEST, timeout=None, sample_every=1):
         """NonBlockingPlugin.
 
         Starts a worker thread that listens for incoming frames. If a new
-        frame arrives and the plugin is still processing the old frame, the
-        new plugin is dropped.
+        frame arrives and the queue of frames waiting for the worker is
+        full, the policy decides what happens.
 
         Args:
           every (int): process_frame gets called every Nth frame.
+          queue_size (int, optional): number of frames waiting for the
+            worker. Defaults to 1.
+          policy (str, optional): what to do when the queue is full. One of
+            'drop_newest' (discard the new frame), 'replace_oldest'
+            (discard the oldest waiting frame, so the worker always gets
+            the latest), 'block' (wait up to timeout seconds for space,
+            then discard the new frame) or 'sample' (only queue every
+            sample_every-th frame, discarding the new frame when full).
+            Defaults to 'drop_newest'.
+          timeout (float, optional): for 'block', seconds to wait for space
+            in the queue. Defaults to None (wait as long as the worker
+            thread is running).
+          sample_every (int, optional): for 'sample', queue one frame in
+            this many. Defaults to 1. The other frames are counted in
+            frames_sampled_out, not as dropped.
         """
         _Plugin.__init__(self, every, logger)
         threading.Thread.__init__(self)
         self.daemon = True
-        self._arg_queue = Queue.Queue(maxsize=1)
-        self._res_queue = Queue.Queue(maxsize=1)
+
+        if int(queue_size) < 1:
+            raise ValueError("queue_size has to be bigger than 0")
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of %s" % (POLICIES,))
+        if int(sample_every) < 1:
+            raise ValueError("sample_every has to be bigger than 0")
+        self._queue_size = int(queue_size)
+        self._policy = policy
+        self._timeout = timeout
+        self._sample_every = int(sample_every)
+
+        self._arg_queue = Queue.Queue(maxsize=self._queue_size)
+        # results are drained by the mainloop on every frame
+        self._res_queue = Queue.Queue()
         self._et = np.nan
 
+        self.frames_submitted = 0
+        self.frames_processed = 0
+        self.frames_sampled_out = 0
+        self._warned_dead = False
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
         self.threaded = True
 
     # we manage our own t0 and t1 based on the real time of execution
@@ -346,7 +671,22 @@ class NonBlockingPlugin(_Plugin, threading.Thread):
     def get_execution_time(self):
         return self._et
 
+    def get_stats(self):
+        """returns a dict of queue counters. queue wait is the time (in
+        seconds) frames waited in the queue before the worker took them."""
+        processed = self.frames_processed
+        return {'policy': self._policy,
+                'queue_size': self._queue_size,
+                'queued': self._arg_queue.qsize(),
+                'submitted': self.frames_submitted,
+                'processed': processed,
+                'dropped': self.frames_dropped,
+                'sampled_out': self.frames_sampled_out,
+                'queue_wait_mean': self.queue_wait_total / processed if processed else np.nan,
+                'queue_wait_max': self.queue_wait_max}
+
     def start(self, capture_object):
+        self.name = self.identifier
         threading.Thread.start(self)
         logging.debug('plugin %s started thread' % self.identifier)
 
@@ -355,44 +695,223 @@ class NonBlockingPlugin(_Plugin, threading.Thread):
         # block to make sure the thread finishes
         self._arg_queue.put(None)
 #        self.join()
-    
+
+    def _put_blocking(self, item):
+        # wait for space while the worker is running, it never makes space
+        # once it has died
+        if self._timeout is not None:
+            self._arg_queue.put(item, timeout=self._timeout)
+            return
+        while True:
+            if not self.is_alive():
+                if not self._warned_dead:
+                    self.logger.warn('%s worker thread is not running, dropping frames' % self.identifier)
+                    self._warned_dead = True
+                raise Queue.Full
+            try:
+                self._arg_queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def _enqueue(self, args, storem):
+        # returns True if the frame was queued. only the mainloop puts frames
+        # on the queue, so if it is not full now it won't be when we put
+        if self._arg_queue.full():
+            if self._policy == POLICY_REPLACE_OLDEST:
+                try:
+                    _, old, _ = self._arg_queue.get_nowait()
+                    _release_args(old)
+                    self.frames_dropped += 1
+                except Queue.Empty:
+                    # the worker took it in the meantime
+                    pass
+            elif self._policy == POLICY_BLOCK:
+                args = self._share_args(args)
+                try:
+                    self._put_blocking((time.time(), args, storem))
+                    return True
+                except Queue.Full:
+                    _release_args(args)
+                    return False
+            else:
+                return False
+        self._arg_queue.put_nowait((time.time(), self._share_args(args), storem))
+        return True
+
     def push_frame(self, frame, frame_number, frame_count, frame_time, current_time, state, storem):
         """push a frame to the worker queue.
 
-        Returns False if the worker thread is still processing the last frame.
+        Returns False if the worker has not finished any frame since the
+        last call. Results are handed over by the worker as soon as they
+        complete and stored (tagged with the number and time of the frame
+        they were computed from) by the mainloop before the end of its
+        current frame.
         """
-        try:
-            # fixme: copying the frame and blanking the state seems heavy handed. I really need to
-            # fixme: replace this state object with something smarter - a lockable or freezable dict maybe?
-            self._arg_queue.put_nowait((frame.copy(), frame_number, frame_count, frame_time, current_time, {'KEY':None}))
-        except Queue.Full:
-            # drop new frames if we are busy
-            pass
-        try:
-            ret_state = {}
-            ret = self._res_queue.get_nowait()
-            if isinstance(ret, tuple):
-                frame, ret_state = ret
-            elif isinstance(ret, dict):
-                ret_state = ret
-            elif isinstance(ret, np.ndarray):
-                frame = ret
-            if ret_state:
-                storem.store(self.identifier, frame, frame_number, frame_count, frame_time, current_time, ret_state)
-            return frame, ret_state
-        except Queue.Empty:
+        self.frames_submitted += 1
+        if self._policy == POLICY_SAMPLE and (self.frames_submitted - 1) % self._sample_every:
+            # not wanted, rather than dropped
+            self.frames_sampled_out += 1
+        # the worker gets a copy-on-write copy of the full state
+        elif not self._enqueue((frame, frame_number, frame_count, frame_time, current_time, state), storem):
+            self.frames_dropped += 1
+
+        # the results were already handed over by the worker, only the last is
+        # returned to the mainloop
+        ret = False
+        while True:
+            try:
+                ret = self._res_queue.get_nowait()
+            except Queue.Empty:
+                break
+
+        if ret is False:
             # we are still busy
             return False
-            
+        return _split_result(ret, frame)
 
     def run(self):
         while True:
-            args = self._arg_queue.get()
+            item = self._arg_queue.get()
             #thread was quit
-            if args is None:
+            if item is None:
                 break
             else:
                 t0 = time.time()
-                self._res_queue.put(self.process_frame(*args))
+                t_put, args, storem = item
+                wait = t0 - t_put
+                self.queue_wait_total += wait
+                self.queue_wait_max = max(self.queue_wait_max, wait)
+                try:
+                    with trace.span(self.identifier, cat='plugin', frame_number=args[1]):
+                        ret = self.process_frame(*args)
+                    _pin_result(ret)
+                    # hand over the result now, tagged with the frame it is from
+                    frame, ret_state = _split_result(ret, args[0])
+                    if ret_state:
+                        storem.store_completed(self.identifier, frame, *args[1:5] + (ret_state,))
+                    self.record_latency(args[4])
+                finally:
+                    _release_args(args)
+                self._res_queue.put(ret)
                 self._et = time.time() - t0
+                self.frames_processed += 1
+
+
+class BatchPlugin(_Plugin):
+
+    def __init__(self, every=1, logger=None, batch_size=16):
+        """BatchPlugin.
+
+        Collects frames into batches and processes each batch with a single
+        call to process_frames, so that the processing can be vectorized
+        over time (background models, temporal filters, frame differences).
+        Derive from BatchPlugin and override process_frames. Results are
+        stored once the batch has been processed, tagged with the frame
+        they belong to. A partial batch is processed when the plugin is
+        stopped or the frame shape changes.
+
+        Args:
+          every (int): every Nth frame is added to the batch.
+          batch_size (int, optional): number of frames per batch.
+            Defaults to 16.
+        """
+        _Plugin.__init__(self, every, logger)
+        if int(batch_size) < 1:
+            raise ValueError("batch_size has to be bigger than 0")
+        self.batch_size = int(batch_size)
+
+        # the batch is copied into a preallocated stack of frames
+        self._stack = None
+        self._numbers = np.zeros(self.batch_size, dtype=np.int64)
+        self._counts = np.zeros(self.batch_size, dtype=np.int64)
+        self._times = np.zeros(self.batch_size, dtype=np.float64)
+        self._current_times = np.zeros(self.batch_size, dtype=np.float64)
+        self._states = []
+        self._n = 0
+        self._storem = None
+
+        # the batch is processed inside push_frame, there is no frame to return
+        self.return_frame = False
+
+    def process_frames(self, frames, frame_numbers, frame_counts, frame_times, current_times, states):
+        """override this function.
+
+        Args:
+          frames (ndarray): the frames of the batch, shape (N,H,W[,C]). The
+            array is reused for the next batch.
+          frame_numbers, frame_counts, frame_times, current_times (ndarray):
+            per frame values, as passed to process_frame.
+          states (list): the state of each frame, without FRAME_ORIGINAL
+            and FRAME_CACHE.
+
+        returns:
+          a sequence of N results (or None), each following the return
+          conventions of process_frame.
+        """
+        pass
 
+    def _flush(self):
+        n = self._n
+        if not n:
+            return None
+        self._n = 0
+        states, self._states = self._states, []
+        frames = self._stack[:n]
+        with trace.span(self.identifier, cat='plugin', frames=n):
+            rets = self.process_frames(frames, self._numbers[:n], self._counts[:n], self._times[:n],
+                                       self._current_times[:n], states)
+        if rets is None:
+            return None
+        if len(rets) != n:
+            raise ValueError("%s returned %d results for %d frames" % (self.identifier, len(rets), n))
+
+        ret_state = None
+        for i, ret in enumerate(rets):
+            if ret is None:
+                continue
+            frame, ret_state = _split_result(ret, frames[i])
+            if ret_state:
+                self._storem.store(self.identifier, frame, int(self._numbers[i]), int(self._counts[i]),
+                                   float(self._times[i]), float(self._current_times[i]), ret_state)
+            self.record_latency(self._current_times[i])
+        # only the state of the last frame of the batch
+        return ret_state if rets[n - 1] is not None else None
+
+    def stop(self):
+        """process the remaining frames."""
+        if self._n and (self._storem is not None):
+            self._flush()
+
+    def push_frame(self, frame, frame_number, frame_count, frame_time, current_time, state, storem):
+        """add a frame to the batch, processing the batch once it is full.
+
+        Returns the state of this frame when it completed a batch,
+        otherwise None. Every result is stored with its own frame.
+        """
+        self._storem = storem
+        ret_state = None
+        if (self._stack is None) or (self._stack.shape[1:] != frame.shape) or (self._stack.dtype != frame.dtype):
+            # the results of the earlier frames are stored, not returned
+            self._flush()
+            self._stack = np.empty((self.batch_size,) + frame.shape, dtype=frame.dtype)
+
+        i = self._n
+        self._stack[i] = frame
+        self._numbers[i] = frame_number
+        self._counts[i] = frame_count
+        self._times[i] = frame_time
+        self._current_times[i] = current_time
+        state = state.copy()
+        # the frame is already in the stack and the cache belongs to the mainloop
+        state.pop('FRAME_ORIGINAL', None)
+        state.pop('FRAME_CACHE', None)
+        self._states.append(state)
+        self._n += 1
+
+        if self._n == self.batch_size:
+            ret_state = self._flush()
+        if ret_state:
+            # the frame was not changed, so it is not passed on
+            return ret_state
+        return None
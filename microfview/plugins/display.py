@@ -8,7 +8,7 @@ except ImportError:
 
 from ..plugin import BlockingPlugin, MESSAGE_SEEK
 from ..store import FrameStore, SPECIAL_STATE_KEYS, TrackedObjectType, DetectedObjectType, ContourType, UNIT_PIXELS, PointArrayType
-from ..util import is_color
+from ..util import is_color, compose_transforms
 
 
 def draw_state(frame, val, M):
@@ -50,11 +50,14 @@ class DisplayPlugin(BlockingPlugin, FrameStore):
     def __init__(self, window_name, original_frame=False, every=1, seek=False):
         super(DisplayPlugin, self).__init__(every=every)
         self.shows_windows = True
+        # overlays are drawn in colour on the original frame
+        self.uses_color = True
         self.human_name = "%s(%s)" % (self.__class__.__name__, window_name)
         self._show_original_frame = original_frame
         self._seek = seek
         self._seek_frame_max = None
         self.__window_name = window_name
+        self._get_capture_transform = None
 
         # in main operation we are called via the framestore interface
         self.__last_img = None
@@ -69,6 +72,7 @@ class DisplayPlugin(BlockingPlugin, FrameStore):
     def start(self, capture_object):
         # wait until here to get the window name because it depends on the uid
         self._window_name = self.debug_window_name(self.__window_name)
+        self._get_capture_transform = getattr(capture_object, 'get_transform_matrix', None)
         if self.visible:
             # create a resizable window but limit its size to less than the screen size
             cv2.namedWindow(self._window_name, getattr(cv2,'WINDOW_NORMAL',0))
@@ -92,20 +96,30 @@ class DisplayPlugin(BlockingPlugin, FrameStore):
     def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
         if self.visible:
             img = frame if not self._show_original_frame else state['FRAME_ORIGINAL']
-            if self._show_original_frame and ('FRAME_TRANSFORM' in state):
-                M = state['FRAME_TRANSFORM']
-            else:
-                M = None
+            if not img.flags.writeable:
+                # frames shared with threaded plugins are read-only
+                img = img.copy()
+            M = self._original_frame_transform(state) if self._show_original_frame else None
             draw_all_state(img, state, M)
             cv2.imshow(self._window_name, img)
 
+    def _original_frame_transform(self, state):
+        # FRAME_TRANSFORM maps to full frame coordinates, but the original
+        # frame may itself be cropped or scaled by the capture
+        M = state.get('FRAME_TRANSFORM')
+        Mc = self._get_capture_transform() if self._get_capture_transform is not None else None
+        if (M is None) or (Mc is None):
+            return M
+        return compose_transforms(cv2.invertAffineTransform(Mc), M)
+
     def store_state(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
         if self.visible:
-            draw_all_state(self.__last_img, state, state.get('FRAME_TRANSFORM', None))
+            draw_all_state(self.__last_img, state, self._original_frame_transform(state))
 
     def store_begin_frame(self, buf, frame_number, frame_count, frame_timestamp, now, key):
         if self.visible:
-            self.__last_img = buf
+            # draw on a copy, threaded plugins may still be reading the frame
+            self.__last_img = buf.copy()
 
     def store_end_frame(self, buf, frame_number, frame_count, frame_timestamp, now):
         if self.visible:
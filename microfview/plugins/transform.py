@@ -2,6 +2,7 @@ import yaml
 import numpy as np
 
 from ..plugin import BlockingPlugin
+from ..util import compose_transforms
 
 
 class ExtractROIPlugin(BlockingPlugin):
@@ -29,4 +30,6 @@ class ExtractROIPlugin(BlockingPlugin):
             _img = img.copy()
         else:
             _img = img
-        return _img, {'FRAME_TRANSFORM':self._M}
+        # the frame itself may already be cropped or scaled by the capture
+        M = state.get('FRAME_TRANSFORM')
+        return _img, {'FRAME_TRANSFORM':self._M if M is None else compose_transforms(M, self._M)}
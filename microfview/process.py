@@ -0,0 +1,268 @@
+"""microfview.process module
+
+Provides ProcessPlugin, a plugin which runs process_frame in a worker
+process, so that CPU heavy plugins are not limited by the GIL.
+
+Frames are passed to the worker through a ring of shared memory slots
+and results are passed back through a queue, using the same return
+conventions (frame, state tuple, dict or ndarray) as other plugins.
+"""
+import ctypes
+import cPickle
+import multiprocessing
+import multiprocessing.sharedctypes
+import Queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .plugin import _Plugin, PluginFinished, _split_result
+from . import trace
+
+_RESULT = 0
+_ERROR = 1
+
+
+def _picklable_exception(e):
+    try:
+        cPickle.dumps(e, cPickle.HIGHEST_PROTOCOL)
+        return e
+    except Exception:
+        return RuntimeError(repr(e))
+
+
+def _process_worker(target, wrapped, capture_object, shm, slot_bytes, tasks, results):
+    # a wrapped plugin is started in the worker. derived plugins were
+    # already started by the mainloop before the worker was forked
+    if wrapped:
+        target.start(capture_object)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, shape, dtype, frame_number, frame_count, frame_time, current_time, state = task
+            state = cPickle.loads(state)
+            frame = np.frombuffer(shm, dtype=np.uint8, count=slot_bytes, offset=slot * slot_bytes)
+            frame = frame[:int(np.prod(shape)) * np.dtype(dtype).itemsize].view(dtype).reshape(shape)
+            frame.flags.writeable = False
+            t0 = time.time()
+            try:
+                ret = target.process_frame(frame, frame_number, frame_count, frame_time, current_time, state)
+                msg = (_RESULT, slot, ret, time.time() - t0)
+            except Exception as e:
+                if not isinstance(e, PluginFinished):
+                    target.logger.warn(e.message, exc_info=True)
+                msg = (_ERROR, slot, _picklable_exception(e), time.time() - t0)
+            # a returned view of the slot is pickled (copied) by the queue
+            results.put(msg)
+            if target.shows_windows:
+                cv2.waitKey(1)
+            if msg[0] == _ERROR:
+                break
+    finally:
+        if wrapped:
+            target.stop()
+        # tell the collecting thread we are done
+        results.put(None)
+
+
+class ProcessPlugin(_Plugin):
+
+    def __init__(self, every=1, logger=None, plugin=None, slots=2):
+        """ProcessPlugin.
+
+        Runs process_frame in a worker process. Either derive from
+        ProcessPlugin and override process_frame, or pass an existing
+        plugin to run its process_frame (and start and stop) in the worker.
+        Like NonBlockingPlugin, frames are dropped while the worker is busy.
+
+        The worker receives a read-only copy of the frame in shared memory
+        and a copy of the state (without FRAME_ORIGINAL and FRAME_CACHE).
+        The state, the results and any exception (such as PluginFinished)
+        are passed between the processes and must be picklable.
+
+        Args:
+          every (int): process_frame gets called every Nth frame.
+          plugin (plugin, optional): plugin to run in the worker.
+          slots (int, optional): number of frames in the shared memory
+            ring. Defaults to 2 (one processed, one waiting).
+        """
+        if plugin is not None:
+            every = plugin.every
+        _Plugin.__init__(self, every, logger)
+        self._plugin = plugin
+        if plugin is not None:
+            self.human_name = "%s(%s)" % (self.__class__.__name__, plugin.human_name)
+            self.shows_windows = plugin.shows_windows
+            self.uses_color = plugin.uses_color
+            self.priority = plugin.priority
+            self.budget = plugin.budget
+            self.target_rate = plugin.target_rate
+
+        self._nslots = max(1, int(slots))
+        self._capture_object = None
+        self._process = None
+        self._shm = None
+        self._slot_bytes = 0
+        self._free_slots = []
+        self._slot_frames = {}
+        self._tasks = self._results = None
+        self._collector = None
+        self._warned_pickle = False
+        # results (or exceptions) collected from the worker
+        self._done = Queue.Queue()
+        self._et = np.nan
+
+        self.threaded = True
+
+    # we manage our own t0 and t1 based on the real time of execution
+    def tick(self): pass
+    def tock(self): pass
+    def get_execution_time(self):
+        return self._et
+
+    def set_uid(self, uid):
+        self._uid = uid
+        if self._plugin is not None:
+            self._plugin.set_uid(uid)
+
+    def set_debug(self, d):
+        self.debug = d
+        if self._plugin is not None:
+            self._plugin.set_debug(d)
+
+    def set_visible(self, v):
+        self.visible = v
+        if self._plugin is not None:
+            self._plugin.set_visible(v)
+
+    def get_schema(self):
+        if self._plugin is not None:
+            return self._plugin.get_schema()
+        return {}
+
+    def get_requires(self):
+        if self._plugin is not None:
+            return self._plugin.get_requires()
+        return None
+
+    def start(self, capture_object):
+        # the worker is started with the first frame, once we know how big
+        # the shared memory has to be
+        self._capture_object = capture_object
+
+    def _start_worker(self, frame, storem):
+        self._slot_bytes = frame.nbytes
+        self._shm = multiprocessing.sharedctypes.RawArray(ctypes.c_uint8, self._slot_bytes * self._nslots)
+        self._slots = np.frombuffer(self._shm, dtype=np.uint8).reshape((self._nslots, self._slot_bytes))
+        self._free_slots = range(self._nslots)
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        target = self._plugin if self._plugin is not None else self
+        self._process = multiprocessing.Process(target=_process_worker,
+                                                args=(target, self._plugin is not None, self._capture_object, self._shm,
+                                                      self._slot_bytes, self._tasks, self._results))
+        self._process.daemon = True
+        self._process.start()
+        self.logger.debug('plugin %s started process %d' % (self.identifier, self._process.pid))
+        self._collector = threading.Thread(target=self._collect, args=(self._results, storem),
+                                           name='%s:collect' % self.human_name)
+        self._collector.daemon = True
+        self._collector.start()
+
+    def _pickle_state(self, state):
+        # the frame is already in shared memory and the cache belongs to the
+        # mainloop. everything else upstream plugins put in the state is
+        # passed on if it can be pickled
+        state = dict((k, v) for k, v in state.items() if k not in ('FRAME_ORIGINAL', 'FRAME_CACHE'))
+        try:
+            return cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            if not self._warned_pickle:
+                self.logger.warn('state can not be passed to worker process: %s' % e)
+                self._warned_pickle = True
+            return cPickle.dumps({'KEY': state.get('KEY')}, cPickle.HIGHEST_PROTOCOL)
+
+    def _collect(self, results, storem):
+        # hand over results as soon as the worker delivers them, tagged with
+        # the number and time of the frame they were computed from
+        while True:
+            msg = results.get()
+            if msg is None:
+                break
+            kind, slot, val, et = msg
+            shape, dtype, frame_number, frame_count, frame_time, current_time = self._slot_frames.pop(slot)
+            self._et = et
+            # the time spent in the worker process, as seen from here
+            trace.complete(self.identifier, time.time() - et, time.time(), cat='process', frame_number=frame_number)
+            if kind == _RESULT:
+                view = self._slots[slot, :int(np.prod(shape)) * np.dtype(dtype).itemsize].view(dtype).reshape(shape)
+                frame, ret_state = _split_result(val, view)
+                if ret_state:
+                    if frame is view:
+                        # the slot is reused before the result is stored
+                        frame = view.copy()
+                    storem.store_completed(self.identifier, frame, frame_number, frame_count, frame_time, current_time, ret_state)
+                self.record_latency(current_time)
+            self._free_slots.append(slot)
+            self._done.put((kind, val))
+
+    def stop(self):
+        """stop the worker process."""
+        if self._process is None:
+            return
+        self._tasks.put(None)
+        self._process.join(1.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+        self._collector.join(1.0)
+
+    def push_frame(self, frame, frame_number, frame_count, frame_time, current_time, state, storem):
+        """copy a frame to the worker.
+
+        Returns False if the worker is still processing the earlier frames.
+        """
+        if self._process is None:
+            if self._shm is not None:
+                # the worker has exited after an error
+                return False
+            self._start_worker(frame, storem)
+
+        # the results were already handed over when they were collected, only
+        # the last is returned to the mainloop
+        ret = False
+        while True:
+            try:
+                kind, val = self._done.get_nowait()
+            except Queue.Empty:
+                break
+            if kind == _ERROR:
+                # re-raise exceptions (such as PluginFinished) in the main thread
+                self._process.join(1.0)
+                self._process = None
+                self._collector.join(1.0)
+                raise val
+            ret = val
+
+        # only the mainloop takes free slots, the collecting thread returns them
+        if self._free_slots and frame.nbytes <= self._slot_bytes:
+            slot = self._free_slots.pop(0)
+            self._slots[slot, :frame.nbytes] = np.ascontiguousarray(frame).view(np.uint8).reshape(-1)
+            self._slot_frames[slot] = (frame.shape, frame.dtype.str, frame_number, frame_count, frame_time, current_time)
+            self._tasks.put((slot, frame.shape, frame.dtype.str, frame_number, frame_count, frame_time, current_time,
+                             self._pickle_state(state)))
+        elif frame.nbytes > self._slot_bytes:
+            self.logger.warn('frame %r too large for shared memory, dropped' % (frame.shape,))
+            self.frames_dropped += 1
+        else:
+            # drop new frames if we are busy
+            self.frames_dropped += 1
+
+        if ret is False:
+            # we are still busy
+            return False
+        return _split_result(ret, frame)
@@ -0,0 +1,280 @@
+"""microfview.schedule module
+
+Provides PluginSchedule, which orders plugins into levels that can run
+concurrently within a frame, based on the state keys each plugin reads
+(get_requires) and writes (the keys of get_schema).
+
+Plugins are only run concurrently if they
+  - declare what they read (get_requires does not return None),
+  - do not pass a frame on to the following plugins (return_frame is
+    False, e.g. plugins attached with attach_parallel_plugin) and
+  - do not show windows.
+Every other plugin is a barrier: it runs alone, after all plugins
+attached before it and before all plugins attached after it.
+
+A plugin is put in the first level after those of the plugins it
+depends on, i.e. earlier plugins which write a key it reads or writes,
+or read a key it writes. Results of a level are merged into the state in
+attach order, so the merged state is the same as when running the
+plugins one after the other.
+
+DeadlineScheduler decides each frame which plugins run, for plugins
+which declare a priority, a budget or a target_rate instead of (or as
+well as) a fixed every.
+"""
+import sys
+import math
+import logging
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger('microfview.schedule')
+
+
+def _can_run_concurrently(plugin):
+    return (plugin.get_requires() is not None) and \
+           (not plugin.shows_windows) and \
+           (not getattr(plugin, 'return_frame', True))
+
+
+class PluginSchedule(object):
+
+    def __init__(self, plugins, workers=0):
+        """schedule of plugins.
+
+        Args:
+          plugins (list): plugins in attach order.
+          workers (int, optional): number of threads to run plugins on.
+            Defaults to 0, running all plugins one after the other.
+        """
+        if workers > 1:
+            self.levels = self.build_levels(plugins)
+        else:
+            self.levels = [[p] for p in plugins]
+
+        self._pool = None
+        if any(len(l) > 1 for l in self.levels):
+            self._pool = ThreadPool(workers)
+            logger.info('running plugins on %d threads: %s' % (workers, self.describe()))
+
+    @staticmethod
+    def build_levels(plugins):
+        """returns a list of levels (lists of plugins in attach order) such
+        that the plugins in a level do not depend on each other."""
+        levels = []
+        # level of the last plugin to write / read each key
+        last_write = {}
+        last_read = {}
+        barrier = -1
+        for p in plugins:
+            writes = set(p.get_schema())
+            if not _can_run_concurrently(p):
+                lvl = len(levels)
+                barrier = lvl
+                levels.append([p])
+            else:
+                reads = set(p.get_requires())
+                lvl = barrier + 1
+                for k in reads | writes:
+                    if k in last_write:
+                        lvl = max(lvl, last_write[k] + 1)
+                for k in writes:
+                    if k in last_read:
+                        lvl = max(lvl, last_read[k])
+                if lvl == len(levels):
+                    levels.append([])
+                levels[lvl].append(p)
+                for k in reads:
+                    last_read[k] = max(lvl, last_read.get(k, lvl))
+            for k in writes:
+                last_write[k] = lvl
+        return levels
+
+    def describe(self):
+        return ' -> '.join('[%s]' % ', '.join(p.identifier for p in l) for l in self.levels)
+
+    def run_level(self, plugins, func):
+        """calls func(plugin) for each plugin, concurrently if possible.
+
+        returns a list of (plugin, return value, exc_info) in the order of
+        plugins, where exc_info is None if func did not raise.
+        """
+        def _call(plugin):
+            try:
+                return plugin, func(plugin), None
+            except Exception:
+                return plugin, None, sys.exc_info()
+
+        if (self._pool is None) or (len(plugins) < 2):
+            return map(_call, plugins)
+        return self._pool.map(_call, plugins)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+# why a plugin did or did not run on a frame
+DECISION_RUN = 'run'
+DECISION_EVERY = 'every'
+DECISION_RATE = 'rate'
+DECISION_BUDGET = 'budget'
+DECISION_SHED = 'shed'
+
+DECISIONS = (DECISION_RUN, DECISION_EVERY, DECISION_RATE, DECISION_BUDGET, DECISION_SHED)
+
+
+def _is_adaptive(plugin):
+    return (getattr(plugin, 'priority', None) is not None) or \
+           (getattr(plugin, 'budget', None) is not None) or \
+           (getattr(plugin, 'target_rate', None) is not None)
+
+
+class DeadlineScheduler(object):
+
+    def __init__(self, fps=None, live=True, alpha=0.2, margin=0.9):
+        """decides each frame which plugins run.
+
+        A plugin runs on a frame if frame_number % every == 0 and
+          - target_rate (Hz): at least 1/target_rate seconds (of frame
+            time) have passed since it last ran,
+          - budget (seconds): it has accumulated enough budget for its
+            measured execution time. Each frame adds budget seconds, so a
+            plugin slower than its budget runs on a fraction of the frames.
+          - priority (int): if the plugins selected on a live capture are
+            expected to take longer than a frame period (1/fps), plugins
+            with a priority are shed, lowest priority first, until they
+            fit. Plugins without a priority are never shed.
+        Execution times are exponentially weighted moving averages of
+        get_execution_time(). Threaded plugins are not counted towards the
+        frame period as they do not block the mainloop.
+
+        Args:
+          fps (float, optional): frame rate of the capture.
+          live (bool, optional): shed plugins when falling behind fps.
+            Defaults to True, should be False for video files, which are
+            not dropped when processing is slow.
+          alpha (float, optional): weight of new execution times.
+          margin (float, optional): fraction of the frame period plugins
+            may use.
+        """
+        if (fps is not None) and (fps > 0) and not math.isinf(fps) and not math.isnan(fps):
+            self.period = 1.0 / fps
+        else:
+            self.period = None
+        self.live = live
+        self.alpha = float(alpha)
+        self.margin = float(margin)
+
+        self._cost = {}
+        self._credit = {}
+        self._last_run = {}
+        # time of each iteration after the capture not spent in plugins
+        # (stores, display, ...)
+        self.overhead = 0.0
+
+        self.behind = False
+        self.decisions = {}
+        self.counts = {}
+
+    @staticmethod
+    def wanted(plugins):
+        """returns True if any plugin needs adaptive scheduling."""
+        return any(_is_adaptive(p) for p in plugins)
+
+    def _ewma(self, old, new):
+        if old is None:
+            return new
+        return old + self.alpha * (new - old)
+
+    def get_cost(self, plugin):
+        """returns the expected execution time of plugin (seconds)."""
+        return self._cost.get(plugin.identifier, 0.0)
+
+    def select(self, plugins, frame_number, frame_time):
+        """returns the set of plugins to run on this frame."""
+        decisions = {}
+        selected = []
+        for p in plugins:
+            d = DECISION_RUN
+            target_rate = getattr(p, 'target_rate', None)
+            budget = getattr(p, 'budget', None)
+            if frame_number % p.every:
+                d = DECISION_EVERY
+            elif target_rate:
+                last = self._last_run.get(p.identifier)
+                # allow for jitter of the frame timestamps
+                if (last is not None) and (frame_time - last) < 0.95 / target_rate:
+                    d = DECISION_RATE
+            if (d == DECISION_RUN) and (budget is not None):
+                cid = p.identifier
+                credit = self._credit.get(cid, 0.0) + budget
+                cost = self.get_cost(p)
+                # do not save up more than one run
+                self._credit[cid] = credit = min(credit, max(cost, budget))
+                if credit < cost:
+                    d = DECISION_BUDGET
+            decisions[p.identifier] = d
+            if d == DECISION_RUN:
+                selected.append(p)
+
+        behind = False
+        if self.live and (self.period is not None):
+            available = self.period * self.margin - self.overhead
+            blocking = lambda p: 0.0 if p.threaded else self.get_cost(p)
+            total = sum(blocking(p) for p in selected)
+            if total > available:
+                behind = True
+                # shed lowest priority first, later attached first on ties
+                order = sorted((p for p in selected if getattr(p, 'priority', None) is not None),
+                               key=lambda p: (p.priority, -plugins.index(p)))
+                for p in order:
+                    if total <= available:
+                        break
+                    if blocking(p) > 0:
+                        total -= blocking(p)
+                        selected.remove(p)
+                        decisions[p.identifier] = DECISION_SHED
+        if behind != self.behind:
+            logger.info('%s frame period of %.1fms' % ('falling behind' if behind else 'keeping up with',
+                                                         (self.period or 0) * 1000))
+        self.behind = behind
+
+        for cid, d in decisions.iteritems():
+            c = self.counts.setdefault(cid, dict.fromkeys(DECISIONS, 0))
+            c[d] += 1
+        self.decisions = decisions
+        return set(selected)
+
+    def update(self, plugins_run, frame_time, iteration_time):
+        """record the execution times of the plugins that ran on a frame
+        and the total time of the iteration."""
+        spent = 0.0
+        for p in plugins_run:
+            cid = p.identifier
+            et = p.get_execution_time()
+            if not math.isnan(et):
+                self._cost[cid] = self._ewma(self._cost.get(cid), et)
+                if not p.threaded:
+                    spent += et
+            if getattr(p, 'budget', None) is not None:
+                self._credit[cid] = self._credit.get(cid, 0.0) - self.get_cost(p)
+            self._last_run[cid] = frame_time
+        self.overhead = self._ewma(self.overhead, max(0.0, iteration_time - spent))
+
+    def remove(self, plugin):
+        for d in (self._cost, self._credit, self._last_run):
+            d.pop(plugin.identifier, None)
+
+    def get_decisions(self):
+        """returns a dict of plugin identifier to a dict with the decision
+        on the last frame ('last'), the expected execution time ('cost') and
+        the number of frames of each decision."""
+        out = {}
+        for cid, c in self.counts.iteritems():
+            d = dict(c)
+            d['last'] = self.decisions.get(cid)
+            d['cost'] = self._cost.get(cid, float('nan'))
+            out[cid] = d
+        return out
@@ -0,0 +1,190 @@
+"""microfview.state module
+
+Provides FrameState, the per frame state passed to (and merged from)
+plugins.
+
+FrameState:
+  A dict-like container whose keys known in advance (from the plugin
+  schemas) are stored in preallocated slots. copy() is O(1): the copy
+  shares storage with the original and whichever is written to first
+  copies it (copy-on-write), so threaded plugins can be handed the full
+  upstream state without the mainloop copying it. freeze() makes a state
+  read-only.
+
+StateLayout:
+  The mapping of keys to slots, built once when the mainloop starts.
+
+Note that only the container is copied on write, the values themselves
+are shared and must not be modified.
+"""
+import collections
+
+# always present in the state of every frame
+BUILTIN_KEYS = ('FRAME_ORIGINAL', 'FRAME_METADATA', 'FRAME_CACHE', 'KEY')
+
+_MISSING = object()
+
+
+class StateLayout(object):
+
+    def __init__(self, keys=()):
+        """the slots of a FrameState.
+
+        Args:
+          keys (iterable): the keys to preallocate slots for. The builtin
+            keys always have slots.
+        """
+        self.keys = []
+        self.index = {}
+        for k in tuple(BUILTIN_KEYS) + tuple(keys):
+            if k not in self.index:
+                self.index[k] = len(self.keys)
+                self.keys.append(k)
+        self.empty = [_MISSING] * len(self.keys)
+
+    @classmethod
+    def from_schemas(cls, schemas):
+        """returns the layout for a dict of plugin identifier to schema"""
+        keys = []
+        for schema in schemas.values():
+            keys.extend(sorted(schema))
+        return cls(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class FrozenStateError(TypeError):
+    pass
+
+
+class FrameState(collections.MutableMapping):
+
+    __slots__ = ('_layout', '_values', '_extra', '_shared', '_frozen')
+
+    def __init__(self, layout=None, data=None):
+        """per frame state.
+
+        Args:
+          layout (StateLayout, optional): the slots to use. Keys without a
+            slot are stored in a dict.
+          data (dict, optional): initial contents.
+        """
+        if layout is None:
+            layout = StateLayout()
+        self._layout = layout
+        self._values = list(layout.empty)
+        self._extra = None
+        # True if _values and _extra may be referenced by another state
+        self._shared = False
+        self._frozen = False
+        if data:
+            self.update(data)
+
+    def _unshare(self):
+        if self._frozen:
+            raise FrozenStateError('state is frozen')
+        if self._shared:
+            self._values = list(self._values)
+            if self._extra is not None:
+                self._extra = dict(self._extra)
+            self._shared = False
+
+    def __getitem__(self, key):
+        i = self._layout.index.get(key)
+        if i is not None:
+            v = self._values[i]
+            if v is not _MISSING:
+                return v
+        elif self._extra is not None:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._unshare()
+        i = self._layout.index.get(key)
+        if i is not None:
+            self._values[i] = value
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        self._unshare()
+        i = self._layout.index.get(key)
+        if i is not None:
+            if self._values[i] is _MISSING:
+                raise KeyError(key)
+            self._values[i] = _MISSING
+        elif self._extra is not None:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        i = self._layout.index.get(key)
+        if i is not None:
+            return self._values[i] is not _MISSING
+        return (self._extra is not None) and (key in self._extra)
+
+    def __iter__(self):
+        for k, v in zip(self._layout.keys, self._values):
+            if v is not _MISSING:
+                yield k
+        if self._extra:
+            for k in list(self._extra):
+                yield k
+
+    def __len__(self):
+        # values may be arrays, so compare by identity
+        n = sum(1 for v in self._values if v is not _MISSING)
+        return n + (len(self._extra) if self._extra else 0)
+
+    def __repr__(self):
+        return 'FrameState(%r)' % dict(self.items())
+
+    def get(self, key, default=None):
+        i = self._layout.index.get(key)
+        if i is not None:
+            v = self._values[i]
+            return default if v is _MISSING else v
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs) if (len(args) != 1 or kwargs) else args[0]
+        if not other:
+            return
+        self._unshare()
+        index = self._layout.index
+        values = self._values
+        for k, v in other.items():
+            i = index.get(k)
+            if i is not None:
+                values[i] = v
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[k] = v
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        """make this state read-only, returns self."""
+        self._frozen = True
+        return self
+
+    def copy(self):
+        """returns a writable copy of this state in O(1). The storage is
+        shared until either state is written to."""
+        c = FrameState.__new__(FrameState)
+        c._layout = self._layout
+        c._values = self._values
+        c._extra = self._extra
+        c._frozen = False
+        c._shared = self._shared = True
+        return c
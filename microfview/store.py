@@ -1,7 +1,11 @@
 import threading
+import collections
 
 import numpy as np
 
+from . import trace
+from .frame import SharedFrame, release_frame
+
 DETECTED_OBJECT   = "UFVIEW_object"
 TRACKED_OBJECT    = "UFVIEW_tracked_object"
 TRACKED_3D_OBJECT = "UFVIEW_tracked_3d_object"
@@ -104,6 +108,11 @@ class PointArrayType(_Transformable):
 
 class FrameStore(object):
 
+    # framestores are passed the original frame (and FRAME_ORIGINAL in the
+    # state). set to True if its colour is needed, otherwise the capture
+    # may produce grey frames
+    uses_color = False
+
     def store_open(self, schema_dict):
         pass
 
@@ -123,29 +132,107 @@ class FrameStore(object):
 class FrameStoreManager(object):
 
     def __init__(self):
-        self._lock = threading.Lock()
+        # threaded plugins record the latency of their results from their
+        # own thread
+        self._lock = threading.RLock()
         self._framestores = []
+        self._latency = None
+        # results completed on other threads, waiting to be stored by the
+        # mainloop (see store_completed)
+        self._completed = collections.deque()
 
     def add(self, framestore):
         self._framestores.append(framestore)
 
+    def uses_color(self):
+        """returns True if any framestore uses the colour of the original frame"""
+        return any(getattr(s, 'uses_color', False) for s in self._framestores)
+
+    def set_latency_recorder(self, recorder):
+        """time every stored result with recorder (a LatencyRecorder)"""
+        self._latency = recorder
+
     def open(self, schema):
         for s in self._framestores:
             s.store_open(schema)
 
     def close(self):
-        for s in self._framestores:
-            s.store_close()
+        # results completed after the last frame
+        self.deliver_completed()
+        with self._lock:
+            for s in self._framestores:
+                s.store_close()
 
     def store(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
+        """store a result, called on the mainloop thread"""
+        if trace.is_enabled():
+            with trace.span('store', cat='framestore', plugin=callback_name):
+                self._store(callback_name, buf, frame_number, frame_count, frame_timestamp, now, state)
+        else:
+            self._store(callback_name, buf, frame_number, frame_count, frame_timestamp, now, state)
+
+    def _store(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
         with self._lock:
+            if self._latency is not None:
+                self._latency.store(callback_name, frame_number, frame_timestamp, now)
             for s in self._framestores:
                 s.store_state(callback_name, buf, frame_number, frame_count, frame_timestamp, now, state)
 
+    def store_completed(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
+        """store a result completed on another thread. the latency is
+        recorded now, the result is passed to the framestores by the
+        mainloop thread during its next frame (see deliver_completed), tagged
+        with the frame it was computed from."""
+        if self._latency is not None:
+            with self._lock:
+                self._latency.store(callback_name, frame_number, frame_timestamp, now)
+        if isinstance(buf, SharedFrame):
+            # the plugin releases its reference once this returns
+            buf.acquire()
+        self._completed.append((callback_name, buf, frame_number, frame_count, frame_timestamp, now, state))
+
+    def deliver_completed(self):
+        """pass the results completed on other threads to the framestores.
+        called by the mainloop before end_frame."""
+        while True:
+            try:
+                item = self._completed.popleft()
+            except IndexError:
+                break
+            if trace.is_enabled():
+                with trace.span('store', cat='framestore', plugin=item[0]):
+                    self._deliver(item)
+            else:
+                self._deliver(item)
+            release_frame(item[1])
+
+    def _deliver(self, item):
+        with self._lock:
+            for s in self._framestores:
+                s.store_state(*item)
+
     def begin_frame(self, buf, frame_number, frame_count, frame_timestamp, now, key):
-        for s in self._framestores:
-            s.store_begin_frame(buf, frame_number, frame_count, frame_timestamp, now, key)
+        if trace.is_enabled():
+            with trace.span('begin_frame', cat='framestore'):
+                self._begin_frame(buf, frame_number, frame_count, frame_timestamp, now, key)
+        else:
+            self._begin_frame(buf, frame_number, frame_count, frame_timestamp, now, key)
+
+    def _begin_frame(self, buf, frame_number, frame_count, frame_timestamp, now, key):
+        with self._lock:
+            if self._latency is not None:
+                self._latency.begin_frame(frame_number, frame_timestamp, now)
+            for s in self._framestores:
+                s.store_begin_frame(buf, frame_number, frame_count, frame_timestamp, now, key)
 
     def end_frame(self, buf, frame_number, frame_count, frame_timestamp, now):
-        for s in self._framestores:
-            s.store_end_frame(buf, frame_number, frame_count, frame_timestamp, now)
+        if trace.is_enabled():
+            with trace.span('end_frame', cat='framestore'):
+                self._end_frame(buf, frame_number, frame_count, frame_timestamp, now)
+        else:
+            self._end_frame(buf, frame_number, frame_count, frame_timestamp, now)
+
+    def _end_frame(self, buf, frame_number, frame_count, frame_timestamp, now):
+        with self._lock:
+            for s in self._framestores:
+                s.store_end_frame(buf, frame_number, frame_count, frame_timestamp, now)
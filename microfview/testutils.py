@@ -8,6 +8,9 @@ from .store import FrameStore
 
 class StateFrameStore(FrameStore):
 
+    # the original frame is not stored
+    uses_color = False
+
     def __init__(self):
         self.state = []
 
@@ -17,6 +20,8 @@ class StateFrameStore(FrameStore):
         except KeyError: pass
         try: state.pop('KEY')
         except KeyError: pass
+        try: state.pop('FRAME_CACHE')
+        except KeyError: pass
         self.state.append(state.copy())
 
 
@@ -0,0 +1,170 @@
+"""microfview.trace module
+
+An opt-in tracer recording the begin and end of the stages of each frame
+(acquisition, transform, plugins, plugin worker threads, framestores,
+waitKey) on every thread into a ring buffer, which can be dumped as a
+Chrome trace-event JSON file and opened in chrome://tracing or
+https://ui.perfetto.dev to inspect stalls and cross thread overlap.
+
+  >>> enable(path='trace.json')
+  >>> with span('my stage'):
+  >>>     ...
+  >>> dump()
+
+When tracing is not enabled, span() returns a shared no-op context
+manager, so instrumented code only pays for a function call.
+"""
+import os
+import json
+import time
+import thread
+import signal
+import logging
+import threading
+import collections
+
+logger = logging.getLogger('microfview.trace')
+
+# the tracer, None when disabled
+_tracer = None
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ('_events', '_name', '_cat', '_args', '_tid', '_t0')
+
+    def __init__(self, tracer, name, cat, args):
+        self._events = tracer._events
+        self._name = name
+        self._cat = cat
+        self._args = args
+        self._tid = tracer._thread_id()
+
+    def __enter__(self):
+        self._t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.time()
+        # deque.append is atomic, no lock is needed
+        self._events.append((self._name, self._cat, self._t0, t1 - self._t0, self._tid, self._args))
+        return False
+
+
+class Tracer(object):
+
+    def __init__(self, size=100000, path=None):
+        """keeps the last size spans.
+
+        Args:
+          size (int, optional): number of spans in the ring buffer.
+          path (str, optional): default file for dump().
+        """
+        self._events = collections.deque(maxlen=int(size))
+        self._threads = {}
+        self.path = path
+        self.pid = os.getpid()
+
+    def _thread_id(self):
+        tid = thread.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        return tid
+
+    def span(self, name, cat, args):
+        return _Span(self, name, cat, args)
+
+    def get_events(self):
+        """returns the trace events (a list of dicts) in the ring buffer"""
+        events = []
+        for tid, name in self._threads.items():
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': self.pid, 'tid': tid,
+                           'args': {'name': name}})
+        for name, cat, t0, dur, tid, args in list(self._events):
+            e = {'ph': 'X', 'name': name, 'cat': cat, 'pid': self.pid, 'tid': tid,
+                 'ts': t0 * 1e6, 'dur': dur * 1e6}
+            if args:
+                e['args'] = args
+            events.append(e)
+        return events
+
+    def dump(self, path=None):
+        """writes the ring buffer to path (or the default path) as trace-event
+        JSON. returns the path written."""
+        path = path or self.path or 'microfview-trace-%d.json' % int(time.time())
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.get_events(), 'displayTimeUnit': 'ms'}, f, default=repr)
+        logger.info('wrote %d trace events to %s' % (len(self._events), path))
+        return path
+
+    def clear(self):
+        self._events.clear()
+
+
+def span(name, cat='microfview', **args):
+    """returns a context manager recording a span, if tracing is enabled"""
+    t = _tracer
+    if t is None:
+        return _NULL_SPAN
+    return t.span(name, cat, args)
+
+
+def complete(name, t0, t1, cat='microfview', **args):
+    """record a span which was already measured (from t0 to t1, as returned
+    by time.time()), if tracing is enabled"""
+    t = _tracer
+    if t is not None:
+        t._events.append((name, cat, t0, t1 - t0, t._thread_id(), args))
+
+
+def enable(size=100000, path=None, dump_signal=getattr(signal, 'SIGUSR1', None)):
+    """start tracing. returns the Tracer.
+
+    Args:
+      size (int, optional): number of spans kept.
+      path (str, optional): file written by dump().
+      dump_signal (int, optional): dump when this signal is received.
+        Defaults to SIGUSR1, None to not install a handler.
+    """
+    global _tracer
+    _tracer = Tracer(size, path)
+    if dump_signal is not None:
+        try:
+            signal.signal(dump_signal, lambda signum, frame: dump())
+        except ValueError:
+            # signal handlers can only be installed from the main thread
+            logger.warn('could not install signal handler to dump the trace')
+    logger.info('tracing enabled (%d spans)' % size)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def get_tracer():
+    return _tracer
+
+
+def dump(path=None):
+    """dump the trace, if tracing is enabled. returns the path written or None"""
+    t = _tracer
+    if t is None:
+        return None
+    return t.dump(path)
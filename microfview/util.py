@@ -12,6 +12,11 @@ def is_color(img):
     return (img.shape[-1] == 3) & (img.ndim == 3)
 
 
+def compose_transforms(outer, inner):
+    """returns the 2x3 affine matrix which applies inner, then outer"""
+    return np.dot(outer, np.vstack([inner, [0, 0, 1]])).astype(np.float32)
+
+
 def get_logger():
     """returns the global microfview logging.Logger instance"""
     # setup logging
@@ -41,6 +46,40 @@ def get_argument_parser():
                         help='stop after this many frames')
     parser.add_argument('--seek', action='store_true', default=False,
                         help='make videos seekable')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='read up to this many frames ahead on a background thread')
+    parser.add_argument('--plugin-workers', type=int, default=0,
+                        help='run plugins which do not depend on each other on this many threads')
+    parser.add_argument('--trace', type=str,
+                        help="record a timeline of every frame, written to this file on exit, "
+                             "when 'T' is pressed or on SIGUSR1")
+    parser.add_argument('--trace-size', type=int, default=100000,
+                        help='number of spans kept for the timeline')
+    parser.add_argument('--latency', action='store_true', default=False,
+                        help='record per frame latencies and count frames not processed, '
+                             'summarized on exit')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-file', type=str,
+                        help='write metrics to this file')
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help='seconds between writes of the metrics file')
+    return parser
+
+def get_batch_argument_parser():
+    parser = argparse.ArgumentParser(prog='micro-fview batch')
+    parser.add_argument('captures', nargs='+', type=str,
+                        help='video files, or directories of video files')
+    parser.add_argument('--setup', type=str, required=True,
+                        help='module:function called as function(fview, capture) to attach the plugins')
+    parser.add_argument('--store', type=str,
+                        help='module:function called as function(capture) returning the framestore for each capture')
+    parser.add_argument('--config', type=str,
+                        help='path to a configuration file')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of processes (default: number of cores)')
+    parser.add_argument('--stop-frame', type=int, default=0,
+                        help='stop each capture after this many frames')
     return parser
 
 def parse_config_file(filename):
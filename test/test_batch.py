@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from microfview import BlockingPlugin
+from microfview.batch import expand_captures, run_batch, main
+from microfview.store import FrameStore
+
+from test_fmfmmap import write_fmf, make_frames
+
+
+class _Numbers(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'n': frame_number}
+
+
+class _FileStore(FrameStore):
+    """writes the frame numbers to a file, the batch workers are other
+    processes"""
+
+    uses_color = False
+
+    def __init__(self, path):
+        self.path = path
+        self.numbers = []
+
+    def store_state(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
+        self.numbers.append(state['n'])
+
+    def store_close(self):
+        with open(self.path, 'w') as f:
+            f.write(' '.join(str(n) for n in self.numbers))
+
+
+def _setup(fview, desc):
+    fview.attach_plugin(_Numbers())
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outdir = tempfile.mkdtemp()
+        for i, n in enumerate((5, 7, 9)):
+            write_fmf(os.path.join(self.tmpdir, '%d.fmf' % i), make_frames(n), [0.1 * j for j in range(n)])
+        open(os.path.join(self.tmpdir, 'notes.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        shutil.rmtree(self.outdir)
+
+    def _store(self, desc):
+        name = os.path.basename(desc).replace(':', '_')
+        return _FileStore(os.path.join(self.outdir, name + '.txt'))
+
+    def _output(self, desc):
+        with open(self._store(desc).path) as f:
+            return [int(n) for n in f.read().split()]
+
+    def test_expand_captures(self):
+        descs = expand_captures([self.tmpdir, 'synth:class=dot'])
+        self.assertEqual([os.path.basename(d) for d in descs], ['0.fmf', '1.fmf', '2.fmf', 'synth:class=dot'])
+
+    def test_one_output_per_capture(self):
+        for workers in (1, 2):
+            descs = expand_captures([self.tmpdir])
+            summary = run_batch(descs, _setup, framestore_factory=self._store, workers=workers)
+            self.assertEqual(summary['failed'], 0)
+            self.assertEqual(summary['frames'], 5 + 7 + 9)
+            self.assertEqual(sorted(r['capture'] for r in summary['results']), descs)
+            for desc, n in zip(descs, (5, 7, 9)):
+                self.assertEqual(self._output(desc), range(n))
+
+    def test_pacing_is_disabled(self):
+        # would take 4s when paced
+        desc = 'synth:class=dot:fps=5:nframes=20'
+        summary = run_batch([desc], _setup, framestore_factory=self._store, workers=1, stop_frame=20)
+        self.assertLess(summary['time'], 2)
+        self.assertEqual(self._output(desc), range(1, 21))
+
+    def test_failed_captures_are_counted(self):
+        results = []
+        summary = run_batch([os.path.join(self.tmpdir, '0.fmf'), os.path.join(self.tmpdir, 'missing.fmf')],
+                            _setup, workers=2, callback=results.append)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['frames'], 5)
+        self.assertEqual(len(results), 2)
+        failed = [r for r in results if r['error'] is not None]
+        self.assertTrue(failed[0]['capture'].endswith('missing.fmf'))
+        # and not opened as a camera
+        self.assertIn('IOError: no such file', failed[0]['error'])
+
+    def test_main(self):
+        self.assertEqual(main([self.tmpdir, '--setup', 'test_batch:_setup', '--workers', '1']), 0)
+        self.assertEqual(main([self.outdir, '--setup', 'test_batch:_setup']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
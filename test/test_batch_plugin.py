@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+
+from microfview import BatchPlugin
+from microfview.store import FrameStoreManager
+from microfview.testutils import get_test_instance, StateFrameStore
+
+
+class _Means(BatchPlugin):
+    def __init__(self, **kwargs):
+        super(_Means, self).__init__(**kwargs)
+        self.calls = []
+
+    def process_frames(self, frames, frame_numbers, frame_counts, frame_times, current_times, states):
+        self.calls.append(frames.shape)
+        means = frames.reshape(len(frames), -1).mean(axis=1)
+        return [{'n': int(n), 't': float(t), 'mean': float(m), 'key': 'KEY' in s}
+                for n, t, m, s in zip(frame_numbers, frame_times, means, states)]
+
+
+class _FirstOnly(BatchPlugin):
+    def process_frames(self, frames, frame_numbers, *args):
+        return [{'n': int(frame_numbers[0])}] + [None] * (len(frames) - 1)
+
+
+class _WrongLength(BatchPlugin):
+    def process_frames(self, frames, *args):
+        return [None]
+
+
+class TestBatchPlugin(unittest.TestCase):
+
+    def test_results_are_fanned_out(self):
+        fview, store = get_test_instance(nframes=10, synthdesc='noise=0.2')
+        plugin = _Means(batch_size=4)
+        fview.attach_plugin(plugin)
+        fview.main()
+        results = [s for s in store.state if 'mean' in s]
+        # the partial batch is processed when the plugin stops
+        self.assertEqual([s['n'] for s in results], range(1, 11))
+        self.assertEqual([shape[0] for shape in plugin.calls], [4, 4, 2])
+        self.assertTrue(all(s['key'] for s in results))
+        self.assertEqual(len(set(s['mean'] for s in results)), 10)
+        self.assertEqual(plugin.get_latency()['count'], 10)
+
+    def test_frames_are_stacked(self):
+        storem = FrameStoreManager()
+        store = StateFrameStore()
+        storem.add(store)
+        plugin = _Means(batch_size=3)
+        rets = []
+        for i in range(3):
+            frame = np.full((4, 5), i, np.uint8)
+            rets.append(plugin.push_frame(frame, i, i, float(i), 0.0, {'FRAME_ORIGINAL': frame}, storem))
+        self.assertEqual(plugin.calls, [(3, 4, 5)])
+        # the state of the last frame of the batch is returned
+        self.assertEqual(rets[:2], [None, None])
+        self.assertEqual(rets[2]['n'], 2)
+        self.assertEqual([s['mean'] for s in store.state], [0.0, 1.0, 2.0])
+        self.assertEqual([s['key'] for s in store.state], [False] * 3)
+
+    def test_shape_change_flushes(self):
+        storem = FrameStoreManager()
+        store = StateFrameStore()
+        storem.add(store)
+        plugin = _Means(batch_size=3)
+        plugin.push_frame(np.zeros((4, 5), np.uint8), 1, 1, 1.0, 0.0, {}, storem)
+        # the result of frame 1 is stored, not returned as that of frame 2
+        self.assertIsNone(plugin.push_frame(np.zeros((2, 5), np.uint8), 2, 2, 2.0, 0.0, {}, storem))
+        self.assertEqual(plugin.calls, [(1, 4, 5)])
+        self.assertEqual([s['n'] for s in store.state], [1])
+        plugin.stop()
+        self.assertEqual(plugin.calls, [(1, 4, 5), (1, 2, 5)])
+
+    def test_only_the_state_of_the_pushed_frame_is_returned(self):
+        storem = FrameStoreManager()
+        plugin = _FirstOnly(batch_size=2)
+        self.assertIsNone(plugin.push_frame(np.zeros(3), 1, 1, 1.0, 0.0, {}, storem))
+        self.assertIsNone(plugin.push_frame(np.zeros(3), 2, 2, 2.0, 0.0, {}, storem))
+
+    def test_wrong_number_of_results(self):
+        plugin = _WrongLength(batch_size=2)
+        storem = FrameStoreManager()
+        plugin.push_frame(np.zeros(3), 1, 1, 1.0, 0.0, {}, storem)
+        self.assertRaises(ValueError, plugin.push_frame, np.zeros(3), 2, 2, 2.0, 0.0, {}, storem)
+        self.assertRaises(ValueError, BatchPlugin, batch_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from microfview.bench import run_suite, compare, format_comparison, save_results, load_results, main
+
+
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # main changes the log levels
+        self.levels = dict((name, logging.getLogger(name).level)
+                           for name in (None, 'microfview', 'microfview.bench'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        for name, level in self.levels.items():
+            logging.getLogger(name).setLevel(level)
+
+    def test_compare(self):
+        rows = compare({'a': 80.0, 'b': 100.0, 'new': 1.0}, {'a': 100.0, 'b': 95.0, 'gone': 1.0})
+        self.assertEqual([(r[0], r[4]) for r in rows], [('a', True), ('b', False)])
+        self.assertAlmostEqual(rows[0][3], -0.2)
+        self.assertEqual(compare({'a': 80.0}, {'a': 100.0}, threshold=0.25)[0][4], False)
+        text = format_comparison(rows)
+        self.assertIn('-20.0%  REGRESSION', text)
+        self.assertEqual(text.count('REGRESSION'), 1)
+
+    def test_save_and_load(self):
+        path = os.path.join(self.tmpdir, 'bench.json')
+        save_results(path, {'a': 1.5}, {'frames': 3})
+        self.assertEqual(load_results(path), {'a': 1.5})
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual(data['params'], {'frames': 3})
+        self.assertIn('numpy', data['environment'])
+
+    def test_only(self):
+        seen = []
+        results = run_suite(sizes=['32x24'], frames=5, repeats=1,
+                            only=['capture:fmf', 'transform:grey', 'plugins:pipelined_chain:1:'],
+                            callback=lambda name, fps: seen.append(name))
+        self.assertEqual(sorted(results), ['capture:fmf:32x24', 'plugins:pipelined_chain:1:32x24',
+                                           'transform:grey:32x24'])
+        self.assertEqual(sorted(seen), sorted(results))
+        self.assertTrue(all(fps > 0 for fps in results.values()))
+        # the temporary movies are removed
+        self.assertFalse([d for d in os.listdir(tempfile.gettempdir()) if d.startswith('microfview-bench-')])
+
+    def _main(self, *argv):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            ret = main(['transform:scale', '--sizes', '32x24', '--quick'] + list(argv))
+            return ret, sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_main(self):
+        output = os.path.join(self.tmpdir, 'out.json')
+        ret, text = self._main('--output', output)
+        self.assertEqual(ret, 0)
+        self.assertIn('transform:scale:32x24', text)
+        results = load_results(output)
+        self.assertEqual(list(results), ['transform:scale:32x24'])
+
+        # no regressions against itself, with a generous threshold
+        self.assertEqual(self._main('--baseline', output, '--threshold', '0.99')[0], 0)
+        fast = os.path.join(self.tmpdir, 'fast.json')
+        save_results(fast, {'transform:scale:32x24': 1e12})
+        ret, text = self._main('--baseline', fast)
+        self.assertEqual(ret, 1)
+        self.assertIn('1 regressions', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
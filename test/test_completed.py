@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+from microfview import Microfview, BlockingPlugin, NonBlockingPlugin, PluginChain, get_capture_object
+from microfview.store import FrameStore
+
+
+class _BracketStore(FrameStore):
+    """records the thread each result is stored on and whether that was
+    between begin_frame and end_frame"""
+
+    uses_color = False
+
+    def __init__(self):
+        self.inside = False
+        self.closed = False
+        self.mainloop_thread = None
+        self.results = []
+
+    def store_begin_frame(self, buf, frame_number, frame_count, frame_timestamp, now, key):
+        self.mainloop_thread = threading.current_thread()
+        self.inside = True
+
+    def store_end_frame(self, buf, frame_number, frame_count, frame_timestamp, now):
+        self.inside = False
+
+    def store_state(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
+        self.results.append((callback_name, frame_number, frame_timestamp, dict(state),
+                             self.inside, threading.current_thread()))
+
+    def store_close(self):
+        self.closed = True
+
+
+class _Slow(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        time.sleep(0.003)
+        return {'nb': frame_number, 'nb_time': frame_time}
+
+
+class _Stage(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        time.sleep(0.002)
+        return {'stage': frame_number, 'stage_time': frame_time}
+
+
+class TestCompletedResults(unittest.TestCase):
+
+    def test_threaded_results_are_tagged_and_delivered_by_the_mainloop(self):
+        cam = get_capture_object('synth:class=dot:fps=200:nframes=40')
+        fview = Microfview(cam, visible=False, debug=False, stop_frame=40)
+        store = _BracketStore()
+        fview.attach_framestore(store)
+        nb = _Slow()
+        fview.attach_parallel_plugin(nb)
+        chain = PluginChain(_Stage(), _Stage(), name='threaded')
+        chain.threaded = True
+        fview.attach_plugin(chain)
+        fview.attach_plugin(PluginChain(_Stage(), _Stage(), name='pipelined', pipelined=True))
+        fview.main()
+
+        self.assertTrue(store.closed)
+        names = set()
+        for name, frame_number, frame_time, state, inside, thread in store.results:
+            names.add(name)
+            # tagged with the frame the result was computed from
+            key = 'nb' if 'nb' in state else 'stage'
+            self.assertEqual(state[key], frame_number)
+            self.assertEqual(state[key + '_time'], frame_time)
+            # passed to the framestores by the mainloop, during a frame or
+            # when it closes
+            self.assertIs(thread, store.mainloop_thread)
+        self.assertEqual(len(names), 3)
+        # only the results completed after the last frame are stored outside
+        # of a frame
+        inside = [r[4] for r in store.results]
+        self.assertTrue(inside[0])
+        self.assertEqual(inside, sorted(inside, reverse=True))
+        self.assertTrue(nb.get_latency()['count'] > 0)
+        self.assertTrue(chain.get_latency()['max'] >= 0.004)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import time
+import unittest
+
+from microfview import BlockingPlugin
+from microfview.schedule import DeadlineScheduler, DECISION_RUN, DECISION_EVERY, DECISION_RATE, \
+    DECISION_BUDGET, DECISION_SHED
+from microfview.testutils import get_test_instance
+
+
+class _Fake(object):
+    """the attributes of a plugin the scheduler looks at"""
+
+    def __init__(self, identifier, cost, every=1, priority=None, budget=None, target_rate=None, threaded=False):
+        self.identifier = identifier
+        self.cost = cost
+        self.every = every
+        self.priority = priority
+        self.budget = budget
+        self.target_rate = target_rate
+        self.threaded = threaded
+
+    def get_execution_time(self):
+        return self.cost
+
+
+def _run(scheduler, plugins, nframes, dt=0.01):
+    ran = dict((p.identifier, 0) for p in plugins)
+    for i in range(nframes):
+        selected = scheduler.select(plugins, i, i * dt)
+        for p in selected:
+            ran[p.identifier] += 1
+        # threaded plugins do not block the iteration
+        scheduler.update(selected, i * dt, sum(p.cost for p in selected if not p.threaded))
+    return ran
+
+
+class TestDeadlineScheduler(unittest.TestCase):
+
+    def test_every_and_target_rate(self):
+        plugins = [_Fake('every', 0.001, every=4), _Fake('rate', 0.001, target_rate=10)]
+        ran = _run(DeadlineScheduler(), plugins, 100)
+        self.assertEqual(ran['every'], 25)
+        # 1s of frames at 10Hz
+        self.assertEqual(ran['rate'], 10)
+
+    def test_budget(self):
+        # three frames of budget per run
+        plugins = [_Fake('slow', 0.03, budget=0.01)]
+        scheduler = DeadlineScheduler()
+        ran = _run(scheduler, plugins, 90)
+        self.assertTrue(28 <= ran['slow'] <= 32, ran)
+        counts = scheduler.get_decisions()['slow']
+        self.assertEqual(counts[DECISION_RUN] + counts[DECISION_BUDGET], 90)
+
+    def test_shedding_lowest_priority_first(self):
+        plugins = [_Fake('always', 0.004), _Fake('high', 0.004, priority=2),
+                   _Fake('low', 0.004, priority=1), _Fake('threaded', 0.05, priority=0, threaded=True)]
+        scheduler = DeadlineScheduler(fps=100)
+        ran = _run(scheduler, plugins, 20)
+        # the first frame runs everything, costs are not known yet
+        self.assertEqual(ran, {'always': 20, 'high': 20, 'low': 1, 'threaded': 20})
+        self.assertTrue(scheduler.behind)
+        decisions = scheduler.get_decisions()
+        self.assertEqual(decisions['low']['last'], DECISION_SHED)
+        self.assertEqual(decisions['low'][DECISION_SHED], 19)
+        self.assertAlmostEqual(decisions['high']['cost'], 0.004)
+
+    def test_no_shedding_offline(self):
+        plugins = [_Fake('a', 0.02, priority=1), _Fake('b', 0.02, priority=2)]
+        ran = _run(DeadlineScheduler(fps=100, live=False), plugins, 10)
+        self.assertEqual(ran, {'a': 10, 'b': 10})
+
+    def test_decisions_of_skipped_plugins(self):
+        scheduler = DeadlineScheduler()
+        plugins = [_Fake('every', 0.001, every=2), _Fake('rate', 0.001, target_rate=1)]
+        _run(scheduler, plugins, 3)
+        decisions = scheduler.get_decisions()
+        self.assertEqual(decisions['every'][DECISION_EVERY], 1)
+        self.assertEqual(decisions['rate'][DECISION_RATE], 2)
+        self.assertFalse(DeadlineScheduler.wanted([_Fake('plain', 0.001)]))
+
+
+class _Counts(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        time.sleep(0.001)
+        return {'ran_%s' % self.human_name: frame_number}
+
+
+class TestDeadlineMainloop(unittest.TestCase):
+
+    def test_target_rate(self):
+        fview, store = get_test_instance(fps=100, nframes=30)
+        paced = _Counts()
+        paced.human_name = 'paced'
+        paced.target_rate = 20
+        fview.attach_plugin(paced)
+        fview.main()
+        ran = [s for s in store.state if 'ran_paced' in s]
+        # 0.3s of frames at 20Hz
+        self.assertTrue(4 <= len(ran) <= 8, len(ran))
+        decisions = fview.get_schedule_decisions()
+        self.assertEqual(len(decisions), 1)
+        counts = decisions.values()[0]
+        self.assertEqual(counts[DECISION_RUN], len(ran))
+        self.assertEqual(counts[DECISION_RUN] + counts[DECISION_RATE], 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
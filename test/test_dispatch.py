@@ -0,0 +1,117 @@
+import logging
+import math
+import unittest
+
+import numpy as np
+
+import microfview.main
+from microfview import BlockingPlugin, FrameState
+from microfview.bench import measure_overhead
+from microfview.testutils import get_test_instance, DummyPlugin
+
+
+class _Returns(BlockingPlugin):
+    """returns the result of make(frame, frame_number) straight to the
+    mainloop, bypassing BlockingPlugin.push_frame"""
+
+    def __init__(self, make, every=1):
+        super(_Returns, self).__init__(every=every)
+        self.make = make
+
+    def push_frame(self, frame, frame_number, frame_count, frame_time, current_time, state, storem):
+        return self.make(frame, frame_number)
+
+
+class _Sees(BlockingPlugin):
+    def __init__(self):
+        super(_Sees, self).__init__()
+        self.seen = []
+
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        self.seen.append((frame_number, int(frame.flat[0]), state.get('k'), state.get('m')))
+
+
+class TestDispatch(unittest.TestCase):
+
+    def _run(self, *plugins, **kwargs):
+        fview, store = get_test_instance(nframes=kwargs.get('nframes', 6))
+        for p in plugins:
+            fview.attach_plugin(p)
+        fview.main()
+        return fview
+
+    def test_result_types(self):
+        marked = lambda frame, n: np.full(frame.shape, n, frame.dtype)
+        results = {1: None,
+                   2: False,
+                   3: {'k': 3},
+                   4: FrameState(data={'m': 4}),
+                   5: 'marked',
+                   6: 'tuple'}
+
+        def make(frame, n):
+            r = results[n]
+            if r == 'marked':
+                return marked(frame, 50)
+            elif r == 'tuple':
+                return marked(frame, 60), {'k': 6}
+            return r
+
+        sees = _Sees()
+        self._run(_Returns(make), sees)
+        self.assertEqual([s[2:] for s in sees.seen],
+                         [(None, None), (None, None), (3, None), (None, 4), (None, None), (6, None)])
+        # returned frames are passed on to the following plugins
+        self.assertEqual([s[1] for s in sees.seen][4:], [50, 60])
+
+    def test_every(self):
+        sees = _Sees()
+        sees.every = 3
+        self._run(sees, nframes=9)
+        self.assertEqual([s[0] for s in sees.seen], [3, 6, 9])
+
+    def test_plugins_are_only_timed_when_needed(self):
+        untimed = DummyPlugin()
+        self._run(untimed)
+        self.assertTrue(math.isnan(untimed.get_execution_time()))
+
+        fview, store = get_test_instance(nframes=3)
+        timed = DummyPlugin()
+        fview.attach_plugin(timed)
+        fview.attach_metrics()
+        fview.main()
+        self.assertFalse(math.isnan(timed.get_execution_time()))
+
+    def test_results_are_only_described_when_debugging(self):
+        described = []
+        orig = microfview.main._describe_result
+        microfview.main._describe_result = lambda *args: described.append(args) or orig(*args)
+        logger = logging.getLogger('microfview')
+        level = logger.level
+        handler = logging.NullHandler()
+        logger.addHandler(handler)
+        try:
+            self._run(DummyPlugin())
+            self.assertEqual(described, [])
+            logger.setLevel(logging.DEBUG)
+            self._run(DummyPlugin())
+            self.assertEqual(len(described), 6)
+        finally:
+            microfview.main._describe_result = orig
+            logger.setLevel(level)
+            logger.removeHandler(handler)
+
+
+class TestOverheadBenchmark(unittest.TestCase):
+
+    def test_measure_overhead(self):
+        r = measure_overhead(plugins=3, frames=50, repeats=1)
+        self.assertEqual(r['plugins'], 3)
+        self.assertTrue(r['total_per_frame'] > r['capture_per_frame'] > 0)
+        self.assertAlmostEqual(r['fps'], 1 / r['total_per_frame'])
+        for k in ('per_frame', 'per_plugin'):
+            self.assertFalse(math.isnan(r[k]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from microfview import get_capture_object, BlockingPlugin
+from microfview.capture import SeekError
+from microfview.capture.fmfmmap import MmapFlyMovie, MmapFMFCapture
+from microfview.frame import FramePool
+from microfview.testutils import get_test_instance
+
+
+def write_fmf(path, frames, timestamps, fmt='MONO8', n_frames=None):
+    # an uncompressed version 3 FMF movie
+    frames = np.asarray(frames)
+    h, w = frames.shape[1:3]
+    bits_per_pixel = frames.dtype.itemsize * 8 * (frames.shape[3] if frames.ndim == 4 else 1)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<II', 3, len(fmt)) + fmt + struct.pack('<III', bits_per_pixel, h, w))
+        f.write(struct.pack('<QQ', 8 + frames[0].nbytes, len(frames) if n_frames is None else n_frames))
+        for frame, ts in zip(frames, timestamps):
+            f.write(struct.pack('<d', ts))
+            f.write(np.ascontiguousarray(frame).tostring())
+
+
+def make_frames(n, shape=(6, 8)):
+    return np.arange(n * np.prod(shape), dtype=np.uint8).reshape((n,) + shape)
+
+
+class _Draws(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        frame[:] = 0
+        return {'n': frame_number}
+
+
+class TestMmapFMF(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.fmf')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_random_access(self):
+        frames = make_frames(10)
+        write_fmf(self.path, frames, np.arange(10) * 0.5)
+        movie = MmapFlyMovie(self.path)
+        self.assertEqual(len(movie), 10)
+        np.testing.assert_array_equal(movie.frames[2:8:3], frames[2:8:3])
+        frame, ts = movie.get_frame(7)
+        np.testing.assert_array_equal(frame, frames[7])
+        self.assertEqual(ts, 3.5)
+        self.assertFalse(frame.flags.writeable)
+        movie.close()
+
+    def test_capture_reads_in_order(self):
+        frames = make_frames(5)
+        write_fmf(self.path, frames, np.arange(5) + 100.)
+        cap = get_capture_object(self.path)
+        self.assertIsInstance(cap, MmapFMFCapture)
+        for i in range(5):
+            np.testing.assert_array_equal(cap.grab_next_frame(), frames[i])
+            self.assertEqual(cap.get_last_framenumber(), i)
+            self.assertEqual(cap.get_last_timestamp(), 100. + i)
+        self.assertRaises(EOFError, cap.grab_next_frame)
+        cap.close()
+
+    def test_seek_and_skip(self):
+        frames = make_frames(8)
+        write_fmf(self.path, frames, np.arange(8))
+        cap = MmapFMFCapture(self.path)
+        cap.seek_frame(5)
+        np.testing.assert_array_equal(cap.grab_next_frame(), frames[5])
+        self.assertTrue(cap.skip_next_frame())
+        np.testing.assert_array_equal(cap.grab_next_frame(), frames[7])
+        self.assertFalse(cap.skip_next_frame())
+        self.assertRaises(SeekError, cap.seek_frame, 9)
+        cap.seek_frame(8)
+        self.assertRaises(EOFError, cap.grab_next_frame)
+        cap.close()
+
+    def test_truncated_file(self):
+        write_fmf(self.path, make_frames(4), np.arange(4), n_frames=4)
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 10)
+        self.assertEqual(len(MmapFlyMovie(self.path)), 3)
+
+    def test_rgb(self):
+        frames = np.zeros((2, 4, 6, 3), np.uint8)
+        frames[..., 0] = 255
+        write_fmf(self.path, frames, (0, 1), fmt='RGB8')
+        cap = MmapFMFCapture(self.path)
+        # red is the last channel in BGR
+        frame = cap.grab_next_frame()
+        self.assertEqual(frame.shape, (4, 6, 3))
+        self.assertEqual(tuple(frame[0, 0]), (0, 0, 255))
+        cap.set_grey(True)
+        self.assertEqual(cap.grab_next_frame().shape, (4, 6))
+        cap.close()
+
+    def test_frames_are_copied_unless_pooled(self):
+        write_fmf(self.path, make_frames(3), np.arange(3))
+        cap = MmapFMFCapture(self.path)
+        self.assertTrue(cap.grab_next_frame().flags.writeable)
+        cap.set_frame_pool(FramePool())
+        frame = cap.grab_next_frame()
+        self.assertFalse(frame.flags.writeable)
+        self.assertTrue(np.may_share_memory(frame, cap.frames))
+        self.assertFalse(MmapFMFCapture(self.path, copy_frames=False).grab_next_frame().flags.writeable)
+        cap.close()
+
+    def test_blocking_plugins_can_draw(self):
+        frames = make_frames(4) + 1
+        write_fmf(self.path, frames, np.arange(4))
+        fview, store = get_test_instance(nframes=0, cam=MmapFMFCapture(self.path))
+        fview.attach_plugin(_Draws())
+        fview.main()
+        self.assertEqual([s['n'] for s in store.state], range(4))
+        np.testing.assert_array_equal(MmapFlyMovie(self.path).frames, frames)
+
+    def test_unsupported_format(self):
+        write_fmf(self.path, make_frames(1), (0,), fmt='YUV422')
+        self.assertRaises(NotImplementedError, MmapFlyMovie, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import hashlib
+import unittest
+
+import numpy as np
+
+from microfview import BlockingPlugin, NonBlockingPlugin, get_capture_object
+from microfview.frame import FramePool, SharedFrame
+from microfview.testutils import get_test_instance
+
+
+class TestFramePool(unittest.TestCase):
+
+    def test_released_buffers_are_reused(self):
+        pool = FramePool()
+        a = pool.empty((4, 5), np.uint8)
+        buf = a.base
+        a.release()
+        b = pool.empty((4, 5), np.uint8)
+        self.assertIs(b.base, buf)
+        self.assertEqual(pool.get_stats()['hits'], 1)
+
+    def test_buffer_is_kept_while_referenced(self):
+        pool = FramePool()
+        a = pool.empty((4, 5), np.uint8).freeze()
+        view = a[1:3]
+        view.acquire()
+        a.release()
+        self.assertEqual(pool.get_stats()['free'], 0)
+        view.release()
+        self.assertEqual(pool.get_stats()['free'], 1)
+
+    def test_release_too_often(self):
+        pool = FramePool()
+        a = pool.empty((2, 2))
+        a.release()
+        self.assertRaises(ValueError, a.release)
+
+    def test_adopt_does_not_copy_or_recycle(self):
+        pool = FramePool()
+        array = np.zeros((3, 3), np.uint8)
+        a = pool.adopt(array)
+        self.assertTrue(np.may_share_memory(a, array))
+        self.assertFalse(a.flags.writeable)
+        a.release()
+        self.assertEqual(pool.get_stats()['free'], 0)
+
+    def test_share(self):
+        pool = FramePool()
+        array = np.arange(6, dtype=np.uint8).reshape(2, 3)
+        copied = pool.share(array)
+        self.assertFalse(np.may_share_memory(copied, array))
+        np.testing.assert_array_equal(copied, array)
+        self.assertEqual(pool.get_stats()['copies'], 1)
+        shared = pool.share(copied)
+        self.assertIs(shared, copied)
+        self.assertEqual(pool.get_stats()['copies'], 1)
+
+    def test_computations_are_plain_arrays(self):
+        a = FramePool().empty((2, 2))
+        self.assertNotIsInstance(a + 1, SharedFrame)
+
+
+class _Writes(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        writable = frame.flags.writeable
+        frame[0, 0] = 255
+        return {'writable': writable}
+
+
+class _KeepsFrames(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'kept': frame, 'digest': hashlib.md5(frame.tostring()).hexdigest()}
+
+
+class TestSharedFramesInMainloop(unittest.TestCase):
+
+    def test_blocking_plugins_get_writable_frames(self):
+        fview, store = get_test_instance(nframes=5)
+        fview.attach_plugin(_Writes())
+        fview.attach_parallel_plugin(_KeepsFrames(), threaded=True)
+        fview.main()
+        results = [s for s in store.state if 'writable' in s]
+        self.assertTrue(results)
+        self.assertTrue(all(s['writable'] for s in results))
+
+    def test_frames_returned_by_threaded_plugins_stay_valid(self):
+        # the transform draws its output frames from the frame pool, which
+        # reuses them once released
+        cam = get_capture_object('synth:class=dot:fps=0:nframes=20',
+                                 options_dict={'capture': {}, 'transform': {'background': {'scale': 0.5}}})
+        fview, store = get_test_instance(nframes=20, cam=cam)
+        fview.attach_plugin(_KeepsFrames())
+        fview.main()
+        results = [s for s in store.state if 'kept' in s]
+        self.assertTrue(results)
+        for s in results:
+            self.assertEqual(hashlib.md5(s['kept'].tostring()).hexdigest(), s['digest'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import threading
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from microfview import BlockingPlugin, NonBlockingPlugin
+from microfview.frame import FrameCache
+from microfview.testutils import get_test_instance
+
+
+def _frame():
+    return np.random.RandomState(0).randint(0, 256, (12, 16, 3)).astype(np.uint8)
+
+
+class TestFrameCache(unittest.TestCase):
+
+    def test_representations_are_computed_once(self):
+        frame = _frame()
+        cache = FrameCache(frame)
+        grey = cache.grey()
+        np.testing.assert_array_equal(grey, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        self.assertIs(cache.grey(), grey)
+        self.assertIs(cache.pyramid_level(2), cache.pyramid(3)[2])
+        self.assertEqual(cache.pyramid_level(2).shape, (3, 4))
+        self.assertIs(cache.blur(3), cache.blur(3))
+        self.assertIs(cache.colour(), frame)
+        self.assertEqual(cache.get_stats()['misses'], 4)
+
+    def test_builtin_results_are_read_only(self):
+        cache = FrameCache(_frame())
+        for img in (cache.grey(), cache.pyramid_level(1), cache.blur(5, grey=False)):
+            self.assertFalse(img.flags.writeable)
+
+    def test_get_does_not_freeze_caller_arrays(self):
+        mine = np.zeros(4)
+        cache = FrameCache(_frame())
+        self.assertIs(cache.get('mine', lambda: mine), mine)
+        self.assertIs(cache.get('mine', lambda: None), mine)
+        self.assertTrue(mine.flags.writeable)
+
+    def test_grey_frames(self):
+        frame = _frame()[..., 0].copy()
+        cache = FrameCache(frame)
+        self.assertTrue(np.may_share_memory(cache.grey(), frame))
+        self.assertFalse(cache.grey().flags.writeable)
+        self.assertTrue(frame.flags.writeable)
+        self.assertEqual(cache.colour().shape, (12, 16, 3))
+
+    def test_drawable_buffers_are_copied(self):
+        frame = _frame()
+        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        expected = grey.copy()
+        cache = FrameCache(frame, grey=grey, drawable=grey)
+        grey[:] = 0
+        np.testing.assert_array_equal(cache.grey(), expected)
+        self.assertIs(cache.colour(), frame)
+
+        cache = FrameCache(frame, drawable=frame)
+        frame[:] = 0
+        np.testing.assert_array_equal(cache.grey(), expected)
+        self.assertFalse(cache.colour().flags.writeable)
+
+        # read-only buffers can not be drawn on, they are not copied
+        frame.flags.writeable = False
+        self.assertIs(FrameCache(frame, drawable=frame).colour(), frame)
+
+    def test_failed_computation_is_retried(self):
+        cache = FrameCache(_frame())
+
+        def fail():
+            raise RuntimeError
+
+        self.assertRaises(RuntimeError, cache.get, 'x', fail)
+        self.assertEqual(cache.get('x', lambda: 1), 1)
+
+    def test_concurrent_requests_compute_once(self):
+        cache = FrameCache(_frame())
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.05)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('slow', slow))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+
+
+class _UsesCache(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        grey = id(state['FRAME_CACHE'].grey())
+        # the first plugin records its grey image, the second compares
+        if 'grey' in state:
+            return {'same_grey': state['grey'] == grey}
+        return {'grey': grey}
+
+
+class _Draws(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        frame[:] = 123
+        return frame
+
+
+class _ReadsGrey(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'drawn': bool((frame == 123).all()),
+                'grey_drawn': bool((state['FRAME_CACHE'].grey() == 123).all())}
+
+
+class _Threaded(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'threaded_has_cache': 'FRAME_CACHE' in state}
+
+
+class TestFrameCacheInMainloop(unittest.TestCase):
+
+    def test_plugins_share_the_cache(self):
+        fview, store = get_test_instance(nframes=5)
+        fview.attach_plugin(_UsesCache())
+        fview.attach_plugin(_UsesCache())
+        fview.attach_plugin(_Threaded())
+        fview.main()
+        same = [s['same_grey'] for s in store.state if 'same_grey' in s]
+        self.assertEqual(same, [True] * 5)
+        threaded = [s for s in store.state if 'threaded_has_cache' in s]
+        self.assertTrue(threaded)
+        self.assertFalse(any(s['threaded_has_cache'] for s in threaded))
+
+    def test_drawing_on_the_frame_does_not_change_the_cache(self):
+        fview, store = get_test_instance(nframes=5)
+        fview.attach_plugin(_Draws())
+        fview.attach_plugin(_ReadsGrey())
+        fview.main()
+        results = [s for s in store.state if 'drawn' in s]
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(s['drawn'] and not s['grey_drawn'] for s in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
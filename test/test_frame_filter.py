@@ -0,0 +1,92 @@
+import time
+import unittest
+
+from microfview import BlockingPlugin, get_capture_object
+from microfview.capture.synth import SynthCapture
+from microfview.capture.prefetch import PrefetchCapture
+from microfview.latency import DROP_DRIVER
+from microfview.testutils import get_test_instance
+
+SYNTH_DESC = 'synth:class=dot:fps=0:nframes=%d:initial_x=100:initial_y=100'
+
+
+class _Records(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'n': frame_number, 'count': frame_count, 'pos': state['FRAME_METADATA']['dot_position']}
+
+
+def _positions(n):
+    cap = SynthCapture(SYNTH_DESC % n)
+    positions = {}
+    for _ in range(n):
+        cap.grab_next_frame()
+        positions[cap.get_last_framenumber()] = cap.get_last_metadata()['dot_position']
+    return positions
+
+
+class TestFrameFilter(unittest.TestCase):
+
+    def _run(self, cam):
+        fview, store = get_test_instance(nframes=12, cam=cam)
+        fview.attach_plugin(_Records(every=3))
+        fview.attach_latency_recorder()
+        fview.main()
+        return fview, store.state
+
+    def _check(self, fview, results):
+        self.assertEqual([s['n'] for s in results], [3, 6, 9, 12])
+        # skipped frames still advance the simulation
+        positions = _positions(12)
+        self.assertEqual([s['pos'] for s in results], [positions[s['n']] for s in results])
+        self.assertEqual(fview.frame_capture.frames_not_decoded, 8)
+        # only the processed frames are counted
+        self.assertEqual([s['count'] for s in results], [1, 2, 3, 4])
+        self.assertEqual((fview.frame_count, fview.frames_skipped), (4, 8))
+        self.assertEqual(fview.latency.drops[DROP_DRIVER], 0)
+
+    def test_unneeded_frames_are_not_decoded(self):
+        cam = SynthCapture(SYNTH_DESC % 12)
+        self._check(*self._run(cam))
+
+    def test_prefetch(self):
+        cam = get_capture_object(SYNTH_DESC % 12, options_dict={
+            'capture': {'prefetch': 2, 'prefetch_overflow': 'block'}, 'transform': {}})
+        self.assertIsInstance(cam, PrefetchCapture)
+        self._check(*self._run(cam))
+
+
+class TestPrefetchFilterCount(unittest.TestCase):
+
+    def _check_policy(self, overflow):
+        cap = PrefetchCapture(SynthCapture(SYNTH_DESC % 40), size=2, overflow=overflow)
+        cap.set_frame_filter(lambda n: n % 3 == 0)
+        prev, total = 0, 0
+        try:
+            while True:
+                cap.grab_next_frame()
+                n = cap.get_last_framenumber()
+                # the frames filtered out since the previous delivered frame,
+                # whether the frames in between were dropped or not
+                expected = len([i for i in range(prev + 1, n) if i % 3])
+                self.assertEqual(cap.frames_not_decoded - total, expected)
+                prev, total = n, cap.frames_not_decoded
+                # let the reading thread run ahead
+                time.sleep(0.005)
+        except EOFError:
+            pass
+        finally:
+            cap.close()
+        self.assertGreater(prev, 0)
+
+    def test_block(self):
+        self._check_policy('block')
+
+    def test_drop_oldest(self):
+        self._check_policy('drop_oldest')
+
+    def test_drop_newest(self):
+        self._check_policy('drop_newest')
+
+
+if __name__ == '__main__':
+    unittest.main()
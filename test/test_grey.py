@@ -0,0 +1,63 @@
+import unittest
+
+from microfview import Microfview, BlockingPlugin, get_capture_object
+from microfview.store import FrameStore
+
+
+class _Plugin(BlockingPlugin):
+    def __init__(self, uses_color):
+        super(_Plugin, self).__init__()
+        self.uses_color = uses_color
+
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'ndim': frame.ndim}
+
+
+class _OriginalStore(FrameStore):
+    def __init__(self, uses_color=None):
+        if uses_color is not None:
+            self.uses_color = uses_color
+        self.original_ndim = set()
+        self.ndim = set()
+
+    def store_begin_frame(self, buf, frame_number, frame_count, frame_timestamp, now, key):
+        self.original_ndim.add(buf.ndim)
+
+    def store_state(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
+        self.ndim.add(state['ndim'])
+
+
+def _run(plugin_color, store_color):
+    cam = get_capture_object('synth:class=dot:fps=0:nframes=3')
+    fview = Microfview(cam, visible=False, debug=False, stop_frame=3)
+    store = _OriginalStore(store_color)
+    fview.attach_framestore(store)
+    fview.attach_plugin(_Plugin(plugin_color))
+    fview.main()
+    return store
+
+
+class TestGreyCapture(unittest.TestCase):
+
+    def test_grey_plugins_and_framestores(self):
+        store = _run(False, False)
+        self.assertEqual(store.ndim, {2})
+        self.assertEqual(store.original_ndim, {2})
+
+    def test_framestores_do_not_use_colour_by_default(self):
+        store = _run(False, None)
+        self.assertEqual(store.original_ndim, {2})
+
+    def test_framestore_keeps_the_original_in_colour(self):
+        store = _run(False, True)
+        self.assertEqual(store.ndim, {2})
+        self.assertEqual(store.original_ndim, {3})
+
+    def test_colour_plugin(self):
+        store = _run(True, False)
+        self.assertEqual(store.ndim, {3})
+        self.assertEqual(store.original_ndim, {3})
+
+
+if __name__ == '__main__':
+    unittest.main()
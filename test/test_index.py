@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from microfview.capture.fmfmmap import MmapFMFCapture
+from microfview.capture.index import FrameIndex, sidecar_filename
+
+from test_fmfmmap import write_fmf, make_frames
+
+
+class TestFrameIndex(unittest.TestCase):
+
+    def test_lookups(self):
+        idx = FrameIndex([0.0, 0.1, 0.2, 0.3, 0.4])
+        self.assertEqual(idx.frame_at_time(0.15), 2)
+        self.assertEqual(idx.frame_at_time(0.2), 2)
+        self.assertEqual(idx.frame_at_time(10), 4)
+        self.assertEqual(list(idx.frames_between(0.1, 0.3)), [1, 2, 3])
+        self.assertEqual(list(idx.frames_between(0.31, 0.39)), [])
+        self.assertEqual(idx.frame_with_time(0.31), 3)
+        self.assertIsNone(idx.frame_with_time(0.5))
+
+    def test_non_monotonic_timestamps(self):
+        idx = FrameIndex([0.0, 0.2, 0.1, 0.3])
+        self.assertEqual(idx.frame_at_time(0.15), 1)
+        self.assertEqual(list(idx.frames_between(0.1, 0.2)), [1, 2])
+        self.assertEqual(idx.frame_with_time(0.1), 2)
+
+    def test_keyframes(self):
+        self.assertIsNone(FrameIndex(np.arange(10)).keyframe_before(5))
+        idx = FrameIndex(np.arange(10), keyframes=[0, 4, 8])
+        self.assertEqual(idx.keyframe_before(3), 0)
+        self.assertEqual(idx.keyframe_before(4), 4)
+        self.assertEqual(idx.keyframe_before(9), 8)
+
+
+class TestIndexCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.fmf')
+        write_fmf(self.path, make_frames(10), np.arange(10) * 0.25 + 3.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sidecar_is_reused(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            return FrameIndex(np.arange(10), keyframes=[0, 5])
+
+        idx = FrameIndex.load_or_build(self.path, build)
+        self.assertTrue(os.path.exists(sidecar_filename(self.path)))
+        again = FrameIndex.load_or_build(self.path, build)
+        self.assertEqual(len(calls), 1)
+        np.testing.assert_array_equal(again.timestamps, idx.timestamps)
+        np.testing.assert_array_equal(again.keyframes, [0, 5])
+
+    def test_stale_sidecar_is_rebuilt(self):
+        FrameIndex(np.arange(10)).save(sidecar_filename(self.path), source=self.path)
+        write_fmf(self.path, make_frames(12), np.arange(12))
+        self.assertIsNone(FrameIndex.load(sidecar_filename(self.path), source=self.path))
+
+    def test_seek_time(self):
+        frames = make_frames(10)
+        cap = MmapFMFCapture(self.path)
+        self.assertEqual(cap.seek_time(4.1), 5)
+        np.testing.assert_array_equal(cap.grab_next_frame(), frames[5])
+        self.assertEqual(cap.get_last_timestamp(), 4.25)
+        self.assertEqual(list(cap.get_frames_between(3.0, 3.5)), [0, 1, 2])
+        cap.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
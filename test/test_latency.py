@@ -0,0 +1,134 @@
+import time
+import unittest
+
+import numpy as np
+
+from microfview import Microfview, BlockingPlugin, NonBlockingPlugin
+from microfview.capture import CaptureBase
+from microfview.latency import LatencyRecorder, DROP_DRIVER, DROP_BUSY, DROP_CAPTURE_ERROR, DROP_SHED
+from microfview.testutils import StateFrameStore
+
+
+class _LiveCapture(CaptureBase):
+    """timestamps frames with time.time() like a live camera. The driver
+    skips frames 4 and 5, and grabbing fails twice."""
+
+    noncritical_errors = (IOError,)
+
+    def __init__(self, nframes=12):
+        self._numbers = [1, 2, 3, 6] + range(7, nframes + 1)
+        # after frame 3, no frame and then an error
+        self._failures = [None, IOError('failed')]
+        self._n = self._t = None
+
+    def grab_next_frame_blocking(self):
+        if (self._n == 3) and self._failures:
+            failure = self._failures.pop(0)
+            if failure is not None:
+                raise failure
+            return None
+        if not self._numbers:
+            raise EOFError('done')
+        self._n = self._numbers.pop(0)
+        self._t = time.time()
+        return np.zeros((4, 4), np.uint8)
+
+    def get_last_timestamp(self):
+        return self._t
+
+    def get_last_framenumber(self):
+        return self._n
+
+
+class _Sleeps(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        time.sleep(0.002)
+        return {'n': frame_number}
+
+
+class _Busy(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        time.sleep(0.02)
+        return {'busy': frame_number}
+
+
+class TestLatencyRecorder(unittest.TestCase):
+
+    def test_records(self):
+        r = LatencyRecorder(size=2)
+        for n in (1, 2, 3):
+            r.begin_frame(n, 10.0 + n, 10.5 + n)
+        self.assertEqual([rec['frame_number'] for rec in r.get_records()], [2, 3])
+        self.assertIsNone(r.get_record(1))
+        self.assertEqual(r.get_record(3)['capture_to_dispatch'], 0.5)
+
+        now = time.time()
+        r.begin_frame(4, now - 0.1, now)
+        r.store('a', 4, now - 0.1, now)
+        r.store('b', 4, now - 0.1, now)
+        # a result for an earlier dispatch of the same frame number
+        r.store('c', 4, now - 0.1, now - 1)
+        rec = r.get_record(4)
+        self.assertEqual(sorted(rec['dispatch_to_complete']), ['a', 'b'])
+        self.assertTrue(0.1 <= rec['capture_to_store'] < 0.5)
+        summary = r.get_summary()
+        self.assertEqual(summary['capture_to_dispatch']['count'], 4)
+        self.assertEqual(summary['dispatch_to_complete:a']['count'], 1)
+        self.assertEqual(summary['capture_to_store']['count'], 3)
+
+    def test_drops(self):
+        r = LatencyRecorder()
+        r.drop(DROP_DRIVER, 2)
+        r.drop(DROP_BUSY, plugin='p')
+        r.drop(DROP_SHED, 3, plugin='p')
+        drops, plugin_drops = r.get_drops()
+        self.assertEqual(drops, {DROP_DRIVER: 2, DROP_BUSY: 1, DROP_CAPTURE_ERROR: 0, DROP_SHED: 3})
+        self.assertEqual(plugin_drops['p'][DROP_SHED], 3)
+        text = r.format_summary()
+        self.assertIn('driver 2', text)
+        self.assertIn('p not processed: busy 1, shed 3', text)
+
+
+class TestLatencyInMainloop(unittest.TestCase):
+
+    def test_accounting(self):
+        fview = Microfview(_LiveCapture(), visible=False, debug=False)
+        store = StateFrameStore()
+        fview.attach_framestore(store)
+        blocking = _Sleeps()
+        busy = _Busy()
+        fview.attach_plugin(blocking)
+        fview.attach_plugin(busy)
+        latency = fview.attach_latency_recorder()
+        fview.main()
+
+        self.assertIs(fview.latency, latency)
+        self.assertEqual(latency.frames, 10)
+        drops, plugin_drops = latency.get_drops()
+        self.assertEqual(drops[DROP_DRIVER], 2)
+        self.assertEqual(drops[DROP_CAPTURE_ERROR], 2)
+        # the busy plugin could not keep up
+        self.assertTrue(drops[DROP_BUSY] > 0)
+        self.assertEqual(plugin_drops[busy.identifier][DROP_BUSY], drops[DROP_BUSY])
+
+        records = latency.get_records()
+        self.assertEqual([r['frame_number'] for r in records], [1, 2, 3] + range(6, 13))
+        for r in records:
+            self.assertTrue(r['dispatch_to_complete'][blocking.identifier] >= 0.002)
+            self.assertTrue(r['capture_to_store'] >= r['capture_to_dispatch'] >= 0)
+        busy_results = [r for r in records if busy.identifier in r['dispatch_to_complete']]
+        self.assertTrue(busy_results)
+        for r in busy_results:
+            self.assertTrue(r['dispatch_to_complete'][busy.identifier] >= 0.02)
+
+    def test_not_recorded_by_default(self):
+        fview = Microfview(_LiveCapture(), visible=False, debug=False)
+        fview.attach_framestore(StateFrameStore())
+        fview.attach_plugin(_Busy())
+        fview.main()
+        self.assertIsNone(fview.latency)
+        self.assertIsNone(fview._framestore._latency)
+
+
+if __name__ == '__main__':
+    unittest.main()
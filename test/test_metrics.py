@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+import urllib2
+
+from microfview.metrics import Histogram, Metrics, MetricsFileWriter, MetricsServer
+from microfview.testutils import get_test_instance, DummyPlugin
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_quantiles(self):
+        h = Histogram()
+        for i in range(1, 1001):
+            h.observe(i * 1e-3)
+        h.observe(float('nan'))
+        stats = h.get_stats()
+        self.assertEqual(stats['count'], 1000)
+        self.assertAlmostEqual(stats['mean'], 0.5005)
+        self.assertEqual(stats['max'], 1.0)
+        for q, v in ((0.5, 0.5), (0.95, 0.95), (0.99, 0.99)):
+            # accurate to the bucket width
+            self.assertTrue(v <= h.quantile(q) <= v * 1.13, (q, h.quantile(q)))
+
+    def test_out_of_range(self):
+        h = Histogram(min_value=1e-3, max_value=1)
+        h.observe(0)
+        h.observe(100)
+        self.assertEqual(h.quantile(1.0), 100)
+        h.reset()
+        self.assertEqual(h.count, 0)
+        self.assertTrue(h.quantile(0.5) != h.quantile(0.5))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def _metrics(self):
+        m = Metrics()
+        m.observe('Acquire', 0.001)
+        m.observe('Acquire', 0.003)
+        m.inc('frames_processed_total')
+        m.inc('frames_dropped_total', 2, cause='busy', plugin='a"b')
+        return m
+
+    def test_counters(self):
+        m = self._metrics()
+        self.assertEqual(m.get_counter('frames_dropped_total', cause='busy', plugin='a"b'), 2)
+        self.assertEqual(m.get_counter('frames_dropped_total'), 0)
+        stages, counters = m.get_stats()
+        self.assertEqual(stages['Acquire']['count'], 2)
+        self.assertEqual(counters['frames_processed_total'], 1)
+
+    def test_prometheus(self):
+        text = self._metrics().to_prometheus()
+        lines = text.splitlines()
+        self.assertIn('# TYPE microfview_stage_seconds summary', lines)
+        self.assertIn('microfview_stage_seconds_count{stage="Acquire"} 2', lines)
+        self.assertIn('microfview_stage_seconds_max{stage="Acquire"} 0.003', lines)
+        self.assertIn('microfview_frames_processed_total 1', lines)
+        self.assertIn('microfview_frames_dropped_total{cause="busy",plugin="a\\"b"} 2', lines)
+        self.assertEqual(len([l for l in lines if l.startswith('microfview_stage_seconds{')]), 3)
+
+    def test_file_writer(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'metrics.prom')
+            w = MetricsFileWriter(self._metrics(), path, interval=60)
+            w.start()
+            w.stop()
+            with open(path) as f:
+                self.assertIn('microfview_frames_processed_total 1', f.read())
+            self.assertEqual(os.listdir(tmpdir), ['metrics.prom'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_server(self):
+        s = MetricsServer(self._metrics(), 0)
+        s.start()
+        try:
+            url = 'http://%s:%d' % s.address
+            body = urllib2.urlopen(url + '/metrics').read()
+            self.assertIn('microfview_frames_processed_total 1', body)
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen, url + '/nope')
+        finally:
+            s.stop()
+
+
+class TestMetricsInMainloop(unittest.TestCase):
+
+    def test_stages_and_counters(self):
+        fview, store = get_test_instance(nframes=20)
+        plugin = DummyPlugin()
+        fview.attach_plugin(plugin)
+        metrics = fview.attach_metrics()
+        fview.main()
+        self.assertIs(fview.get_metrics(), metrics)
+        self.assertEqual(metrics.get_counter('frames_processed_total'), 20)
+        stages, _ = metrics.get_stats()
+        for stage in ('Acquire', 'TOTAL', 'framestore', plugin.identifier):
+            self.assertEqual(stages[stage]['count'], 20, stage)
+        self.assertTrue(stages['TOTAL']['max'] >= stages['Acquire']['max'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from microfview import NonBlockingPlugin
+from microfview.store import FrameStoreManager
+
+
+class _Gated(NonBlockingPlugin):
+    """processes a frame only when the test opens the gate"""
+
+    def __init__(self, **kwargs):
+        super(_Gated, self).__init__(**kwargs)
+        self.gate = threading.Semaphore(0)
+        self.processed = []
+
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        self.gate.acquire()
+        self.processed.append(frame_number)
+        return {'n': frame_number}
+
+
+class _Fails(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        raise ValueError('the worker thread dies')
+
+
+class TestQueuePolicies(unittest.TestCase):
+
+    def _push(self, plugin, numbers):
+        frame = np.zeros((4, 4), np.uint8)
+        rets = []
+        for n in numbers:
+            rets.append(plugin.push_frame(frame, n, n, float(n), time.time(), {}, self.storem))
+        return rets
+
+    def _finish(self, plugin):
+        # let the worker process whatever is queued, then wait for it to quit
+        for _ in range(10):
+            plugin.gate.release()
+        plugin.stop()
+        plugin.join(5)
+        self.assertFalse(plugin.is_alive())
+
+    def _run(self, **kwargs):
+        self.storem = FrameStoreManager()
+        plugin = _Gated(**kwargs)
+        plugin.start(None)
+        # frame 1 is taken by the worker, which then waits at the gate
+        self._push(plugin, [1])
+        while plugin._arg_queue.qsize():
+            time.sleep(0.001)
+        self._push(plugin, range(2, 8))
+        self._finish(plugin)
+        return plugin
+
+    def test_drop_newest(self):
+        plugin = self._run(queue_size=2, policy='drop_newest')
+        self.assertEqual(plugin.processed, [1, 2, 3])
+        self.assertEqual(plugin.get_stats()['dropped'], 4)
+
+    def test_replace_oldest(self):
+        plugin = self._run(queue_size=2, policy='replace_oldest')
+        self.assertEqual(plugin.processed, [1, 6, 7])
+        self.assertEqual(plugin.get_stats()['dropped'], 4)
+
+    def test_sample(self):
+        plugin = self._run(queue_size=4, policy='sample', sample_every=2)
+        self.assertEqual(plugin.processed, [1, 3, 5, 7])
+        # frames sampled out on purpose are not dropped
+        self.assertEqual(plugin.frames_dropped, 0)
+        self.assertEqual(plugin.get_stats()['sampled_out'], 3)
+
+    def test_block_with_timeout(self):
+        plugin = self._run(queue_size=1, policy='block', timeout=0.01)
+        self.assertEqual(plugin.processed, [1, 2])
+        self.assertEqual(plugin.frames_dropped, 5)
+
+    def test_block_waits_for_the_worker(self):
+        self.storem = FrameStoreManager()
+        plugin = _Gated(queue_size=1, policy='block', timeout=None)
+        plugin.start(None)
+        opener = threading.Thread(target=lambda: [plugin.gate.release() or time.sleep(0.01) for _ in range(5)])
+        opener.start()
+        self._push(plugin, range(1, 6))
+        opener.join()
+        self._finish(plugin)
+        self.assertEqual(plugin.processed, range(1, 6))
+
+    def test_block_does_not_wait_for_a_dead_worker(self):
+        self.storem = FrameStoreManager()
+        plugin = _Fails(queue_size=1, policy='block', timeout=None)
+        plugin.start(None)
+        self._push(plugin, [1])
+        plugin.join(5)
+        self.assertFalse(plugin.is_alive())
+        t0 = time.time()
+        self._push(plugin, [2, 3, 4])
+        self.assertLess(time.time() - t0, 1)
+        self.assertEqual(plugin.frames_dropped, 2)
+
+    def test_results_are_returned_once(self):
+        self.storem = FrameStoreManager()
+        plugin = _Gated()
+        plugin.start(None)
+        self.assertEqual(self._push(plugin, [1]), [False])
+        plugin.gate.release()
+        while not plugin.frames_processed:
+            time.sleep(0.001)
+        frame, state = self._push(plugin, [2])[0]
+        self.assertEqual(state, {'n': 1})
+        self.assertEqual(self._push(plugin, [3]), [False])
+        self._finish(plugin)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, NonBlockingPlugin, queue_size=0)
+        self.assertRaises(ValueError, NonBlockingPlugin, policy='nope')
+        self.assertRaises(ValueError, NonBlockingPlugin, policy='sample', sample_every=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
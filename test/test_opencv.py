@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import cv2
+import numpy as np
+
+from microfview import BlockingPlugin
+from microfview.plugin import MESSAGE_SEEK
+from microfview.capture import SeekError
+from microfview.capture.opencv import OpenCVCapture
+from microfview.capture.fmfmmap import MmapFMFCapture
+from microfview.capture.index import FrameIndex, sidecar_filename
+from microfview.testutils import get_test_instance
+
+from test_fmfmmap import write_fmf, make_frames
+
+N_FRAMES = 40
+
+
+def write_avi(path, n):
+    # frame i is filled with grey level 4*i, which survives compression
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+    if not writer.isOpened():
+        return False
+    for i in range(n):
+        writer.write(np.full((48, 64, 3), 4 * i, np.uint8))
+    writer.release()
+    return True
+
+
+def frame_id(frame):
+    return int(round(frame.mean() / 4.))
+
+
+class TestOpenCVSeek(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.avi')
+        if not write_avi(self.path, N_FRAMES):
+            self.skipTest('opencv can not write MJPG videos')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_seeks(self, cap):
+        for n in (30, 5, 6, 39, 0, 17):
+            cap.seek_frame(n)
+            frame = cap.grab_next_frame()
+            self.assertEqual(cap.get_last_framenumber(), n)
+            self.assertEqual(frame_id(frame), n)
+        cap.seek_frame(N_FRAMES)
+        self.assertRaises(EOFError, cap.grab_next_frame)
+        self.assertRaises(SeekError, cap.seek_frame, N_FRAMES + 1)
+        # wait for the index built in the background
+        self.assertEqual(len(cap.get_frame_index()), N_FRAMES)
+
+    def test_seek_is_exact(self):
+        cap = OpenCVCapture(self.path, is_file=True)
+        self._check_seeks(cap)
+        self.assertEqual(cap.frame_count, N_FRAMES)
+        self.assertTrue(os.path.exists(sidecar_filename(self.path)))
+
+    def test_seek_to_keyframes(self):
+        # every MJPG frame is a keyframe, store that in the cached index
+        cap = OpenCVCapture(self.path, is_file=True)
+        timestamps = cap.build_frame_index().timestamps
+        FrameIndex(timestamps, keyframes=np.arange(N_FRAMES)).save(sidecar_filename(self.path), source=self.path)
+        cap = OpenCVCapture(self.path, is_file=True)
+        self.assertIsNotNone(cap.get_frame_index().keyframes)
+        self._check_seeks(cap)
+
+    def test_skip_after_seek(self):
+        cap = OpenCVCapture(self.path, is_file=True)
+        cap.seek_frame(10)
+        self.assertTrue(cap.skip_next_frame())
+        frame = cap.grab_next_frame()
+        self.assertEqual(cap.get_last_framenumber(), 11)
+        self.assertEqual(frame_id(frame), 11)
+        cap.get_frame_index()
+
+    def test_first_seek_does_not_wait_for_the_index(self):
+        cap = OpenCVCapture(self.path, is_file=True)
+        build = cap.build_frame_index
+        started, release = threading.Event(), threading.Event()
+
+        def slow_build():
+            started.set()
+            release.wait(5)
+            return build()
+        cap.build_frame_index = slow_build
+        for n in (12, 4):
+            cap.seek_frame(n)
+            self.assertEqual(frame_id(cap.grab_next_frame()), n)
+        self.assertTrue(started.wait(5))
+        self.assertFalse(os.path.exists(sidecar_filename(self.path)))
+        release.set()
+        self.assertEqual(len(cap.get_frame_index()), N_FRAMES)
+        self.assertTrue(os.path.exists(sidecar_filename(self.path)))
+        # later seeks use the index
+        cap.seek_frame(30)
+        self.assertEqual(frame_id(cap.grab_next_frame()), 30)
+
+
+class _Device(object):
+    """a cv2.VideoCapture of a camera whose raw frames are not grey"""
+
+    def __init__(self, raw, bgr):
+        self.raw, self.bgr = raw, bgr
+        self.convert_rgb = 1
+
+    def set(self, prop, value):
+        self.convert_rgb = value
+        return True
+
+    def retrieve(self):
+        return True, self.bgr if self.convert_rgb else self.raw
+
+
+class TestRawGrey(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.avi')
+        if not write_avi(self.path, 1):
+            self.skipTest('opencv can not write MJPG videos')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_unknown_raw_format_is_converted(self):
+        cap = OpenCVCapture(self.path, is_file=True)
+        bgr = np.full((48, 64, 3), (10, 20, 30), np.uint8)
+        cap._capture = device = _Device(np.zeros(100, np.uint8), bgr)
+        cap.is_video_file = False
+        self.assertTrue(cap.set_grey(True))
+        grey = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        np.testing.assert_array_equal(cap._raw_to_grey(device.retrieve()[1]), grey)
+        # the device is asked for BGR frames from now on
+        self.assertEqual(device.convert_rgb, 1)
+        np.testing.assert_array_equal(cap._raw_to_grey(bgr), grey)
+
+
+class _SeeksOnce(BlockingPlugin):
+    def __init__(self, frame_number, target):
+        super(_SeeksOnce, self).__init__()
+        self._at = frame_number
+        self._target = target
+
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        if frame_number == self._at:
+            self.send_message(MESSAGE_SEEK, self._target)
+        return {'n': frame_number}
+
+
+class TestMainloopSeek(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.fmf')
+        write_fmf(self.path, make_frames(10), np.arange(10))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, target):
+        fview, store = get_test_instance(nframes=0, cam=MmapFMFCapture(self.path))
+        fview.attach_plugin(_SeeksOnce(3, target))
+        fview.main()
+        return [s['n'] for s in store.state]
+
+    def test_seek(self):
+        self.assertEqual(self._run(7), [0, 1, 2, 3, 7, 8, 9])
+
+    def test_failed_seek_continues(self):
+        self.assertEqual(self._run(100), range(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from microfview import get_capture_object
+from microfview.capture.opencv import OpenCVCapture, VideoDeviceReadError
+from microfview.capture.parallel import ParallelDecodeCapture
+
+from test_opencv import write_avi, frame_id
+
+N_FRAMES = 30
+
+
+class TestSplit(unittest.TestCase):
+
+    def test_segments_are_bounded(self):
+        # a long GOP is split anyway
+        segments = ParallelDecodeCapture._split(300, [0, 250], 64)
+        self.assertEqual(segments, [(0, 64), (64, 64), (128, 64), (192, 58), (250, 50)])
+
+    def test_segments_end_before_keyframes(self):
+        segments = ParallelDecodeCapture._split(100, [0, 30, 60, 90], 64)
+        self.assertEqual(segments, [(0, 60), (60, 40)])
+
+    def test_without_keyframes(self):
+        segments = ParallelDecodeCapture._split(10, None, 4)
+        self.assertEqual(segments, [(0, 4), (4, 4), (8, 2)])
+
+    def test_segments_cover_all_frames(self):
+        segments = ParallelDecodeCapture._split(97, [0, 13, 50, 51, 96], 16)
+        self.assertTrue(all(0 < count <= 16 for _, count in segments))
+        self.assertEqual(sum(count for _, count in segments), 97)
+        self.assertTrue(all(s0 + c0 == s1 for (s0, c0), (s1, _) in zip(segments, segments[1:])))
+
+
+class TestParallelDecode(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.avi')
+        if not write_avi(self.path, N_FRAMES):
+            self.skipTest('opencv can not write MJPG videos')
+        self.cap = get_capture_object(self.path, options_dict={'capture': {'decode_workers': 2, 'segment_length': 7},
+                                                               'transform': {}})
+
+    def tearDown(self):
+        self.cap.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_frames_in_order(self):
+        self.assertIsInstance(self.cap, ParallelDecodeCapture)
+        for n in range(N_FRAMES):
+            frame = self.cap.grab_next_frame()
+            self.assertEqual(self.cap.get_last_framenumber(), n)
+            self.assertEqual(frame_id(frame), n)
+        self.assertRaises(EOFError, self.cap.grab_next_frame)
+
+    def test_seek(self):
+        for n in (20, 3, 28, 8):
+            self.cap.seek_frame(n)
+            for i in (n, n + 1):
+                frame = self.cap.grab_next_frame()
+                self.assertEqual(self.cap.get_last_framenumber(), i)
+                self.assertEqual(frame_id(frame), i)
+
+
+class TestDecodeErrors(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.avi')
+        if not write_avi(self.path, N_FRAMES):
+            self.skipTest('opencv can not write MJPG videos')
+        self.grab = OpenCVCapture.grab_next_frame_blocking
+
+    def tearDown(self):
+        OpenCVCapture.grab_next_frame_blocking = self.grab
+        shutil.rmtree(self.tmpdir)
+
+    def _fail_at(self, n, error):
+        grab = self.grab
+
+        def fails(cap):
+            if cap._next_frame == n:
+                raise error
+            return grab(cap)
+        # the workers are forked with the failing method
+        OpenCVCapture.grab_next_frame_blocking = fails
+        cap = ParallelDecodeCapture(self.path, workers=2, segment_length=7)
+        try:
+            frames = []
+            while True:
+                cap.grab_next_frame()
+                frames.append(cap.get_last_framenumber())
+        except EOFError:
+            return frames
+        finally:
+            cap.close()
+
+    def test_errors_are_raised(self):
+        # opencv reports some decoding errors as the end of the file
+        for error in (VideoDeviceReadError(), EOFError('Truncated file at at frame: 10')):
+            self.assertRaises(IOError, self._fail_at, 10, error)
+
+    def test_end_of_the_last_segment(self):
+        self.assertEqual(self._fail_at(N_FRAMES - 1, EOFError('ended')), range(N_FRAMES - 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+
+from microfview import BlockingPlugin, PluginChain, PluginFinished
+from microfview.testutils import get_test_instance
+
+
+class _Stage(BlockingPlugin):
+    def __init__(self, i, finish_after=None):
+        super(_Stage, self).__init__()
+        self.i = i
+        self.finish_after = finish_after
+
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        if (self.finish_after is not None) and (frame_number > self.finish_after):
+            raise PluginFinished
+        time.sleep(0.005)
+        ret = {'n%d' % self.i: frame_number, 'thread%d' % self.i: threading.current_thread().name}
+        if self.i:
+            # the upstream result of the same frame
+            ret['saw%d' % self.i] = state.get('n%d' % (self.i - 1))
+        return ret
+
+
+class TestPipelinedChain(unittest.TestCase):
+
+    def test_results_are_in_frame_order(self):
+        fview, store = get_test_instance(nframes=40)
+        chain = PluginChain(_Stage(0), _Stage(1), _Stage(2), pipelined=True, queue_size=2)
+        fview.attach_plugin(chain)
+        fview.main()
+
+        results = [s for s in store.state if 'n2' in s]
+        self.assertTrue(results)
+        numbers = [s['n0'] for s in results]
+        self.assertEqual(numbers, sorted(set(numbers)))
+        for s in results:
+            self.assertEqual(s['n1'], s['n0'])
+            self.assertEqual(s['n2'], s['n0'])
+            self.assertEqual(s['saw1'], s['n0'])
+            self.assertEqual(s['saw2'], s['n0'])
+        # every stage has a thread of its own
+        threads = set((s['thread0'], s['thread1'], s['thread2']) for s in results)
+        self.assertEqual(len(threads), 1)
+        self.assertEqual(len(set(threads.pop())), 3)
+        self.assertEqual(len(chain.get_stage_times()), 3)
+
+    def test_plugin_finished(self):
+        # paced, so the chain finishes long before the last frame
+        fview, store = get_test_instance(fps=100, nframes=40)
+        fview.attach_plugin(PluginChain(_Stage(0), _Stage(1, finish_after=3), pipelined=True))
+        fview.main()
+        results = [s for s in store.state if 'n1' in s]
+        self.assertTrue(results)
+        self.assertTrue(all(s['n1'] <= 3 for s in results))
+        self.assertEqual(fview._plugins, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
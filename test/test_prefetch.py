@@ -0,0 +1,76 @@
+import time
+import unittest
+
+from microfview.capture.synth import SynthCapture
+from microfview.capture.prefetch import PrefetchCapture
+
+
+def _synth(nframes):
+    return SynthCapture('synth:class=dot:fps=0:nframes=%d:initial_x=100:initial_y=100' % nframes)
+
+
+def _read_all(cap):
+    numbers = []
+    try:
+        while True:
+            cap.grab_next_frame()
+            numbers.append(cap.get_last_framenumber())
+    except EOFError:
+        pass
+    return numbers
+
+
+class TestPrefetchCapture(unittest.TestCase):
+
+    def test_block_delivers_every_frame_in_order(self):
+        cap = PrefetchCapture(_synth(20), size=2, overflow='block')
+        try:
+            self.assertEqual(_read_all(cap), range(1, 21))
+            stats = cap.get_stats()
+            self.assertEqual(stats['delivered'], 20)
+            self.assertEqual(stats['dropped'], 0)
+            self.assertLessEqual(stats['max_occupancy'], 2)
+        finally:
+            cap.close()
+
+    def test_metadata_follows_the_frame(self):
+        direct = _synth(5)
+        expected = []
+        for _ in range(5):
+            direct.grab_next_frame()
+            expected.append(direct.get_last_metadata()['dot_position'])
+
+        cap = PrefetchCapture(_synth(5), size=4, overflow='block')
+        try:
+            for pos in expected:
+                cap.grab_next_frame()
+                self.assertEqual(cap.get_last_metadata()['dot_position'], pos)
+        finally:
+            cap.close()
+
+    def test_drop_oldest_keeps_the_latest_frames(self):
+        cap = PrefetchCapture(_synth(10), size=3, overflow='drop_oldest')
+        try:
+            cap.start()
+            # the reader fills the ring and then waits at the end of the stream
+            while cap.get_stats()['dropped'] < 7:
+                time.sleep(0.001)
+            self.assertEqual(_read_all(cap), [8, 9, 10])
+            self.assertEqual(cap.get_stats()['dropped'], 7)
+        finally:
+            cap.close()
+
+    def test_live_default_drops_oldest(self):
+        cap = PrefetchCapture(_synth(1))
+        try:
+            self.assertEqual(cap._overflow, 'drop_oldest')
+        finally:
+            cap.close()
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, PrefetchCapture, _synth(1), size=0)
+        self.assertRaises(ValueError, PrefetchCapture, _synth(1), overflow='nope')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import unittest
+
+from microfview import BlockingPlugin, PluginFinished
+from microfview.process import ProcessPlugin
+from microfview.store import FrameStore
+from microfview.testutils import get_test_instance
+
+
+class _Sums(ProcessPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'n': frame_number, 'pid': os.getpid(), 'sum': int(frame.sum())}
+
+
+class _Wrapped(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        if frame_number > 3:
+            raise PluginFinished
+        return {'n': frame_number, 'pid': os.getpid()}
+
+
+class _BufferStore(FrameStore):
+    uses_color = False
+
+    def __init__(self):
+        self.results = []
+
+    def store_state(self, callback_name, buf, frame_number, frame_count, frame_timestamp, now, state):
+        self.results.append((frame_number, int(buf.sum()), dict(state)))
+
+
+class TestProcessPlugin(unittest.TestCase):
+
+    def test_results_are_tagged_with_their_frame(self):
+        # noise makes every frame different
+        fview, _ = get_test_instance(nframes=20, synthdesc='noise=0.2')
+        store = _BufferStore()
+        fview.attach_framestore(store)
+        fview.attach_plugin(_Sums())
+        fview.main()
+        self.assertTrue(store.results)
+        numbers = [n for n, _, _ in store.results]
+        self.assertEqual(numbers, sorted(numbers))
+        for n, buf_sum, state in store.results:
+            self.assertEqual(state['n'], n)
+            self.assertNotEqual(state['pid'], os.getpid())
+            # the stored frame is the one the worker processed, even though
+            # its shared memory slot has been reused since
+            self.assertEqual(buf_sum, state['sum'])
+
+    def test_wrapped_plugin_finishes(self):
+        # paced, so the worker finishes long before the last frame
+        fview, store = get_test_instance(fps=100, nframes=30)
+        fview.attach_parallel_plugin(_Wrapped(), mode='process')
+        fview.main()
+        results = [s for s in store.state if 'pid' in s]
+        self.assertTrue(results)
+        self.assertTrue(all(s['n'] <= 3 for s in results))
+        self.assertTrue(all(s['pid'] != os.getpid() for s in results))
+        self.assertEqual(fview._plugins, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+
+import numpy as np
+
+from microfview import BlockingPlugin, NonBlockingPlugin
+from microfview.capture import CaptureBase, get_capture_object
+from microfview.capture.transform import ImageTransform
+from microfview.plugins.display import DisplayPlugin
+from microfview.plugins.transform import ExtractROIPlugin
+from microfview.testutils import get_test_instance
+
+ROI = [((10, 6), (30, 20))]
+
+
+def _image():
+    return np.arange(40 * 50 * 3, dtype=np.uint32).reshape(40, 50, 3).astype(np.uint8)
+
+
+class _Capture(CaptureBase):
+    """delivers the same image, cropped to a 4 pixel aligned region like
+    camera hardware would if roi is True"""
+
+    def __init__(self, roi):
+        self._roi = roi
+        self._region = None
+
+    def set_roi(self, x0, y0, x1, y1):
+        if not self._roi:
+            return None
+        x, y = x0 - x0 % 4, y0 - y0 % 4
+        self._region = x, y, x1 - x, y1 - y
+        return self._region
+
+    def grab_next_frame_blocking(self):
+        img = _image()
+        if self._region is not None:
+            x, y, w, h = self._region
+            img = img[y:y + h, x:x + w]
+        return img
+
+
+class _CropOnly(object):
+    def transform(self, img):
+        return img[:5, :5]
+
+
+class TestRoiPushDown(unittest.TestCase):
+
+    def _grab(self, hardware, **config):
+        cap = _Capture(hardware)
+        cap.attach_transform(ImageTransform(background=dict(roi=ROI, **config)))
+        return cap.grab_next_frame()
+
+    def test_hardware_crop_gives_the_same_frame(self):
+        for config in ({}, {'scale': 0.5}, {'grey': True}):
+            software = self._grab(False, **config)
+            self.assertEqual(software.shape[:2], (14 * config.get('scale', 1), 20 * config.get('scale', 1)))
+            np.testing.assert_array_equal(self._grab(True, **config), software)
+
+    def test_transform_matrix_is_in_full_frame_coordinates(self):
+        cap = _Capture(True)
+        t = ImageTransform(background={'roi': ROI, 'scale': 0.5})
+        cap.attach_transform(t)
+        cap.grab_next_frame()
+        np.testing.assert_allclose(t.get_transform_matrix().dot([4, 2, 1]), [18, 10])
+
+    def test_source_region_must_contain_the_roi(self):
+        t = ImageTransform(background={'roi': ROI})
+        self.assertRaises(ValueError, t.set_source_roi, 12, 0, 30, 30)
+
+    def test_transform_without_roi_support(self):
+        cap = _Capture(True)
+        cap.attach_transform(_CropOnly())
+        cap.set_frame_pool(None)
+        self.assertEqual(cap.grab_next_frame().shape, (5, 5, 3))
+
+
+class _Keeps(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        pass
+
+
+class _Threaded(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        pass
+
+
+class TestFrameTransform(unittest.TestCase):
+
+    def _capture(self, **config):
+        config = {'capture': {}, 'transform': {'background': dict(roi=ROI, scale=0.5, **config)}}
+        return get_capture_object('synth:class=dot:fps=0:nframes=3', options_dict=config)
+
+    def test_results_are_mapped_to_full_frame_coordinates(self):
+        cap = self._capture()
+        fview, store = get_test_instance(cam=cap, nframes=3)
+        fview.attach_plugin(ExtractROIPlugin(((2, 1), (8, 6))))
+        fview.main()
+        # the capture doubles and offsets by the roi, the plugin offsets
+        M = store.state[0]['FRAME_TRANSFORM']
+        np.testing.assert_allclose(M.dot([0, 0, 1]), [14, 8])
+        np.testing.assert_allclose(M.dot([1, 1, 1]), [16, 10])
+
+        # the display draws on the frame of the capture
+        display = DisplayPlugin('test', original_frame=True)
+        display.set_uid('0')
+        display.set_visible(False)
+        display.start(cap)
+        np.testing.assert_allclose(display._original_frame_transform({'FRAME_TRANSFORM': M}).dot([0, 0, 1]), [2, 1])
+        np.testing.assert_allclose(display._original_frame_transform({'FRAME_TRANSFORM': cap.get_transform_matrix()}),
+                                   [[1, 0, 0], [0, 1, 0]], atol=1e-6)
+
+    def test_output_is_not_reused_for_threaded_plugins(self):
+        for plugin, reused in ((_Keeps(), True), (_Threaded(), False)):
+            cap = self._capture(reuse_output=True)
+            fview, store = get_test_instance(cam=cap, nframes=3)
+            fview.attach_plugin(plugin)
+            fview.main()
+            self.assertEqual(cap.transform._reuse_output, reused)
+
+
+if __name__ == '__main__':
+    unittest.main()
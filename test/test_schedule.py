@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+import unittest
+
+from microfview import Microfview, BlockingPlugin, get_capture_object
+from microfview.schedule import PluginSchedule
+from microfview.testutils import StateFrameStore
+
+
+class _Plugin(BlockingPlugin):
+    def __init__(self, reads, writes, new_frame=False):
+        super(_Plugin, self).__init__()
+        self.reads = reads
+        self.writes = writes
+        self.new_frame = new_frame
+        self.return_frame = False
+
+    def get_requires(self):
+        return self.reads
+
+    def get_schema(self):
+        return dict((k, 'int') for k in self.writes)
+
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        # slow enough for the plugins of a level to overlap
+        time.sleep(0.01)
+        ret = dict((k, threading.current_thread().name) for k in self.writes)
+        for k in self.reads:
+            ret['saw_%s' % k] = k in state
+        if self.new_frame:
+            return frame.copy(), ret
+        return ret
+
+
+class _Barrier(_Plugin):
+    def get_requires(self):
+        return None
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestBuildLevels(unittest.TestCase):
+
+    def test_independent_plugins_share_a_level(self):
+        a, b = _Plugin((), ('a',)), _Plugin((), ('b',))
+        self.assertEqual(PluginSchedule.build_levels([a, b]), [[a, b]])
+
+    def test_dependencies(self):
+        a = _Plugin((), ('a',))
+        reads_a = _Plugin(('a',), ('c',))
+        other = _Plugin((), ('d',))
+        # writes a key an earlier plugin reads
+        overwrites_a = _Plugin((), ('a',))
+        self.assertEqual(PluginSchedule.build_levels([a, reads_a, other, overwrites_a]),
+                         [[a, other], [reads_a, overwrites_a]])
+
+    def test_barriers(self):
+        a, b = _Plugin((), ('a',)), _Plugin((), ('b',))
+        barrier = _Barrier((), ('x',))
+        returns_frame = _Plugin((), ('y',))
+        returns_frame.return_frame = True
+        self.assertEqual(PluginSchedule.build_levels([a, barrier, b, returns_frame]),
+                         [[a], [barrier], [b], [returns_frame]])
+
+    def test_no_workers_runs_everything_in_order(self):
+        a, b = _Plugin((), ('a',)), _Plugin((), ('b',))
+        self.assertEqual(PluginSchedule([a, b]).levels, [[a], [b]])
+
+
+class TestConcurrentMainloop(unittest.TestCase):
+
+    def _run(self, *plugins):
+        cam = get_capture_object('synth:class=dot:fps=0:nframes=5')
+        fview = Microfview(cam, visible=False, debug=False, stop_frame=5, plugin_workers=2)
+        store = StateFrameStore()
+        fview.attach_framestore(store)
+        for p in plugins:
+            fview.attach_plugin(p)
+        fview.main()
+        return store.state
+
+    def test_levels_run_concurrently(self):
+        results = self._run(_Plugin((), ('a',)), _Plugin((), ('b',)), _Plugin(('a', 'b'), ('c',)))
+        merged = {}
+        for s in results:
+            merged.update(s)
+        # a and b ran on different threads, c saw both results
+        self.assertNotEqual(merged['a'], merged['b'])
+        self.assertTrue(merged['saw_a'] and merged['saw_b'])
+
+    def test_returned_frames_are_reported(self):
+        handler = _Records()
+        logging.getLogger('microfview').addHandler(handler)
+        try:
+            self._run(_Plugin((), ('a',), new_frame=True), _Plugin((), ('b',)))
+        finally:
+            logging.getLogger('microfview').removeHandler(handler)
+        warnings = [m for m in handler.messages if 'returned a frame' in m]
+        self.assertEqual(len(warnings), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
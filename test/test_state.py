@@ -0,0 +1,109 @@
+import unittest
+
+import numpy as np
+
+from microfview import BlockingPlugin, NonBlockingPlugin, FrameState
+from microfview.state import StateLayout, FrozenStateError
+from microfview.testutils import get_test_instance
+
+
+class TestFrameState(unittest.TestCase):
+
+    def _state(self):
+        return FrameState(StateLayout.from_schemas({'p': {'a': 'int', 'b': 'int'}}), {'a': 1, 'extra': 2})
+
+    def test_mapping(self):
+        s = self._state()
+        self.assertEqual(dict(s), {'a': 1, 'extra': 2})
+        self.assertEqual(len(s), 2)
+        self.assertTrue('a' in s)
+        self.assertFalse('b' in s)
+        self.assertEqual(s.get('b', 3), 3)
+        self.assertRaises(KeyError, lambda: s['b'])
+        s.update(b=4)
+        del s['a']
+        self.assertRaises(KeyError, s.__delitem__, 'a')
+        self.assertEqual(dict(s), {'b': 4, 'extra': 2})
+        self.assertEqual(s.pop('extra'), 2)
+        self.assertEqual(dict(s), {'b': 4})
+
+    def test_array_values(self):
+        s = self._state()
+        s['a'] = np.zeros(3)
+        self.assertEqual(len(s), 2)
+        self.assertIs(s.get('a'), s['a'])
+
+    def test_copy_on_write(self):
+        s = self._state()
+        c = s.copy()
+        # nothing is copied until either is written to
+        self.assertIs(c._values, s._values)
+        c['a'] = 10
+        c['extra'] = 20
+        s['b'] = 30
+        self.assertEqual(dict(s), {'a': 1, 'b': 30, 'extra': 2})
+        self.assertEqual(dict(c), {'a': 10, 'extra': 20})
+
+    def test_freeze(self):
+        s = self._state()
+        c = s.copy().freeze()
+        self.assertTrue(c.frozen)
+        self.assertRaises(FrozenStateError, c.__setitem__, 'a', 2)
+        self.assertRaises(FrozenStateError, c.update, {'x': 1})
+        self.assertRaises(FrozenStateError, c.__delitem__, 'a')
+        # the original is still writable, and the frozen copy unchanged
+        s['a'] = 2
+        self.assertEqual(c['a'], 1)
+        self.assertFalse(c.copy().frozen)
+
+    def test_layout(self):
+        layout = StateLayout.from_schemas({'p': {'b': 'int', 'a': 'int'}, 'q': {'a': 'int'}})
+        self.assertEqual(layout.keys[:4], ['FRAME_ORIGINAL', 'FRAME_METADATA', 'FRAME_CACHE', 'KEY'])
+        self.assertEqual(sorted(layout.keys[4:]), ['a', 'b'])
+        self.assertEqual(len(layout), 6)
+
+
+class _Writes(BlockingPlugin):
+    def get_schema(self):
+        return {'upstream': 'int'}
+
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        # plugins may return a FrameState too
+        return FrameState(data={'upstream': frame_number})
+
+
+class _Reads(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        seen = state.get('upstream')
+        has_original = state.get('FRAME_ORIGINAL') is not None
+        # the worker's state is its own
+        state['upstream'] = -1
+        return {'seen': seen, 'n': frame_number, 'has_original': has_original}
+
+
+class _Checks(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'unchanged': state['upstream'] == frame_number}
+
+
+class TestStateInMainloop(unittest.TestCase):
+
+    def test_threaded_plugins_see_the_upstream_state(self):
+        fview, store = get_test_instance(nframes=20)
+        fview.attach_plugin(_Writes())
+        fview.attach_plugin(_Reads())
+        fview.attach_plugin(_Checks())
+        fview.main()
+        upstream = [s['upstream'] for s in store.state if 'upstream' in s]
+        self.assertEqual(upstream, range(1, 21))
+        read = [s for s in store.state if 'seen' in s]
+        self.assertTrue(read)
+        for s in read:
+            self.assertEqual(s['seen'], s['n'])
+            self.assertTrue(s['has_original'])
+        unchanged = [s['unchanged'] for s in store.state if 'unchanged' in s]
+        self.assertEqual(unchanged, [True] * 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
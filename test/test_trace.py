@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from microfview import trace, BlockingPlugin, NonBlockingPlugin, PluginChain
+from microfview.testutils import get_test_instance
+
+
+class _Sleeps(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        time.sleep(0.001)
+
+
+class _Stores(BlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        return {'n': frame_number}
+
+
+class _Worker(NonBlockingPlugin):
+    def process_frame(self, frame, frame_number, frame_count, frame_time, current_time, state):
+        time.sleep(0.002)
+        return {'n': frame_number}
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        trace.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def test_disabled(self):
+        self.assertFalse(trace.is_enabled())
+        with trace.span('nothing'):
+            pass
+        trace.complete('nothing', 0, 1)
+        self.assertIsNone(trace.dump())
+
+    def test_no_spans_when_disabled(self):
+        spans = []
+        span = trace.span
+        trace.span = lambda *args, **kwargs: spans.append(args) or span(*args, **kwargs)
+        try:
+            fview, store = get_test_instance(nframes=5)
+            fview.attach_plugin(_Stores())
+            fview.main()
+        finally:
+            trace.span = span
+        self.assertEqual(len(store.state), 5)
+        # not even the context managers are created on the mainloop
+        self.assertEqual(spans, [])
+
+    def test_spans(self):
+        tracer = trace.enable(size=3, dump_signal=None)
+        self.assertIs(trace.get_tracer(), tracer)
+        with trace.span('outer', cat='test', frame_number=1):
+            pass
+        t = threading.Thread(target=lambda: trace.complete('other', 1.0, 1.5), name='other thread')
+        t.start()
+        t.join()
+        events = tracer.get_events()
+        spans = [e for e in events if e['ph'] == 'X']
+        self.assertEqual([e['name'] for e in spans], ['outer', 'other'])
+        self.assertEqual(spans[0]['args'], {'frame_number': 1})
+        self.assertEqual(spans[1]['ts'], 1e6)
+        self.assertEqual(spans[1]['dur'], 0.5e6)
+        self.assertNotEqual(spans[0]['tid'], spans[1]['tid'])
+        names = dict((e['tid'], e['args']['name']) for e in events if e['ph'] == 'M')
+        self.assertEqual(names[spans[1]['tid']], 'other thread')
+
+        # only the last spans are kept
+        for i in range(5):
+            trace.complete(str(i), 0, 1)
+        self.assertEqual([e['name'] for e in tracer.get_events() if e['ph'] == 'X'], ['2', '3', '4'])
+
+    def test_dump(self):
+        path = os.path.join(self.tmpdir, 'trace.json')
+        trace.enable(path=path, dump_signal=None)
+        with trace.span('x', obj=object()):
+            pass
+        self.assertEqual(trace.dump(), path)
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual([e['name'] for e in data['traceEvents'] if e['ph'] == 'X'], ['x'])
+
+    def test_mainloop(self):
+        path = os.path.join(self.tmpdir, 'trace.json')
+        trace.enable(path=path, dump_signal=None)
+        fview, store = get_test_instance(nframes=10, synthdesc='noise=0.1')
+        worker = _Worker()
+        chain = PluginChain(_Sleeps(), _Sleeps(), pipelined=True)
+        fview.attach_plugin(worker)
+        fview.attach_plugin(chain)
+        fview.main()
+
+        # dumped when the mainloop stops
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        spans = [e for e in events if e['ph'] == 'X']
+        names = set(e['name'] for e in spans)
+        for name in ('Acquire', 'frame', 'store', 'begin_frame', 'end_frame', worker.identifier):
+            self.assertIn(name, names)
+        frames = [e['args']['frame_number'] for e in spans if e['name'] == 'frame']
+        self.assertEqual(frames, range(1, 11))
+        # the plugins process frames on threads of their own, the mainloop
+        # only pushes frames to them
+        tids = lambda name: set(e['tid'] for e in spans
+                                if (e['name'] == name) and ('frame_number' in e.get('args', {})))
+        mainloop = tids('frame')
+        self.assertEqual(len(mainloop), 1)
+        for p in chain._plugins + [worker]:
+            self.assertTrue(tids(p.identifier))
+            self.assertFalse(tids(p.identifier) & mainloop, p.identifier)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from microfview.frame import FramePool, SharedFrame
+from microfview.capture.transform import ImageTransform
+
+
+def _image(seed=0):
+    return np.random.RandomState(seed).randint(0, 256, (60, 80, 3)).astype(np.uint8)
+
+
+class TestImageTransform(unittest.TestCase):
+
+    def test_crop_scale_grey_match_the_unfused_steps(self):
+        img = _image()
+        for scale in (0.5, 1.0, 2.0):
+            t = ImageTransform(background={'roi': [((8, 4), (72, 52))], 'scale': scale, 'grey': True})
+            expected = img[4:52, 8:72]
+            expected = cv2.resize(expected, (int(64 * scale), int(48 * scale)),
+                                  interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+            expected = cv2.cvtColor(expected, cv2.COLOR_BGR2GRAY)
+            out = t.transform(img)
+            self.assertEqual(out.shape, expected.shape)
+            # grey conversion and scaling are done in a different order
+            self.assertLessEqual(np.abs(out.astype(int) - expected).max(), 1)
+
+    def test_mask(self):
+        img = np.full((40, 40), 200, np.uint8)
+        t = ImageTransform(background={'mask': [[(0, 0), (20, 0), (20, 20), (0, 20)]]})
+        out = t.transform(img)
+        self.assertEqual(out[5, 5], 0)
+        self.assertEqual(out[30, 30], 200)
+        # the mask is applied to every frame, not only the first
+        out = t.transform(img + 1)
+        self.assertEqual(out[5, 5], 0)
+        self.assertEqual(out[30, 30], 201)
+
+    def test_outputs_are_not_reused_by_default(self):
+        t = ImageTransform(background={'grey': True})
+        a = t.transform(_image(0))
+        kept = a.copy()
+        b = t.transform(_image(1))
+        self.assertFalse(np.may_share_memory(a, b))
+        np.testing.assert_array_equal(a, kept)
+
+    def test_reuse_output(self):
+        t = ImageTransform(background={'grey': True})
+        t.set_reuse_output(True)
+        a = t.transform(_image(0))
+        b = t.transform(_image(1))
+        self.assertIs(a, b)
+        t = ImageTransform(background={'grey': True, 'reuse_output': True})
+        self.assertIs(t.transform(_image(0)), t.transform(_image(1)))
+
+    def test_pool_output(self):
+        pool = FramePool()
+        t = ImageTransform(background={'scale': 0.5})
+        t.set_frame_pool(pool)
+        out = t.transform(_image())
+        self.assertIsInstance(out, SharedFrame)
+        self.assertFalse(out.flags.writeable)
+        out.release()
+        t.transform(_image())
+        self.assertEqual(pool.get_stats()['hits'], 1)
+
+    def test_geometry_follows_the_input(self):
+        t = ImageTransform(background={'scale': 0.5})
+        self.assertEqual(t.transform(_image()).shape, (30, 40, 3))
+        self.assertEqual(t.transform(np.zeros((20, 10), np.uint8)).shape, (10, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()